@@ -0,0 +1,61 @@
+'''
+Benchmark ChartPrinter image writing.
+
+Draws one chart per session of a synthetic M15 series with pivots, extrema and titles, serially in this process, the
+work each worker of a chart pool does per image.
+
+    python benchmarks/chart_images.py [charts] [output_dir]
+'''
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from bfin import prepare_chart_data
+from bfin.chart_printer import ChartPrinter
+from bfin.ohlc_analysis import OHLCAnalysis
+
+BARS_PER_DAY = 96
+
+
+def make_ohlc(bar_count, seed=3):
+    rng = np.random.default_rng(seed)
+    close = 1.1 + np.cumsum(rng.normal(0, 0.0004, bar_count))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) + rng.exponential(0.0003, bar_count)
+    low = np.minimum(open_, close) - rng.exponential(0.0003, bar_count)
+    index = pd.date_range('2022-01-03', periods=bar_count, freq='15min', tz='America/New_York')
+    return pd.DataFrame({'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': 1}, index=index)
+
+
+def write_charts(chart_printer, data, sessions, config, output_path):
+    start = time.perf_counter()
+    for number, (start_iloc, end_iloc) in enumerate(sessions):
+        data_chunk = data.iloc[start_iloc:end_iloc].copy()
+        chart_printer._add_pivot_columns(data_chunk, config)
+        chart_printer._save_chart_image(data_chunk, output_path / f'chart-{number}', 'EUR_USD', 'M15', 0.0001,
+                                        chart_printer._chunk_config(config, data_chunk))
+    return time.perf_counter() - start
+
+
+def main(chart_count=500, output_dir=None):
+    # 35 days of history ahead of the charts for the daily, weekly and monthly pivots
+    df = make_ohlc(BARS_PER_DAY * (chart_count + 40))
+    pivots = prepare_chart_data(df, False, False, False, False, True)
+    OHLCAnalysis.add_extrema_dataframe_to_data(df, OHLCAnalysis.generate_extrema_dataframe(df, 10))
+    data = df[df.index >= df.index[BARS_PER_DAY * 35]]
+
+    chart_printer = ChartPrinter()
+    sessions = chart_printer._break_into_sessions_by_ilocs(data)[:chart_count]
+    config = {'auto_titles': True, 'pivots': pivots}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_path = Path(output_dir or temp_dir)
+        output_path.mkdir(parents=True, exist_ok=True)
+        seconds = write_charts(chart_printer, data, sessions, config, output_path)
+    print(f'{len(sessions)} charts  {seconds:.1f}s  {1000 * seconds / len(sessions):.0f} ms per image')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500, sys.argv[2] if len(sys.argv) > 2 else None)
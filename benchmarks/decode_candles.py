@@ -0,0 +1,70 @@
+'''
+Benchmark decode_candles() against the json_normalize decoder it replaced.
+
+Both decoders must give the same frame for the sample payload in tests/data and for a full 5000 candle page built
+in the same format, then each is timed on the full page.
+
+    python benchmarks/decode_candles.py [candles] [repeats]
+'''
+
+import json
+import sys
+import timeit
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from bfin.oanda.historical import decode_candles, MAX_CANDLES_PER_REQUEST
+
+PAYLOAD_PATH = Path(__file__).parent.parent / 'tests' / 'data' / 'oanda_candles_eur_usd_m5.json'
+
+
+def legacy_load_dataframe(raw_body):
+    '''
+    OandaHistorical._load_dataframe() before decode_candles()
+    '''
+    df = pd.json_normalize(json.loads(raw_body), 'candles')
+    df.rename(columns={'time': 'Date', 'volume': 'Volume', 'mid.o': 'Open', 'mid.h': 'High', 'mid.l': 'Low',
+                       'mid.c': 'Close'}, inplace=True)
+    try:
+        df.set_index('Date', inplace=True)
+    except KeyError:
+        return None
+    df.index = pd.to_datetime(df.index)
+    df[['Open', 'High', 'Low', 'Close', 'Volume']] = df[['Open', 'High', 'Low', 'Close', 'Volume']].apply(
+        pd.to_numeric, errors='coerce')
+    return df
+
+
+def build_page(candle_count, seed=0):
+    '''
+    v20 candles response body with candle_count M1 mid candles
+    '''
+    rng = np.random.default_rng(seed)
+    times = pd.date_range('2022-01-03', periods=candle_count, freq='1min', tz='UTC')
+    close = 1.1 + np.cumsum(rng.normal(0, 0.0002, candle_count))
+    open_ = np.r_[1.1, close[:-1]]
+    high = np.maximum(open_, close) + rng.exponential(0.0001, candle_count)
+    low = np.minimum(open_, close) - rng.exponential(0.0001, candle_count)
+    volume = rng.integers(1, 400, candle_count)
+    return json.dumps({'instrument': 'EUR_USD', 'granularity': 'M1', 'candles': [{
+        'complete': True,
+        'volume': int(volume[number]),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S.000000000Z'),
+        'mid': {'o': f'{open_[number]:.5f}', 'h': f'{high[number]:.5f}', 'l': f'{low[number]:.5f}', 'c': f'{close[number]:.5f}'},
+    } for number, time in enumerate(times)]})
+
+
+def main(candle_count=MAX_CANDLES_PER_REQUEST, repeats=20):
+    for name, raw_body in (('sample payload', PAYLOAD_PATH.read_text()), (f'{candle_count} candles', build_page(candle_count))):
+        pd.testing.assert_frame_equal(legacy_load_dataframe(raw_body), decode_candles(raw_body))
+        print(f'{name}: frames equal')
+
+    raw_body = build_page(candle_count)
+    legacy_seconds = timeit.timeit(lambda: legacy_load_dataframe(raw_body), number=repeats) / repeats
+    decode_seconds = timeit.timeit(lambda: decode_candles(raw_body), number=repeats) / repeats
+    print(f'json_normalize  {legacy_seconds * 1000:8.2f} ms per page')
+    print(f'decode_candles  {decode_seconds * 1000:8.2f} ms per page  {legacy_seconds / decode_seconds:.1f}x')
+
+
+if __name__ == '__main__':
+    main(*(int(value) for value in sys.argv[1:3]))
@@ -124,6 +124,7 @@ setup(
     extras_require={  # Optional
         "dev": ["check-manifest"],
         "test": ["coverage"],
+        "fast": ["orjson", "numba"],
     },
 
     # To provide executable scripts, use entry points in preference to the
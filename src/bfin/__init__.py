@@ -10,14 +10,19 @@ from bfin.chart_printer import ChartPrinter
 import bfin.pivot_points as Pivots
 from bfin.ohlc_analysis import OHLCAnalysis
 from bfin.directories import CACHE_DIR
-from bfin.backtest.strategy_ma_cross import StrategyMACross
 from bfin.backtest.portfolio import Portfolio
 from tabulate import tabulate
 from bfin.backtest.optimizer import Optimizer
+from bfin.backtest.walk_forward import WalkForward
+from bfin.backtest.optimizer import init_datasets
+import bfin.backtest.spec as Spec
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import sys
 
 USE_MULTIPROCESSING = True
+DOWNLOAD_WORKERS = 4
 
 @click.group('bfin')
 @click.pass_context
@@ -66,7 +71,7 @@ def command_download(instrument, timeframe, startdate, enddate, save_to_file, fi
             return
         print('\n')
 
-    downloader = Downloader()
+    downloader = Downloader(max_workers=DOWNLOAD_WORKERS)
     try:
         df = downloader.download(instrument, timeframe, chart_start_date, chart_end_date)
     except RuntimeError as e:
@@ -81,6 +86,29 @@ def command_download(instrument, timeframe, startdate, enddate, save_to_file, fi
             print(df.to_markdown())
 
 
+def prepare_chart_data(df_ohlc, no_moving_averages, pivot_day, pivot_week, pivot_month, pivot_all):
+    '''
+    Add the moving averages the chart command draws to df_ohlc, returns the pivots it draws as a list of
+    Pivots.PivotLevels, ChartPrinter adds their columns to each chart's bars
+    '''
+    if not no_moving_averages:
+        df_ohlc['ma_50'] = ta.sma(df_ohlc['Close'], 50)
+        df_ohlc['ma_100'] = ta.sma(df_ohlc['Close'], 100)
+        df_ohlc['ma_200'] = ta.sma(df_ohlc['Close'], 200)
+
+    pivots = []
+    if pivot_all or pivot_day:
+        pivots_daily = Pivots.calculate_daily_pivots_from_intraday(df_ohlc)
+        pivots.append(Pivots.PivotLevels(pivots_daily, 'Day'))
+    if pivot_all or pivot_week:
+        pivots_weekly = Pivots.calculate_weekly_pivots_from_intraday(df_ohlc)
+        pivots.append(Pivots.PivotLevels(pivots_weekly, 'Wk'))
+    if pivot_all or pivot_month:
+        pivots_monthly = Pivots.calculate_monthly_pivots_from_intraday(df_ohlc)
+        pivots.append(Pivots.PivotLevels(pivots_monthly, 'Mn'))
+    return pivots
+
+
 @click.command('chart')
 @click.argument('instrument', required=True)
 @click.argument('timeframe', required=True)
@@ -102,10 +130,13 @@ def command_chart(instrument, timeframe, startdate, enddate, output, bars_per_ch
         Create chart images for an instrument
 
         \b
-        instrument      EUR_USD, ^GSPC, FRED/NROU
-        timeframe       M1, M5, M15, M30, H1, H4, D, W, M
+        instrument      EUR_USD, ^GSPC, FRED/NROU, or a comma separated list EUR_USD,GBP_USD,USD_JPY
+        timeframe       M1, M5, M15, M30, H1, H4, D, W, M, or a comma separated list M15,H1
         startdate       YYYY-MM-DD
         enddate         YYYY-MM-DD
+
+        Every instrument is charted in every timeframe. The data is downloaded concurrently and all the images are
+        rendered by one shared process pool.
     '''
 
     try:
@@ -119,8 +150,11 @@ def command_chart(instrument, timeframe, startdate, enddate, output, bars_per_ch
     if not output_path.is_dir():
         print(f'Output path must be an existing directory. [{output_path}]')
 
-    if timeframe.upper() in ('D', 'W', 'M') and not bars_per_chart:
-        print(f'For daily, weekly, or monthly charts the "--bars" option must be used.')
+    instruments = [value.strip() for value in instrument.split(',') if value.strip()]
+    timeframes = [value.strip() for value in timeframe.split(',') if value.strip()]
+    for use_timeframe in timeframes:
+        if use_timeframe.upper() in ('D', 'W', 'M') and not bars_per_chart:
+            print('For daily, weekly, or monthly charts the "--bars" option must be used.')
     try:
         chart_start_date, chart_end_date = Utils.parse_start_and_end_dates(startdate, enddate)
     except RuntimeError as e:
@@ -131,30 +165,16 @@ def command_chart(instrument, timeframe, startdate, enddate, output, bars_per_ch
     if extrema_period is not None and extrema_period > max_period:
         max_period = extrema_period
 
-    data_start_date = Utils.get_padded_date(chart_start_date, timeframe, max_period, pivot_day, pivot_week, pivot_month)
-    downloader = Downloader()
-    try:
-        df_ohlc = downloader.download(instrument, timeframe, data_start_date, chart_end_date)
-    except RuntimeError as e:
-        print(f'Error downloading data, {e}')
-        return
-
-    if not no_moving_averages:
-        df_ohlc['ma_50'] = ta.sma(df_ohlc['Close'], 50)
-        df_ohlc['ma_100'] = ta.sma(df_ohlc['Close'], 100)
-        df_ohlc['ma_200'] = ta.sma(df_ohlc['Close'], 200)
+    # Each instrument downloads in its own thread, so the total number of concurrent requests stays at DOWNLOAD_WORKERS
+    jobs = [(use_instrument, use_timeframe) for use_instrument in instruments for use_timeframe in timeframes]
+    downloader = Downloader(max_workers=DOWNLOAD_WORKERS if len(jobs) == 1 else 1)
 
-    if pivot_all or pivot_day:
-        pivots_daily = Pivots.calculate_daily_pivots_from_intraday(df_ohlc)
-        Pivots.add_interday_to_intraday(df_ohlc, pivots_daily, 'Day')
-    if pivot_all or pivot_week:
-        pivots_weekly = Pivots.calculate_weekly_pivots_from_intraday(df_ohlc)
-        Pivots.add_interday_to_intraday(df_ohlc, pivots_weekly, 'Wk')
-    if pivot_all or pivot_month:
-        pivots_monthly = Pivots.calculate_monthly_pivots_from_intraday(df_ohlc)
-        Pivots.add_interday_to_intraday(df_ohlc, pivots_monthly, 'Mn')
+    def download_job(job):
+        data_start_date = Utils.get_padded_date(chart_start_date, job[1], max_period, pivot_day, pivot_week, pivot_month)
+        return downloader.download(job[0], job[1], data_start_date, chart_end_date)
 
-    chart = ChartPrinter()
+    with ThreadPoolExecutor(max_workers=min(DOWNLOAD_WORKERS, len(jobs))) as executor:
+        futures = {job: executor.submit(download_job, job) for job in jobs}
 
     kwargs = {
         'b_use_multiprocessing': USE_MULTIPROCESSING,
@@ -170,27 +190,52 @@ def command_chart(instrument, timeframe, startdate, enddate, output, bars_per_ch
         print('using session us')
         kwargs['session_lines'] = 'us'
 
-    if extrema_period:
-        kwargs['extrema'] =  OHLCAnalysis.generate_extrema_dataframe(df_ohlc, extrema_period)
-
     if bars_per_chart:
         kwargs['bars_per_chart'] = bars_per_chart
 
     if titles:
         kwargs['auto_titles'] = True
 
+    chart = ChartPrinter()
+    pool = multiprocessing.Pool() if USE_MULTIPROCESSING and len(jobs) > 1 else None
     try:
-        chart.write_html(
-            df_ohlc,
-            output_path,
-            instrument,
-            timeframe,
-            Utils.pip_size(instrument),
-            **kwargs,
-        )
-    except RuntimeError as e:
-        print(f'Error generating charts for {instrument} - [{e}]')
-        return
+        for use_instrument, use_timeframe in jobs:
+            try:
+                df_ohlc = futures[(use_instrument, use_timeframe)].result()
+            except RuntimeError as e:
+                print(f'Error downloading data for {use_instrument} {use_timeframe}, {e}')
+                continue
+
+            pivots = prepare_chart_data(df_ohlc, no_moving_averages, pivot_day, pivot_week, pivot_month, pivot_all)
+            job_kwargs = dict(kwargs, pivots=pivots)
+            if extrema_period:
+                job_kwargs['extrema'] = OHLCAnalysis.generate_extrema_dataframe(df_ohlc, extrema_period)
+            if pool is not None:
+                job_kwargs['pool'] = pool
+
+            try:
+                chart.write_html(
+                    df_ohlc,
+                    output_path,
+                    use_instrument,
+                    use_timeframe,
+                    Utils.pip_size(use_instrument),
+                    **job_kwargs,
+                )
+            except RuntimeError as e:
+                print(f'Error generating charts for {use_instrument} {use_timeframe} - [{e}]')
+                continue
+
+        if pool is not None:
+            print(f'Writing images to {output_path}...')
+            try:
+                chart.wait_for_charts()
+            except RuntimeError as e:
+                print(f'Error generating charts - [{e}]')
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
 
 
@@ -227,7 +272,7 @@ def command_analysis(instrument, timeframe, startdate, enddate, extrema, ohlc_ra
         return
 
     data_start_date = Utils.get_padded_date(chart_start_date, timeframe, extrema if extrema else 0)
-    downloader = Downloader()
+    downloader = Downloader(max_workers=DOWNLOAD_WORKERS)
     try:
         df_ohlc = downloader.download(instrument, timeframe, data_start_date, chart_end_date)
     except RuntimeError as e:
@@ -253,13 +298,81 @@ def command_analysis(instrument, timeframe, startdate, enddate, extrema, ohlc_ra
 
 
 
+def prompt_strategy():
+    '''
+    Ask for a strategy when none was given on the command line
+    '''
+    click.echo('Strategies')
+    strategies = list(Spec.STRATEGIES.values())
+    for number, strategy in enumerate(strategies, start=1):
+        click.echo(f'   {number}. {strategy.STRATEGY_NAME}')
+    strategy_number = click.prompt('\nEnter Strategy Number', type=int)
+    if not 1 <= strategy_number <= len(strategies):
+        raise RuntimeError(f'Unknown strategy [{strategy_number}]')
+    return strategies[strategy_number - 1]
+
+
+def download_job_datasets(jobs, longest_period):
+    '''
+    Download the data of every job once, jobs with the same instrument, timeframe and dates share a dataset.
+    Sets job['dataset_id'] and returns {dataset_id: df_ohlc}.
+    '''
+    downloader = Downloader(max_workers=DOWNLOAD_WORKERS)
+    datasets = {}
+    for job in jobs:
+        data_start_date = Utils.get_padded_date(job['start_date'], job['timeframe'], longest_period(job))
+        dataset_id = f'{job["instrument"]}-{job["timeframe"]}-{data_start_date.isoformat()}-{job["end_date"].isoformat()}'
+        if dataset_id not in datasets:
+            print(f'Download {job["instrument"]} {job["timeframe"]} start: {data_start_date}, Chart start: {job["start_date"]}')
+            datasets[dataset_id] = downloader.download(job['instrument'], job['timeframe'], data_start_date, job['end_date'])
+        job['dataset_id'] = dataset_id
+    return datasets
+
+
+def print_optimizer_results(job, strategy, kwargs, counter, total_data):
+    print(f'\nOptimizer results for: {strategy.STRATEGY_NAME} {job["instrument"]} {job["timeframe"]}')
+    print(f'Initial equity: {kwargs["portfolio"]["initial_equity"]}')
+    print(f'Generators: {kwargs["generators"]["periods"]}\n')
+
+    analysis_list = [o['analysis'] for o in total_data.values()]
+    df_analysis = pd.concat(analysis_list)
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.precision', 4):
+        sort_column = 'equity' if 'equity' in df_analysis else 'profit_total'
+        print(df_analysis.sort_values(sort_column, ascending=False).head(15).fillna(0).to_markdown())
+
+
+def print_walk_forward_results(job, strategy, kwargs, df_windows, df_positions):
+    print(f'\nWalk forward results for: {strategy.STRATEGY_NAME} {job["instrument"]} {job["timeframe"]}')
+    print(f'Initial equity: {kwargs["portfolio"]["initial_equity"]}')
+    print(f'Generators: {kwargs["generators"]["periods"]}\n')
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.precision', 4):
+        print(df_windows.fillna(0).to_markdown())
+    if len(df_positions) > 0 and 'equity' in df_positions:
+        print(f'\nOut-of-sample trades: {len(df_positions)}, final equity: {df_positions.iloc[-1]["equity"]:.2f}')
+
+
 @click.command('optimize')
-@click.argument('instrument', required=True)
-@click.argument('timeframe', required=True)
-@click.argument('startdate', required=True)
+@click.argument('instrument', required=False)
+@click.argument('timeframe', required=False)
+@click.argument('startdate', required=False)
 @click.argument('enddate', required=False)
+@click.option('--spec', 'spec_file', type=str, help='YAML or JSON spec file listing the strategy, generators, portfolio and jobs')
+@click.option('--strategy', 'strategy_name', type=str, help=f'Strategy name: {", ".join(Spec.STRATEGIES)}')
+@click.option('--generator', 'str_generators', type=str, multiple=True,
+              help='Period generator "start, stop, step", repeat shortest to longest')
 @click.option('--topoff_equity', is_flag=True, help='Top off equity if less than initial')
-def command_optimize(instrument, timeframe, startdate, enddate, topoff_equity):
+@click.option('--engine', type=click.Choice(['portfolio', 'batch']), required=False,
+              help='"batch" evaluates whole blocks of the grid at once, strategies without stop/take only [default: portfolio]')
+@click.option('--search', type=click.Choice(['grid', 'random', 'latin_hypercube', 'halving']), required=False,
+              help='Search strategy, all but grid need --budget [default: grid]')
+@click.option('--budget', type=int, required=False, help='Number of combinations to evaluate for sampled searches')
+@click.option('--seed', type=int, required=False, help='Random seed for sampled searches')
+@click.option('--in_sample_bars', type=int, required=False, help='Walk forward, bars in each optimized window')
+@click.option('--out_sample_bars', type=int, required=False, help='Walk forward, bars traded after each window')
+@click.option('--anchored', is_flag=True, help='Walk forward, in-sample windows all begin at startdate')
+@click.option('--checkpoint', is_flag=True, help=f'Store finished combinations in {CACHE_DIR}, reruns skip them')
+def command_optimize(instrument, timeframe, startdate, enddate, spec_file, strategy_name, str_generators, topoff_equity,
+                     engine, search, budget, seed, in_sample_bars, out_sample_bars, anchored, checkpoint):
     '''
         Optimize a strategy against market data
 
@@ -268,78 +381,183 @@ def command_optimize(instrument, timeframe, startdate, enddate, topoff_equity):
         timeframe       M1, M5, M15, M30, H1, H4, D, W, M
         startdate       YYYY-MM-DD
         enddate         YYYY-MM-DD
+
+        With --spec the jobs come from the spec file and the arguments are not used, options given on the command
+        line override the spec. Without --strategy or --generator the missing values are prompted for.
     '''
+    cli_options = {name: value for name, value in (('engine', engine), ('search', search), ('budget', budget),
+                   ('seed', seed), ('in_sample_bars', in_sample_bars), ('out_sample_bars', out_sample_bars),
+                   ('anchored', anchored), ('checkpoint', checkpoint)) if value is not None and value is not False}
     try:
-        chart_start_date, chart_end_date = Utils.parse_start_and_end_dates(startdate, enddate)
+        if spec_file:
+            jobs = Spec.build_jobs(Spec.load_spec_file(spec_file))
+        else:
+            if not instrument or not timeframe or not startdate:
+                print('instrument, timeframe and startdate are required without --spec')
+                return
+            chart_start_date, chart_end_date = Utils.parse_start_and_end_dates(startdate, enddate)
+            click.echo(f'Optimizing {instrument} {timeframe} {chart_start_date} {chart_end_date}\n')
+            strategy = Spec.get_strategy(strategy_name) if strategy_name else prompt_strategy()
+            if str_generators:
+                generators = {f'gen_{number}': Utils.decode_generator_string(value) for number, value in enumerate(str_generators)}
+            else:
+                click.echo('\nRequired parameters: generator_short, generator_long\n')
+                click.echo('Generator format is "<start>, <stop>, <step>"')
+                gen_short = Utils.decode_generator_string(click.prompt('Enter short period generator', type=str))
+                gen_long = Utils.decode_generator_string(click.prompt('Enter long period generator', type=str))
+                generators = dict(gen_short=gen_short, gen_long=gen_long)
+            jobs = [{
+                'instrument': instrument,
+                'timeframe': timeframe,
+                'start_date': chart_start_date,
+                'end_date': chart_end_date,
+                'strategy': strategy,
+                'generators': {'periods': generators},
+                'portfolio': dict(Spec.DEFAULT_PORTFOLIO),
+                'options': {},
+            }]
     except RuntimeError as e:
         print(e)
         return
 
-    click.echo(f'Optimizing {instrument} {timeframe} {chart_start_date} {chart_end_date}\n')
-    click.echo(f'Strategies')
-    click.echo(f'   1. Moving Average Cross')
-    strategy_number = click.prompt(f'\nEnter Strategy Number', type=int)
-    if strategy_number == 1:
-        click.echo(f'\nRequired parameters: generator_short, generator_long\n')
-        click.echo(f'Generator format is "<start>, <stop>, <step>"')
-        str_gen_short = click.prompt(f'Enter short period generator', type=str)
-        gen_short = Utils.decode_generator_string(str_gen_short)
-        str_gen_long = click.prompt(f'Enter long period generator', type=str)
-        gen_long = Utils.decode_generator_string(str_gen_long)
-        generators = dict(gen_short=gen_short, gen_long=gen_long)
-        strategy = StrategyMACross
-    else:
-        print(f'Unknown strategy [{strategy_number}]')
-        return
+    for job in jobs:
+        job['options'] = {**job['options'], **cli_options}
+        if job['generators'] is None:
+            print(f'Job {job["instrument"]} {job["timeframe"]} has no generators')
+            return
+        if topoff_equity:
+            job['portfolio']['b_top_off_equity'] = True
+        if job['options'].get('search', 'grid') != 'grid' and job['options'].get('budget') is None:
+            print(f'Search "{job["options"]["search"]}" needs a budget')
+            return
+        b_walk_forward = 'in_sample_bars' in job['options'] or 'out_sample_bars' in job['options']
+        if b_walk_forward and ('in_sample_bars' not in job['options'] or 'out_sample_bars' not in job['options']):
+            print('Walk forward needs both in_sample_bars and out_sample_bars')
+            return
 
-    kwargs = {
-        'strategy': strategy,
-        'use_multiprocessing': USE_MULTIPROCESSING,
-        'start_date': chart_start_date,
-        'pip_size': Utils.pip_size(instrument),
-        'generators': {
-            'periods': generators,
-        },
-        'portfolio': {
-            'initial_equity': 10000,
-            'margin_ratio': 25,
-            'top_off_equity': False,
-        }
-    }
+    def longest_period(job):
+        return max([200] + [generator[1] for generator in job['generators']['periods'].values()])
 
-    data_start_date = Utils.get_padded_date(chart_start_date, timeframe, 200)
-    print(f'\nDownload start: {data_start_date}, Chart start: {chart_start_date}')
-    downloader = Downloader()
     try:
-        df_ohlc = downloader.download(instrument, timeframe, data_start_date, chart_end_date)
+        datasets = download_job_datasets(jobs, longest_period)
     except RuntimeError as e:
         print(f'Error downloading data, {e}')
         return
 
-    optimizer = Optimizer(df_ohlc, instrument, timeframe, **kwargs)
-    counter, total_data = optimizer.optimize()
+    # Every job shares one pool, the workers receive all datasets once when the pool starts
+    pool = multiprocessing.Pool(initializer=init_datasets, initargs=(datasets,)) if USE_MULTIPROCESSING else None
+    try:
+        for job in jobs:
+            strategy = job['strategy']
+            kwargs = {
+                'strategy': strategy,
+                'use_multiprocessing': USE_MULTIPROCESSING,
+                'start_date': job['start_date'],
+                'pip_size': Utils.pip_size(job['instrument']),
+                'generators': job['generators'],
+                'results': 'metrics',
+                'portfolio': job['portfolio'],
+                **job['options'],
+            }
+            df_ohlc = datasets[job['dataset_id']]
+            if 'in_sample_bars' in job['options']:
+                try:
+                    df_windows, df_positions = WalkForward(df_ohlc, job['instrument'], job['timeframe'], **kwargs).run()
+                except RuntimeError as e:
+                    print(f'Error running walk forward, {e}')
+                    continue
+                print_walk_forward_results(job, strategy, kwargs, df_windows, df_positions)
+                continue
+
+            if pool is not None:
+                kwargs.update(pool=pool, dataset_id=job['dataset_id'])
+            try:
+                optimizer = Optimizer(df_ohlc, job['instrument'], job['timeframe'], **kwargs)
+            except RuntimeError as e:
+                print(f'Error creating optimizer, {e}')
+                continue
+            counter, total_data = optimizer.optimize()
+            print_optimizer_results(job, strategy, kwargs, counter, total_data)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def run_backtest(job, df_ohlc, topoff_equity, output_path, bars_per_chart):
+    instrument = job['instrument']
+    timeframe = job['timeframe']
+    chart_start_date = job['start_date']
+    period_short, period_long = job['periods']
+    initial_equity = job['portfolio']['initial_equity']
+    b_top_off_equity = topoff_equity or bool(job['portfolio'].get('b_top_off_equity', False))
 
-    print(f'\nOptimizer results for: {strategy.STRATEGY_NAME}')
-    print(f'Initial equity: {kwargs["portfolio"]["initial_equity"]}')
-    print(f'Generators: {generators}\n')
+    print('Backtesting...\n')
+    print(f'\nInitial Equity: {initial_equity}\n')
 
-    analysis_list = [o['analysis'] for o in total_data.values()]
-    df_analysis = pd.concat(analysis_list)
-    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.precision', 4):
-        sort_column = 'equity' if 'equity' in df_analysis else 'profit_total'
-        print(df_analysis.sort_values(sort_column, ascending=False).head(15).fillna(0).to_markdown())
+    kwargs = {'periods': (period_short, period_long), 'start_date': chart_start_date }
+    strategy = job['strategy'](instrument, df_ohlc, **kwargs)
+    signals = strategy.generate_signals()
+    kwargs = {
+        'margin_ratio': float(job['portfolio']['margin_ratio']),
+        'b_top_off_equity': b_top_off_equity,
+        'start_date': chart_start_date,
+        'b_use_multiprocessing': USE_MULTIPROCESSING,
+        'datetime_format': '%m-%d %H:%M',
+        'ylim_adjust': 0,
+    }
 
+    portfolio = Portfolio(instrument, df_ohlc, signals, **kwargs)
+    positions = portfolio.generate_positions()
+    equity_curve = portfolio.generate_equity_curve(positions, initial_equity, b_top_off_equity=b_top_off_equity)
+    positions_equity = Portfolio.merge_equity_curve_and_positions(equity_curve, positions)
+    headers, table, floatfmt = Portfolio.positions_to_table(positions_equity, instrument)
+    print(tabulate(table, headers=headers, floatfmt=floatfmt))
+    total_pips = positions['pips_profit'].sum()
+    print(f'\nTotal pips profit: {total_pips}\n')
+    winners = len(positions[positions['pips_profit'] > 0])
+    losers = len(positions) - winners
+    print(f'Trades: {len(positions)}, winners {winners}, losers {losers}')
+
+    df_ohlc['ma_100'] = ta.sma(df_ohlc['Close'], period_short)
+    df_ohlc['ma_200'] = ta.sma(df_ohlc['Close'], period_long)
+
+    if output_path:
+        kwargs['signals'] = {
+            'df_signals': signals,
+            'marker_entries': True,
+            'marker_exits': True,
+        }
+        if bars_per_chart:
+            kwargs['bars_per_chart'] = bars_per_chart
+        try:
+            chart = ChartPrinter()
+            chart.write_html(
+                df_ohlc,
+                output_path,
+                instrument,
+                timeframe,
+                Utils.pip_size(instrument),
+                **kwargs,
+            )
+        except RuntimeError as e:
+            print(f'Error generating charts for {instrument} - [{e}]')
+            return
 
 
 @click.command('backtest')
-@click.argument('instrument', required=True)
-@click.argument('timeframe', required=True)
-@click.argument('startdate', required=True)
+@click.argument('instrument', required=False)
+@click.argument('timeframe', required=False)
+@click.argument('startdate', required=False)
 @click.argument('enddate', required=False)
+@click.option('--spec', 'spec_file', type=str, help='YAML or JSON spec file listing the strategy, periods, portfolio and jobs')
+@click.option('--strategy', 'strategy_name', type=str, help=f'Strategy name: {", ".join(Spec.STRATEGIES)}')
+@click.option('--periods', 'str_periods', type=str, help='Strategy periods "short, long"')
 @click.option('--topoff_equity', is_flag=True, help='Top off equity if less than initial')
 @click.option('--output', type=str, help='Output directory to write the chart')
 @click.option('--bars', 'bars_per_chart', type=int, help='Number of bars per chart on the output chart, if omitted split on sessions.')
-def command_backtest(instrument, timeframe, startdate, enddate, topoff_equity, output, bars_per_chart):
+def command_backtest(instrument, timeframe, startdate, enddate, spec_file, strategy_name, str_periods, topoff_equity,
+                     output, bars_per_chart):
     '''
         Backtest a strategy against market data
 
@@ -348,13 +566,10 @@ def command_backtest(instrument, timeframe, startdate, enddate, topoff_equity, o
         timeframe       M1, M5, M15, M30, H1, H4, D, W, M
         startdate       YYYY-MM-DD
         enddate         YYYY-MM-DD
-    '''
-    try:
-        chart_start_date, chart_end_date = Utils.parse_start_and_end_dates(startdate, enddate)
-    except RuntimeError as e:
-        print(e)
-        return
 
+        With --spec the jobs come from the spec file and the arguments are not used. Without --strategy or
+        --periods the missing values are prompted for.
+    '''
     if output is not None:
         try:
             output_path = Path(output).expanduser()
@@ -365,86 +580,59 @@ def command_backtest(instrument, timeframe, startdate, enddate, topoff_equity, o
             print(f'Output path must be an existing directory. [{output_path}]')
             return
     else:
+        output_path = None
         if bars_per_chart is not None:
-            print(f'Cannot use --bars without --output')
+            print('Cannot use --bars without --output')
             return
 
-    click.echo(f'Backtesting {instrument} {timeframe} {chart_start_date} {chart_end_date}\n')
-    click.echo(f'Strategies')
-    click.echo(f'   1. Moving Average Cross')
-    strategy_number = click.prompt(f'\nEnter Strategy Number', type=int)
-    if strategy_number == 1:
-        print(f'\nRequired parameters: period_short, period_long\n')
-        period_short = click.prompt(f'Enter period_short', type=int)
-        period_long = click.prompt(f'Enter period_long', type=int)
-    else:
-        print(f'Unknown strategy [{strategy_number}]')
+    try:
+        if spec_file:
+            jobs = Spec.build_jobs(Spec.load_spec_file(spec_file))
+        else:
+            if not instrument or not timeframe or not startdate:
+                print('instrument, timeframe and startdate are required without --spec')
+                return
+            chart_start_date, chart_end_date = Utils.parse_start_and_end_dates(startdate, enddate)
+            click.echo(f'Backtesting {instrument} {timeframe} {chart_start_date} {chart_end_date}\n')
+            strategy = Spec.get_strategy(strategy_name) if strategy_name else prompt_strategy()
+            if str_periods:
+                try:
+                    periods = tuple(int(value) for value in str_periods.replace('(', '').replace(')', '').split(','))
+                except ValueError:
+                    raise RuntimeError(f'Could not parse periods "{str_periods}"')
+            else:
+                print('\nRequired parameters: period_short, period_long\n')
+                period_short = click.prompt('Enter period_short', type=int)
+                period_long = click.prompt('Enter period_long', type=int)
+                periods = (period_short, period_long)
+                print('\n')
+            jobs = [{
+                'instrument': instrument,
+                'timeframe': timeframe,
+                'start_date': chart_start_date,
+                'end_date': chart_end_date,
+                'strategy': strategy,
+                'periods': periods,
+                'portfolio': dict(Spec.DEFAULT_PORTFOLIO),
+            }]
+    except RuntimeError as e:
+        print(e)
         return
-    print('\n')
 
-    data_start_date = Utils.get_padded_date(chart_start_date, timeframe, 200)
-    print(f'Download start: {data_start_date}, Chart start: {chart_start_date}')
-    downloader = Downloader()
+    for job in jobs:
+        if job['periods'] is None or len(job['periods']) != 2:
+            print(f'Job {job["instrument"]} {job["timeframe"]} needs 2 periods')
+            return
+
     try:
-        df_ohlc = downloader.download(instrument, timeframe, data_start_date, chart_end_date)
+        datasets = download_job_datasets(jobs, lambda job: 200)
     except RuntimeError as e:
         print(f'Error downloading data, {e}')
         return
 
-    initial_equity = 10000
-
-    print('Backtesting...\n')
-    print(f'\nInitial Equity: {initial_equity}\n')
-
-    if strategy_number == 1:
-        kwargs = {'periods': (period_short, period_long), 'start_date': chart_start_date }
-        strategy = StrategyMACross(instrument, df_ohlc, **kwargs)
-        signals = strategy.generate_signals()
-        kwargs = {
-            'margin_ratio': 25.0,
-            'b_top_off_equity': False,
-            'start_date': chart_start_date,
-            'b_use_multiprocessing': USE_MULTIPROCESSING,
-            'datetime_format': '%m-%d %H:%M',
-            'ylim_adjust': 0,            
-        }
-
-        portfolio = Portfolio(instrument, df_ohlc, signals, **kwargs)
-        positions = portfolio.generate_positions()
-        equity_curve = portfolio.generate_equity_curve(positions, initial_equity, b_top_off_equity=topoff_equity)
-        positions_equity = Portfolio.merge_equity_curve_and_positions(equity_curve, positions)
-        headers, table, floatfmt = Portfolio.positions_to_table(positions_equity, instrument)
-        print(tabulate(table, headers=headers, floatfmt=floatfmt))
-        total_pips = positions['pips_profit'].sum()
-        print(f'\nTotal pips profit: {total_pips}\n')
-        winners = len(positions[positions['pips_profit'] > 0])
-        losers = len(positions) - winners
-        print(f'Trades: {len(positions)}, winners {winners}, losers {losers}')
-
-        df_ohlc['ma_100'] = ta.sma(df_ohlc['Close'], period_short)
-        df_ohlc['ma_200'] = ta.sma(df_ohlc['Close'], period_long)
-
-        if output:
-            kwargs['signals'] = {
-                'df_signals': signals,
-                'marker_entries': True,
-                'marker_exits': True,
-            }
-            if bars_per_chart:
-                kwargs['bars_per_chart'] = bars_per_chart
-            try:
-                chart = ChartPrinter()
-                chart.write_html(
-                    df_ohlc,
-                    output_path,
-                    instrument,
-                    timeframe,
-                    Utils.pip_size(instrument),
-                    **kwargs,
-                )
-            except RuntimeError as e:
-                print(f'Error generating charts for {instrument} - [{e}]')
-                return
+    for job in jobs:
+        print(f'\n{job["strategy"].STRATEGY_NAME} {job["instrument"]} {job["timeframe"]} {job["periods"]}')
+        run_backtest(job, datasets[job['dataset_id']].copy(), topoff_equity, output_path, bars_per_chart)
 
 
 run_bfin.add_command(command_chart)
@@ -463,7 +651,7 @@ def main():
 
     if not os.path.exists(v20_path):
         print(f'\nA valid configuration file was not found at "{v20_path}"')
-        print(f'An account and access token from Oanda\'s REST-V20 API are required. (https://developer.oanda.com/)\n')
+        print('An account and access token from Oanda\'s REST-V20 API are required. (https://developer.oanda.com/)\n')
         response = input('Would you like to create a configuration file? (y/n)> ')
         response = response.lower()
         if response == 'y' or response == 'yes':
@@ -9,3 +9,22 @@ class Strategy(object):
         containing the signals to go long, short or hold (1, -1 or 0)."""
         raise NotImplementedError("Should implement generate_signals()!")
 
+    @classmethod
+    def precompute(cls, df_ohlc, period_values):
+        """Called once by the optimizer before a search. Returns a dict of extra kwargs passed to every
+        strategy built on df_ohlc, so data shared between parameter combinations is only computed once.
+        period_values holds every distinct period the search can use."""
+        return {}
+
+    @classmethod
+    def precompute_window(cls, precomputed, df_window, period_values):
+        """Kwargs for strategies built on df_window, a contiguous part of the data precomputed came from.
+        The default computes them again on df_window, strategies with sliceable caches reuse precomputed."""
+        return cls.precompute(df_window, period_values)
+
+    @classmethod
+    def evaluate_batch(cls, instrument, df_ohlc, periods_list, portfolio_settings=None, **kwargs):
+        """Evaluates every entry of periods_list without building per combination signals or positions.
+        Returns a DataFrame of Portfolio.analyze_positions() rows in the order of periods_list. kwargs are the
+        ones returned by precompute()."""
+        raise RuntimeError(f'{cls.__name__}.evaluate_batch() this strategy has no batch engine')
@@ -0,0 +1,123 @@
+'''
+Batched backtester for StrategyMACross.
+
+Evaluates many (short, long) period pairs at once as 2-D numpy arrays with one row per pair, and returns the same
+metrics as Portfolio.analyze_positions() without building per pair signals or positions dataframes.
+Trades follow Portfolio.generate_positions(): a run of the same non zero signal lasting at least 2 bars, opened at
+the close of its first bar and closed at the close of the bar after its last. Stop loss and take profit are not
+supported by this engine.
+'''
+
+import numpy as np
+import pandas as pd
+import bfin.backtest.equity as Equity
+import bfin.myutil as Utils
+
+ANALYSIS_COLUMNS = ['trades', 'win', 'profit_total', 'profit_mean', 'winners_mean', 'losers_mean']
+
+# Upper bound on the number of signal matrix elements held at once, pairs are processed in batches below this size
+MAX_BATCH_ELEMENTS = 20_000_000
+
+
+def signal_matrix(sma_short, sma_long, periods_short):
+    '''
+    Signals for a batch of pairs, sma_short/sma_long are (pairs x bars) arrays. Matches StrategyMACross.generate_signals(),
+    1 while the short average is above the long, -1 while below, and 0 before bar period_short or when equal.
+    '''
+    signals = (sma_short > sma_long).astype(np.int8) - (sma_short < sma_long).astype(np.int8)
+    signals[np.arange(signals.shape[1])[np.newaxis, :] < np.asarray(periods_short)[:, np.newaxis]] = 0
+    return signals
+
+
+def find_trades(signals, close):
+    '''
+    Run length segmentation of a (pairs x bars) signal matrix. Returns arrays (rows, starts, ends, direction) for every
+    trade of every row, ordered by row and then by start.
+    '''
+    pairs, bars = signals.shape
+    previous = np.zeros_like(signals)
+    previous[:, 1:] = signals[:, :-1]
+    flat_starts = np.flatnonzero(signals != previous)
+    rows = flat_starts // bars
+    starts = flat_starts % bars
+    # A run ends the bar before the next change in the same row, or on the last bar
+    ends = np.full(len(starts), bars - 1, dtype=np.int64)
+    b_same_row = rows[1:] == rows[:-1]
+    ends[:-1][b_same_row] = starts[1:][b_same_row] - 1
+    direction = signals[rows, starts].astype(np.float64)
+
+    # Drop flat runs, single bar runs, and the run on the last bar which has no next close
+    keep = (direction != 0) & (ends - starts >= 1) & (ends < bars - 1)
+    rows, starts, ends, direction = rows[keep], starts[keep], ends[keep], direction[keep]
+    keep = ~np.isnan(close[starts]) & ~np.isnan(close[ends + 1])
+    return rows[keep], starts[keep], ends[keep], direction[keep]
+
+
+def evaluate_grid(instrument, df_ohlc, pairs, ma_cache, portfolio_settings=None):
+    '''
+    pairs               list of (period_short, period_long)
+    ma_cache            MovingAverageCache of df_ohlc['Close'] holding every period used in pairs
+    portfolio_settings  Portfolio kwargs, initial_equity adds an equity column
+    Returns a dataframe with one row per pair, in the order of pairs, with the Portfolio.analyze_positions() columns.
+    '''
+    portfolio_settings = portfolio_settings if portfolio_settings else {}
+    if portfolio_settings.get('stop_loss') is not None or portfolio_settings.get('take_profit') is not None:
+        raise RuntimeError('BatchMACross.evaluate_grid() does not support stop_loss or take_profit')
+    for column in ('High', 'Low', 'Close'):
+        if df_ohlc[column].isnull().any():
+            raise RuntimeError(f'BatchMACross.evaluate_grid() {column} contains missing values')
+
+    close = df_ohlc['Close'].to_numpy(dtype=np.float64)
+    bars = len(close)
+    initial_equity = portfolio_settings.get('initial_equity')
+    if initial_equity:
+        if Utils.is_instrument_forex(instrument):
+            home_currency = portfolio_settings.get('home_currency', 'USD')
+            margin_ratio = portfolio_settings.get('margin_ratio', 1.0)
+        else:
+            home_currency = None
+            margin_ratio = None
+        mode = Equity.unit_mode(instrument, margin_ratio=margin_ratio, home_currency=home_currency)
+        b_top_off_equity = portfolio_settings.get('b_top_off_equity', False)
+        b_use_numba = portfolio_settings.get('b_use_numba', True)
+
+    results = []
+    batch_size = max(1, MAX_BATCH_ELEMENTS // max(1, bars))
+    for batch_start in range(0, len(pairs), batch_size):
+        batch = pairs[batch_start:batch_start + batch_size]
+        periods_short = [pair[0] for pair in batch]
+        try:
+            sma_short = ma_cache.matrix[[ma_cache.rows[period] for period in periods_short]]
+            sma_long = ma_cache.matrix[[ma_cache.rows[pair[1]] for pair in batch]]
+        except KeyError as e:
+            raise RuntimeError(f'BatchMACross.evaluate_grid() period {e} was not precomputed')
+        signals = signal_matrix(sma_short, sma_long, periods_short)
+        rows, starts, ends, direction = find_trades(signals, close)
+
+        price_opened = close[starts]
+        price_closed = close[ends + 1]
+        pips_profit = np.where(direction == 1, price_closed - price_opened, price_opened - price_closed)
+        row_bounds = np.searchsorted(rows, np.arange(len(batch) + 1))
+
+        for row in range(len(batch)):
+            lo, hi = row_bounds[row], row_bounds[row + 1]
+            profits = pips_profit[lo:hi]
+            winners = profits[profits > 0]
+            losers = profits[profits <= 0]
+            data = [
+                len(profits),
+                len(winners),
+                profits.sum(),
+                profits.mean() if len(profits) else np.nan,
+                winners.mean() if len(winners) else np.nan,
+                losers.mean() if len(losers) else np.nan,
+            ]
+            if initial_equity:
+                equity = Equity.compound_equity(direction[lo:hi], price_opened[lo:hi], price_closed[lo:hi],
+                                                initial_equity, mode, margin_ratio=margin_ratio,
+                                                b_top_off_equity=b_top_off_equity, b_use_numba=b_use_numba)
+                data.append(equity[-1])
+            results.append(data)
+
+    columns = ANALYSIS_COLUMNS + (['equity'] if initial_equity else [])
+    return pd.DataFrame(data=results, columns=columns)
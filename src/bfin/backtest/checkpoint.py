@@ -0,0 +1,121 @@
+'''
+On-disk store of finished optimizer cells.
+
+Every evaluated combination is appended to a SQLite table keyed by a run key and the combination's settings. The run
+key hashes everything that changes the result of a cell other than its own settings: the evaluated data, the
+instrument and timeframe, the strategy, the portfolio settings and the engine and search settings. A rerun of the
+same search, or of a wider one, reads the finished cells back and only evaluates the rest.
+'''
+
+import hashlib
+import json
+import math
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+from bfin.directories import CACHE_DIR
+
+COMMIT_SECONDS = 5.0        # Finished cells are committed at least this often
+
+
+def dataset_fingerprint(df):
+    '''
+    sha1 of the index and price columns of an OHLC dataframe
+    '''
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(df.index.asi8).tobytes())
+    for column in ('Open', 'High', 'Low', 'Close'):
+        if column in df:
+            digest.update(column.encode())
+            digest.update(np.ascontiguousarray(df[column].to_numpy(dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+
+def _to_json_value(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class OptimizerCheckpoint(object):
+    FILE_NAME = 'optimizer_checkpoint.sqlite'
+
+    def __init__(self, path=None):
+        '''
+        path    SQLite file, default CACHE_DIR/optimizer_checkpoint.sqlite
+        '''
+        self.path = path if path is not None else CACHE_DIR / self.FILE_NAME
+        self.connection = sqlite3.connect(str(self.path), timeout=60)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS cells (
+            run_key TEXT NOT NULL,
+            settings TEXT NOT NULL,
+            task TEXT NOT NULL,
+            score REAL,
+            columns TEXT NOT NULL,
+            analysis TEXT NOT NULL,
+            PRIMARY KEY (run_key, settings))''')
+        self.connection.commit()
+        self.last_commit = time.monotonic()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    @staticmethod
+    def run_key(df, instrument, timeframe, strategy, portfolio_settings, b_warm_indicators=False, search_settings=None):
+        '''
+        Hash of everything a cell result depends on besides its settings. b_warm_indicators marks runs whose
+        indicators were sliced from a longer series, they differ from ones computed on df alone near its start.
+        search_settings is a dict of the engine and search kwargs, cells of a random or halving search are not reused
+        by a grid search or by one with another budget or seed.
+        '''
+        description = json.dumps({
+            'data': dataset_fingerprint(df),
+            'instrument': instrument,
+            'timeframe': timeframe,
+            'strategy': getattr(strategy, 'STRATEGY_NAME', strategy.__name__),
+            'portfolio': portfolio_settings or {},
+            'warm_indicators': b_warm_indicators,
+            'search': search_settings or {},
+        }, sort_keys=True, default=str)
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def load(self, run_key):
+        '''
+        Returns {settings: work} for every finished cell of run_key, work in the Optimizer work dict format
+        '''
+        finished = {}
+        rows = self.connection.execute('SELECT settings, task, score, columns, analysis FROM cells WHERE run_key = ?',
+                                       (run_key,))
+        for settings, task, score, columns, analysis in rows:
+            periods, trading = json.loads(task)
+            values = [np.nan if value is None else value for value in json.loads(analysis)]
+            finished[settings] = {
+                'periods': tuple(periods),
+                'trading': trading,
+                'analysis': pd.DataFrame([values], columns=json.loads(columns)),
+                'score': np.nan if score is None else score,
+            }
+        return finished
+
+    def add(self, run_key, settings, work):
+        '''
+        Append a finished cell, commits are batched every COMMIT_SECONDS
+        '''
+        analysis = work['analysis']
+        values = [_to_json_value(value) for value in analysis.to_dict('records')[0].values()]
+        values = [None if isinstance(value, float) and math.isnan(value) else value for value in values]
+        score = _to_json_value(work['score'])
+        self.connection.execute('INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?, ?, ?)', (
+            run_key,
+            settings,
+            json.dumps([list(work['periods']), work['trading']]),
+            None if isinstance(score, float) and math.isnan(score) else score,
+            json.dumps(list(analysis.columns)),
+            json.dumps(values),
+        ))
+        if time.monotonic() - self.last_commit >= COMMIT_SECONDS:
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self.last_commit = time.monotonic()
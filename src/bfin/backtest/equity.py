@@ -0,0 +1,87 @@
+'''
+Compounding equity curve over arrays of closed trades.
+
+The relationship between the instrument and the home currency is resolved once per run with unit_mode(), then
+compound_equity() runs the trade by trade recurrence of myutil.trade_units_available() / trade_equity_result() over
+plain arrays, compiled with numba when it is installed.
+'''
+
+import math
+import numpy as np
+import bfin.myutil as Utils
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+UNITS_NON_FOREX = 0     # units = equity / price_opened
+UNITS_HOME_BASE = 1     # home currency is the first currency, units = equity * margin_ratio
+UNITS_HOME_QUOTE = 2    # home currency is the second currency, units = equity * margin_ratio / price_opened
+
+
+def unit_mode(instrument, margin_ratio=None, home_currency=None):
+    '''
+    Returns the UNITS_* mode for an instrument, raising the same errors as myutil.trade_units_available()
+    '''
+    if not Utils.is_instrument_forex(instrument):
+        return UNITS_NON_FOREX
+    if margin_ratio is None or home_currency is None:
+        raise RuntimeError(f'Equity.unit_mode() passed a forex instrument {instrument} but margin_ratio or home_currency is missing.')
+    first_currency, second_currency = Utils.forex_split_instrument_to_currencies(instrument)
+    if home_currency.upper() == first_currency:
+        return UNITS_HOME_BASE
+    elif home_currency.upper() == second_currency:
+        return UNITS_HOME_QUOTE
+    raise NotImplementedError('Equity.unit_mode() need implementation for non-home currency trade')
+
+
+def _compound_loop(direction, price_opened, price_closed, initial_equity, mode, margin_ratio, b_top_off_equity, equity_out):
+    equity = initial_equity
+    equity_out[0] = equity
+    for i in range(len(direction)):
+        if b_top_off_equity and equity < initial_equity:
+            equity += initial_equity - equity
+        if equity <= 0 or equity != equity:
+            units = 0
+        elif mode == UNITS_HOME_BASE:
+            units = math.floor(equity * margin_ratio)
+        elif mode == UNITS_HOME_QUOTE:
+            units = math.floor(equity * margin_ratio / price_opened[i])
+        else:
+            units = math.floor(equity / price_opened[i])
+        value_at_open = price_opened[i] * units
+        value_at_close = price_closed[i] * units
+        if mode == UNITS_HOME_BASE:
+            equity += direction[i] * (value_at_close - value_at_open) / price_closed[i]
+        else:
+            equity += direction[i] * (value_at_close - value_at_open)
+        equity_out[i + 1] = equity
+
+
+_compound_compiled = njit(cache=True)(_compound_loop) if njit is not None else None
+
+
+def compound_equity(direction, price_opened, price_closed, initial_equity, mode, margin_ratio=None,
+                    b_top_off_equity=False, b_use_numba=True):
+    '''
+    Returns an array of len(direction) + 1 equity values, the initial equity followed by the equity after each trade.
+    If b_top_off_equity is set, equity below initial_equity is topped back up before each trade.
+    '''
+    direction = np.asarray(direction, dtype=np.float64)
+    price_opened = np.asarray(price_opened, dtype=np.float64)
+    price_closed = np.asarray(price_closed, dtype=np.float64)
+    if np.any((price_opened == 0) | np.isnan(price_opened)):
+        raise RuntimeError('Equity.compound_equity() passed zero or or missing price_opened')
+    margin_ratio = 1.0 if margin_ratio is None else float(margin_ratio)
+
+    equity_out = np.empty(len(direction) + 1, dtype=np.float64)
+    if b_use_numba and _compound_compiled is not None:
+        _compound_compiled(direction, price_opened, price_closed, float(initial_equity), mode, margin_ratio,
+                           bool(b_top_off_equity), equity_out)
+    else:
+        # Plain python floats are much faster than numpy scalars in an interpreted loop
+        _compound_loop(direction.tolist(), price_opened.tolist(), price_closed.tolist(), float(initial_equity), mode,
+                       margin_ratio, bool(b_top_off_equity), equity_out)
+    return equity_out
@@ -0,0 +1,98 @@
+'''
+First-touch stop loss / take profit search over flat High/Low arrays.
+
+Every trade covers the bars starts[i]..ends[i] (inclusive). The exit search runs for all trades at once, either as a
+single numpy pass over the concatenated trade bars, or with a compiled loop when numba is installed.
+'''
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+EXIT_NONE = 0
+EXIT_STOP = 1
+EXIT_TAKE = 2
+
+
+def _first_touch_loop(high, low, starts, ends, direction, stop_prices, take_prices, exit_offsets, exit_types):
+    for i in range(len(starts)):
+        exit_offsets[i] = -1
+        exit_types[i] = EXIT_NONE
+        for offset in range(ends[i] - starts[i] + 1):
+            bar = starts[i] + offset
+            if direction[i] == 1:
+                hit_stop = low[bar] <= stop_prices[i]
+                hit_take = high[bar] >= take_prices[i]
+            else:
+                hit_stop = high[bar] >= stop_prices[i]
+                hit_take = low[bar] <= take_prices[i]
+            if hit_stop:
+                exit_offsets[i] = offset
+                exit_types[i] = EXIT_STOP
+                break
+            if hit_take:
+                exit_offsets[i] = offset
+                exit_types[i] = EXIT_TAKE
+                break
+
+
+_first_touch_compiled = njit(cache=True)(_first_touch_loop) if njit is not None else None
+
+
+def _first_touch_numpy(high, low, starts, ends, direction, stop_prices, take_prices):
+    lengths = ends - starts + 1
+    trade_offsets = np.r_[0, np.cumsum(lengths)[:-1]]
+    trade_ids = np.repeat(np.arange(len(starts)), lengths)
+    bar_offsets = np.arange(lengths.sum()) - trade_offsets[trade_ids]
+    bars = starts[trade_ids] + bar_offsets
+    b_long = direction[trade_ids] == 1
+    bar_high = high[bars]
+    bar_low = low[bars]
+    bar_stop = stop_prices[trade_ids]
+    bar_take = take_prices[trade_ids]
+
+    no_touch = np.iinfo(np.int64).max
+    hit_stop = np.where(b_long, bar_low <= bar_stop, bar_high >= bar_stop)
+    hit_take = np.where(b_long, bar_high >= bar_take, bar_low <= bar_take)
+    first_stop = np.minimum.reduceat(np.where(hit_stop, bar_offsets, no_touch), trade_offsets)
+    first_take = np.minimum.reduceat(np.where(hit_take, bar_offsets, no_touch), trade_offsets)
+
+    exit_types = np.full(len(starts), EXIT_NONE, dtype=np.int8)
+    exit_types[first_take < no_touch] = EXIT_TAKE
+    exit_types[(first_stop < no_touch) & (first_stop <= first_take)] = EXIT_STOP
+    exit_offsets = np.where(exit_types == EXIT_STOP, first_stop, np.where(exit_types == EXIT_TAKE, first_take, -1))
+    return exit_offsets.astype(np.int64), exit_types
+
+
+def find_first_touch(high, low, starts, ends, direction, stop_prices, take_prices, b_use_numba=True):
+    '''
+    Find the exit bar of each trade.
+        high, low       float arrays of bar prices
+        starts, ends    int arrays, first and last bar of each trade
+        direction       1 for long, -1 for short
+        stop_prices     stop loss price per trade, NaN for no stop
+        take_prices     take profit price per trade, NaN for no take
+    Returns (exit_offsets, exit_types). exit_offsets is the bar offset from the trade start of the first touch, or -1.
+    exit_types is EXIT_NONE, EXIT_STOP or EXIT_TAKE. If both levels are touched on the same bar the stop is assumed
+    to have been hit first.
+    '''
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if len(starts) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int8)
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    direction = np.asarray(direction, dtype=np.float64)
+    stop_prices = np.asarray(stop_prices, dtype=np.float64)
+    take_prices = np.asarray(take_prices, dtype=np.float64)
+
+    if b_use_numba and _first_touch_compiled is not None:
+        exit_offsets = np.empty(len(starts), dtype=np.int64)
+        exit_types = np.empty(len(starts), dtype=np.int8)
+        _first_touch_compiled(high, low, starts, ends, direction, stop_prices, take_prices, exit_offsets, exit_types)
+        return exit_offsets, exit_types
+    return _first_touch_numpy(high, low, starts, ends, direction, stop_prices, take_prices)
@@ -6,9 +6,18 @@ import multiprocessing
 from datetime import datetime
 from tabulate import tabulate
 import math
+import random
+import uuid
+from itertools import islice
 from bfin.backtest.portfolio import Portfolio
+from bfin.backtest.checkpoint import OptimizerCheckpoint
+from bfin.directories import CACHE_DIR
+import bfin.backtest.search as Search
 
 MOST_COMMON_COUNT = 10
+CHUNKS_PER_WORKER = 4       # imap_unordered chunks handed to each pool worker, more chunks balance uneven tasks
+BATCH_BLOCK_SIZE = 512      # Combinations per batch engine task
+SEARCH_MODES = ('grid', 'random', 'latin_hypercube', 'halving')
 
 class Optimizer(object):
     def __init__(self, df_ohlc, instrument, timeframe, **kwargs):
@@ -20,11 +29,39 @@ class Optimizer(object):
             pip_size                pip size of instrument
             generators
                 periods   [{'name': (start, stop, step)}, ...]  List of periods to use as generators, ordered shortest to longest
-                trading     {'stop_loss': (start, stop, step), 'take_profit': (start, stop, step)}
+                trading     {'stop_loss_gen': (start, stop, step), 'take_profit_gen': (start, stop, step)}  Optional,
+                            every period combination is also tried with each stop loss / take profit pair
             portfolio
                 initial_equity      int     Initial deposit in dollars
                 margin_ratio        int     Multiple such as 25
-                top_off_equity      bool    If equity <= initial_equity after a trade, deposit more equity to bring balance up to initial_equity
+                b_top_off_equity    bool    If equity <= initial_equity after a trade, deposit more equity to bring balance up to initial_equity
+            results                 'full'      keep the portfolio, positions and analysis of every combination (default)
+                                    'metrics'   workers only return the analysis row of each combination
+            keep_top                int     With 'metrics' results, keep positions for this many of the best combinations
+            engine                  'portfolio' run every combination through the strategy and Portfolio (default)
+                                    'batch'     evaluate blocks of combinations at once with strategy.evaluate_batch(),
+                                                results are metrics only as above
+            search                  'grid'      evaluate every combination (default)
+                                    'random'    evaluate budget combinations drawn uniformly at random
+                                    'latin_hypercube'   evaluate budget combinations spread evenly over each generator
+                                    'halving'   successive halving, budget random combinations are evaluated on a short
+                                                prefix of the data, the best 1/halving_eta are promoted to a prefix
+                                                halving_eta times longer, ending with the full range
+            budget                  int     Number of combinations for the 'random', 'latin_hypercube' and 'halving' searches
+            seed                    int     Random seed for the sampled searches
+            halving_eta             int     Promotion ratio of the 'halving' search, default 3
+            halving_min_fraction    float   Shortest data prefix used by the 'halving' search, default 0.05
+            precomputed             dict    strategy.precompute() result over df_ohlc or a longer series holding it,
+                                            each evaluated slice reuses it through strategy.precompute_window()
+            pool                    multiprocessing.Pool started with initializer=init_datasets, shared by many
+                                    optimizers so the pool and the datasets are only set up once. Workers build the
+                                    strategy kwargs themselves, precomputed is not used.
+            dataset_id              Key of df_ohlc in the datasets handed to init_datasets(), needed with pool
+            checkpoint              True or path    Store every finished combination in a SQLite file, True uses
+                                            CACHE_DIR/optimizer_checkpoint.sqlite. A rerun over the same data,
+                                            strategy and portfolio settings only evaluates combinations not stored yet.
+                                            Stored combinations come back with their analysis and score only, so
+                                            a checkpoint needs 'metrics' results.
         '''
         self.df_ohlc = df_ohlc
         self.instrument = instrument
@@ -58,70 +95,326 @@ class Optimizer(object):
 
         self.trading = self.generators.get('trading')
 
+        self.results = kwargs.get('results', 'full')
+        if self.results not in ('full', 'metrics'):
+            raise RuntimeError(f'WindowOptimizer() unknown results mode "{self.results}", must be "full" or "metrics"')
+        self.keep_top = kwargs.get('keep_top', MOST_COMMON_COUNT)
+
+        self.engine = kwargs.get('engine', 'portfolio')
+        if self.engine not in ('portfolio', 'batch'):
+            raise RuntimeError(f'WindowOptimizer() unknown engine "{self.engine}", must be "portfolio" or "batch"')
+        if self.engine == 'batch':
+            self.results = 'metrics'
+            if self.trading:
+                raise RuntimeError('WindowOptimizer() the batch engine does not support trading generators')
+
+        self.search = kwargs.get('search', 'grid')
+        if self.search not in SEARCH_MODES:
+            raise RuntimeError(f'WindowOptimizer() unknown search "{self.search}", must be one of {", ".join(SEARCH_MODES)}')
+        self.budget = kwargs.get('budget')
+        if self.search != 'grid' and (self.budget is None or self.budget < 1):
+            raise RuntimeError(f'WindowOptimizer() search "{self.search}" needs a positive "budget" kwargs')
+        self.seed = kwargs.get('seed')
+        self.halving_eta = kwargs.get('halving_eta', 3)
+        if self.halving_eta < 2:
+            raise RuntimeError('WindowOptimizer() halving_eta must be at least 2')
+        self.halving_min_fraction = kwargs.get('halving_min_fraction', 0.05)
+        self.precomputed = kwargs.get('precomputed')
+        # (data_slice, strategy kwargs) of the last slice this process precomputed, reused by the keep_top re-run
+        self.parent_precompute = None
+
+        self.pool = kwargs.get('pool')
+        self.dataset_id = kwargs.get('dataset_id')
+        if self.pool is not None and self.dataset_id is None:
+            raise RuntimeError('WindowOptimizer() a shared pool needs "dataset_id" kwargs')
+        # Identifies this optimizer's worker state in a shared pool
+        self.job_id = uuid.uuid4().hex
+
+        checkpoint = kwargs.get('checkpoint')
+        if checkpoint is True:
+            if not Utils.does_cache_dir_exist():
+                raise RuntimeError(f'WindowOptimizer() checkpoint needs the cache dir {CACHE_DIR}')
+            self.checkpoint_path = CACHE_DIR / OptimizerCheckpoint.FILE_NAME
+        elif checkpoint:
+            self.checkpoint_path = checkpoint
+        else:
+            self.checkpoint_path = None
+        if self.checkpoint_path is not None and self.results != 'metrics':
+            raise RuntimeError('WindowOptimizer() checkpoint needs "metrics" results, stored combinations have no portfolio or positions')
+
+
+    def task_key(self, periods, trading):
+        '''
+        The counter / total_data key of a combination, the period tuple, paired with the sorted trading settings when
+        the search includes trading generators
+        '''
+        return (periods, tuple(sorted(trading.items()))) if self.trading else periods
+
+    def split_key(self, key):
+        '''
+        The (periods, trading) pair of a key made by task_key()
+        '''
+        return (key[0], dict(key[1])) if self.trading else (key, {})
 
     def optimize(self):
         counter = Counter()
         total_data = {}
-        if self.use_multiprocessing:
-            pool = multiprocessing.Pool()
-        else:
-            pool = None
 
-        # Perform the work
-        work_list = []
+        # The dataset is handed to each worker process once by the pool initializer, tasks only carry the periods
         data_slice = self.df_ohlc[self.df_ohlc.index >= self.start_date]
-        for periods in Utils.period_generator(*self.periods.values()):
-            work_list.append([
-                self.instrument,
-                data_slice,
-                self.strategy,
-                periods,
-                self.portfolio_settings,
-            ])
-
-        if self.use_multiprocessing:
-                finished_work = pool.map(process_periods, work_list)
+        space = Search.SearchSpace(self.periods.values(), self.trading)
+        rng = random.Random(self.seed)
+
+        # Grid combinations are generated lazily, only the count is known up front
+        if self.search == 'grid':
+            finished_work = self.evaluate(data_slice, iter(space), len(space))
+        elif self.search == 'random':
+            tasks = Search.sample_random(space, self.budget, rng)
+            finished_work = self.evaluate(data_slice, tasks, len(tasks))
+        elif self.search == 'latin_hypercube':
+            tasks = Search.sample_latin_hypercube(space, self.budget, rng)
+            finished_work = self.evaluate(data_slice, tasks, len(tasks))
         else:
-            finished_work = []
-            for work in work_list:
-                finished_work.append(process_periods(work))
+            finished_work = self.successive_halving(data_slice, Search.sample_random(space, self.budget, rng))
 
         # Add the finished work to the counter and total data
         for work in finished_work:
-            periods = work['periods']
-            portfolio = work['portfolio']
-            positions = work['positions']
+            key = self.task_key(work['periods'], work['trading'])
             analysis = work['analysis']
-            key = periods
             analysis.index = [str(key)]
             analysis.index.names = ['settings']
-            if 'equity' in positions:
-                counter[key] = positions.iloc[-1].equity
-            else:
-                counter[key] = positions['pips_profit'].sum()
-            total_data[key] = {
-                'portfolio': portfolio,
-                'positions': positions,
-                'analysis': analysis,
-            }
+            counter[key] = work['score']
+            total_data[key] = {name: work[name] for name in ('portfolio', 'positions', 'analysis') if name in work}
+
+        # Only the best combinations keep their positions in metrics mode, re-run them here rather than ship every
+        # positions frame back from the workers
+        if self.results == 'metrics' and self.keep_top:
+            top_keys = [key for key, _ in counter.most_common(self.keep_top)]
+            init_worker(*self.top_worker_args(data_slice, top_keys))
+            try:
+                for key in top_keys:
+                    _, positions, _ = evaluate_periods(*self.split_key(key))
+                    total_data[key]['positions'] = positions
+            finally:
+                _worker_state.clear()
+        self.parent_precompute = None
 
         # Return the results
         return counter, total_data
 
+    def search_settings(self):
+        '''
+        The engine and search kwargs, part of the checkpoint run key
+        '''
+        return {
+            'engine': self.engine,
+            'search': self.search,
+            'budget': self.budget,
+            'seed': self.seed,
+            'halving_eta': self.halving_eta,
+            'halving_min_fraction': self.halving_min_fraction,
+        }
+
+    def period_values(self):
+        return sorted(set(value for generator in self.periods.values() for value in range(*generator)))
+
+    def strategy_kwargs(self, data_slice, period_values):
+        if self.precomputed is not None:
+            return self.strategy.precompute_window(self.precomputed, data_slice, period_values)
+        return self.strategy.precompute(data_slice, period_values)
+
+    def worker_args(self, data_slice, results=None):
+        # Indicators shared by every combination, such as one moving average per distinct period, are computed once
+        strategy_kwargs = self.strategy_kwargs(data_slice, self.period_values())
+        self.parent_precompute = (data_slice, strategy_kwargs)
+        results = results if results is not None else self.results
+        return self.instrument, data_slice, self.strategy, self.portfolio_settings, results, strategy_kwargs
+
+    def top_worker_args(self, data_slice, keys):
+        '''
+        init_worker() args to re-run keys on data_slice in this process. The strategy kwargs evaluate() built here for
+        data_slice are reused, when pool workers built their own only the periods of keys are precomputed.
+        '''
+        if self.parent_precompute is not None and self.parent_precompute[0] is data_slice:
+            strategy_kwargs = self.parent_precompute[1]
+        else:
+            period_values = sorted(set(value for key in keys for value in self.split_key(key)[0]))
+            if self.pool is not None:
+                # As the shared pool workers do, see run_shared_task()
+                strategy_kwargs = self.strategy.precompute(data_slice, period_values)
+            else:
+                strategy_kwargs = self.strategy_kwargs(data_slice, period_values)
+        return self.instrument, data_slice, self.strategy, self.portfolio_settings, 'full', strategy_kwargs
+
+    def evaluate(self, data_slice, tasks, task_count, results=None):
+        '''
+        Run (periods, trading) tasks on data_slice and return the list of work dicts, sorted by key
+        '''
+        # With a checkpoint, cells finished by an earlier run are read back instead of evaluated, and every new cell
+        # is stored as soon as it arrives
+        finished_work = []
+        checkpoint = None
+        if self.checkpoint_path is not None:
+            checkpoint = OptimizerCheckpoint(self.checkpoint_path)
+            run_key = checkpoint.run_key(data_slice, self.instrument, self.timeframe, self.strategy,
+                                         self.portfolio_settings, self.precomputed is not None, self.search_settings())
+            stored = checkpoint.load(run_key)
+            tasks = self.skip_stored(tasks, stored, finished_work)
+            task_count = max(1, task_count - len(stored))
+
+        # The batch engine hands each task a block of combinations instead of a single one
+        worker_count = multiprocessing.cpu_count() if self.use_multiprocessing or self.pool is not None else 1
+        if self.engine == 'batch':
+            block_size = min(BATCH_BLOCK_SIZE, max(1, math.ceil(task_count / worker_count)))
+            task_iter = iter(tasks)
+            tasks = iter(lambda: list(islice(task_iter, block_size)), [])
+            task_count = math.ceil(task_count / block_size)
+            process_task = process_batch
+        else:
+            process_task = process_periods
 
-def process_periods(args):
-    instrument, df, use_strategy, periods, portfolio_settings = args
-    kwargs = { 'periods': periods }
+        def collect(results_iter):
+            for result in results_iter:
+                for work in (result if self.engine == 'batch' else [result]):
+                    finished_work.append(work)
+                    if checkpoint is not None:
+                        checkpoint.add(run_key, str(self.task_key(work['periods'], work['trading'])), work)
+
+        try:
+            if self.pool is not None:
+                # Workers of a shared pool hold the datasets, each task names the slice and settings to build its
+                # worker state from, which a worker only does when it switches to another optimizer or slice
+                chunk_size = max(1, task_count // (worker_count * CHUNKS_PER_WORKER))
+                start = int(self.df_ohlc.index.searchsorted(data_slice.index[0])) if len(data_slice) > 0 else 0
+                state_spec = (self.dataset_id, start, start + len(data_slice), self.instrument, self.strategy,
+                              self.portfolio_settings, results if results is not None else self.results,
+                              self.period_values())
+                state_id = f'{self.job_id}-{start}-{len(data_slice)}-{state_spec[6]}'
+                shared_tasks = ((state_id, state_spec, process_task, task) for task in tasks)
+                collect(self.pool.imap_unordered(run_shared_task, shared_tasks, chunksize=chunk_size))
+            elif self.use_multiprocessing:
+                worker_args = self.worker_args(data_slice, results)
+                chunk_size = max(1, task_count // (worker_count * CHUNKS_PER_WORKER))
+                with multiprocessing.Pool(initializer=init_worker, initargs=worker_args) as pool:
+                    collect(pool.imap_unordered(process_task, tasks, chunksize=chunk_size))
+            else:
+                init_worker(*self.worker_args(data_slice, results))
+                try:
+                    collect(process_task(task) for task in tasks)
+                finally:
+                    _worker_state.clear()
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+
+        # Results arrive in completion order, sort them so ties in the counter always rank the same way
+        finished_work.sort(key=lambda work: self.task_key(work['periods'], work['trading']))
+        return finished_work
+
+    def skip_stored(self, tasks, stored, finished_work):
+        '''
+        Yields the tasks missing from stored, the stored work of the others is appended to finished_work
+        '''
+        for task in tasks:
+            work = stored.get(str(self.task_key(*task)))
+            if work is None:
+                yield task
+            else:
+                finished_work.append(work)
+
+    def successive_halving(self, data_slice, candidates):
+        '''
+        Evaluate candidates on growing prefixes of data_slice, keeping the best 1/halving_eta after each rung.
+        Returns the work of the last rung, which runs on the full data_slice.
+        '''
+        rungs = Search.halving_rungs(len(candidates), self.halving_eta, self.halving_min_fraction)
+        for rung, (fraction, keep) in enumerate(rungs):
+            candidates = candidates[:keep]
+            if rung == len(rungs) - 1:
+                return self.evaluate(data_slice, candidates, len(candidates))
+            prefix = data_slice.iloc[:max(1, math.ceil(len(data_slice) * fraction))]
+            finished_work = self.evaluate(prefix, candidates, len(candidates), results='metrics')
+            # Stable sort on score, equal scores keep key order
+            finished_work.sort(key=lambda work: work['score'], reverse=True)
+            candidates = [(work['periods'], work['trading']) for work in finished_work]
+
+
+# Per process state set by init_worker(), shared by every task the process runs
+_worker_state = {}
+
+
+def init_worker(instrument, df, use_strategy, portfolio_settings, results='full', strategy_kwargs=None):
+    _worker_state['instrument'] = instrument
+    _worker_state['strategy_kwargs'] = strategy_kwargs if strategy_kwargs is not None else {}
+    _worker_state['df'] = df
+    _worker_state['strategy'] = use_strategy
+    _worker_state['portfolio_settings'] = portfolio_settings
+    _worker_state['results'] = results
+
+
+# Datasets of a shared pool, set by init_datasets()
+_datasets = {}
+
+
+def init_datasets(datasets):
+    '''
+    Pool initializer for pools shared between optimizers, datasets is {dataset_id: df_ohlc}
+    '''
+    _datasets.clear()
+    _datasets.update(datasets)
+
+
+def run_shared_task(shared_task):
+    state_id, state_spec, process_task, task = shared_task
+    if _worker_state.get('state_id') != state_id:
+        dataset_id, start, stop, instrument, use_strategy, portfolio_settings, results, period_values = state_spec
+        df = _datasets[dataset_id].iloc[start:stop]
+        init_worker(instrument, df, use_strategy, portfolio_settings, results, use_strategy.precompute(df, period_values))
+        _worker_state['state_id'] = state_id
+    return process_task(task)
+
+
+def evaluate_periods(periods, trading=None):
+    instrument = _worker_state['instrument']
+    df = _worker_state['df']
+    use_strategy = _worker_state['strategy']
+    portfolio_settings = {**(_worker_state['portfolio_settings'] or {}), **(trading or {})}
+    kwargs = { 'periods': periods, **_worker_state['strategy_kwargs'] }
     strategy = use_strategy(instrument, df, **kwargs)
     signals = strategy.generate_signals()
-    if portfolio_settings:
-        portfolio = Portfolio(instrument, df, signals, **portfolio_settings)
-    else:
-        portfolio = Portfolio(instrument, df, signals)
+    portfolio = Portfolio(instrument, df, signals, **portfolio_settings)
     positions = portfolio.generate_positions()
-    return {
+    return portfolio, positions, portfolio.analyze_positions(positions)
+
+
+def process_periods(task):
+    periods, trading = task
+    portfolio, positions, analysis = evaluate_periods(periods, trading)
+    if 'equity' in positions:
+        score = positions.iloc[-1].equity if len(positions) > 0 else portfolio.initial_equity
+    else:
+        score = positions['pips_profit'].sum()
+    work = {
+        'periods': periods,
+        'trading': trading,
+        'analysis': analysis,
+        'score': score,
+    }
+    if _worker_state['results'] == 'full':
+        work['portfolio'] = portfolio
+        work['positions'] = positions
+    return work
+
+
+def process_batch(tasks):
+    use_strategy = _worker_state['strategy']
+    periods_list = [periods for periods, _ in tasks]
+    df_analysis = use_strategy.evaluate_batch(_worker_state['instrument'], _worker_state['df'], periods_list,
+                                              _worker_state['portfolio_settings'], **_worker_state['strategy_kwargs'])
+    score_column = 'equity' if 'equity' in df_analysis else 'profit_total'
+    return [{
         'periods': periods,
-        'portfolio': portfolio,
-        'positions': positions,
-        'analysis': portfolio.analyze_positions(positions),
-    }
\ No newline at end of file
+        'trading': trading,
+        'analysis': df_analysis.iloc[[row]].reset_index(drop=True),
+        'score': df_analysis[score_column].iat[row],
+    } for row, (periods, trading) in enumerate(tasks)]
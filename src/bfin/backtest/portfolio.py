@@ -20,6 +20,8 @@ import numpy as np
 import pandas as pd
 import math
 import bfin.myutil as Utils
+import bfin.backtest.exits as Exits
+import bfin.backtest.equity as Equity
 
 
 
@@ -42,6 +44,7 @@ class Portfolio(object):
         self.take_profit = kwargs.get('take_profit')
         self.stop_loss = kwargs.get('stop_loss')
         self.start_date = kwargs.get('start_date')
+        self.b_use_numba = kwargs.get('b_use_numba', True)
         if Utils.is_instrument_forex(instrument):
             self.home_currency = kwargs.get('home_currency', 'USD')
             self.margin_ratio = kwargs.get('margin_ratio', 1.0)
@@ -86,128 +89,145 @@ class Portfolio(object):
     def generate_equity_curve(self, positions, initial_equity, b_top_off_equity=False):
         if len(positions) == 0:
             return pd.DataFrame({'equity': []}, index=[]).rename_axis('Date')
-        instrument = self.instrument
-        home_currency = self.home_currency
-        margin_ratio = self.margin_ratio
-        added_equity = 0
-        equity_curve = [initial_equity]
-        equity_open_dates = [positions.iloc[0]['date_opened']]
-        equity = initial_equity
+        mode = Equity.unit_mode(self.instrument, margin_ratio=self.margin_ratio, home_currency=self.home_currency)
+        equity_curve = Equity.compound_equity(
+            positions['direction'].to_numpy(),
+            positions['price_opened'].to_numpy(),
+            positions['price_closed'].to_numpy(),
+            initial_equity,
+            mode,
+            margin_ratio=self.margin_ratio,
+            b_top_off_equity=b_top_off_equity,
+            b_use_numba=self.b_use_numba,
+        )
+        equity_open_dates = pd.DatetimeIndex([positions.iloc[0]['date_opened']]).append(pd.DatetimeIndex(positions['date_closed']))
+        return pd.DataFrame({'equity': equity_curve}, index=equity_open_dates).rename_axis('date')
 
 
-        for index, position in positions.iterrows():
-            if b_top_off_equity and equity < initial_equity:
-                amount_to_add = initial_equity - equity
-                equity += amount_to_add
-                added_equity += amount_to_add
-            direction = position['direction']
-            date_closed = position['date_closed']
-            price_opened = position['price_opened']
-            price_closed = position['price_closed']
-            units = Utils.trade_units_available(instrument, price_opened, equity, margin_ratio=margin_ratio, home_currency=home_currency)
-            equity_result = Utils.trade_equity_result(instrument, direction, units, price_opened, price_closed, home_currency=home_currency)
-            equity += equity_result
-            equity_curve.append(equity)
-            equity_open_dates.append(date_closed)
-
-        return pd.DataFrame({'equity': equity_curve}, index=equity_open_dates).rename_axis('date')
 
+    POSITION_COLUMNS = ['date_opened', 'date_closed', 'price_opened', 'price_closed', 'pips_profit', 'bars_held',
+                        'direction', 'price_max', 'price_min', 'pips_favorable', 'pips_adverse', 'close_type']
 
+    def _find_trades(self):
+        '''
+        Split signals into trades using the runs of signal_change, and return a dict of arrays with one entry per trade.
+        Runs shorter than 2 bars, flat runs, and runs missing an open/close price or excursion are dropped.
+        '''
+        index = self.signals.index
+        change = self.signals['signal_change'].to_numpy()
+        signal = self.signals['signal'].to_numpy(dtype=np.float64)
+        close = self.signals['close'].to_numpy(dtype=np.float64)
+        next_close = self.signals['next_close'].to_numpy(dtype=np.float64)
+        high = self.df_ohlc.loc[index, 'High'].to_numpy(dtype=np.float64)
+        low = self.df_ohlc.loc[index, 'Low'].to_numpy(dtype=np.float64)
+
+        if len(change) == 0:
+            starts = np.array([], dtype=np.int64)
+        else:
+            starts = np.flatnonzero(np.r_[True, change[1:] != change[:-1]])
+        ends = np.r_[starts[1:] - 1, len(change) - 1].astype(np.int64) if len(starts) else starts
+        lengths = ends - starts + 1
+
+        direction = signal[starts]
+        keep = (lengths >= 2) & (direction != 0)
+        starts, ends, lengths, direction = starts[keep], ends[keep], lengths[keep], direction[keep]
+
+        price_opened = close[starts]
+        price_closed = next_close[ends]
+        keep = ~np.isnan(price_opened) & ~np.isnan(price_closed)
+        starts, ends, lengths, direction = starts[keep], ends[keep], lengths[keep], direction[keep]
+        price_opened, price_closed = price_opened[keep], price_closed[keep]
+
+        if np.any((direction != 1) & (direction != -1)):
+            raise RuntimeError(f'Portfolio.generate_positions() invalid direction {direction[(direction != 1) & (direction != -1)][0]}, must be -1 or 1.')
+
+        # Max high / min low over each trade excluding its first bar. Trades are ordered and never overlap, so
+        # reduceat over interleaved (start + 1, end + 1) boundaries reduces each trade in one pass. NaN bars are
+        # skipped like Series.max() / Series.min() would.
+        if len(starts) > 0:
+            boundaries = np.empty(2 * len(starts), dtype=np.int64)
+            boundaries[0::2] = starts + 1
+            boundaries[1::2] = ends + 1
+            high_filled = np.append(np.where(np.isnan(high), -np.inf, high), -np.inf)
+            low_filled = np.append(np.where(np.isnan(low), np.inf, low), np.inf)
+            price_max = np.maximum.reduceat(high_filled, boundaries)[0::2]
+            price_min = np.minimum.reduceat(low_filled, boundaries)[0::2]
+            price_max[np.isinf(price_max)] = np.nan
+            price_min[np.isinf(price_min)] = np.nan
+        else:
+            price_max = np.array([], dtype=np.float64)
+            price_min = np.array([], dtype=np.float64)
+
+        b_long = direction == 1
+        pips_favorable = np.where(b_long, price_max - price_opened, price_opened - price_min)
+        pips_adverse = np.where(b_long, price_opened - price_min, price_max - price_opened)
+        keep = ~np.isnan(pips_favorable) & ~np.isnan(pips_adverse)
+
+        return {
+            'index': index,
+            'high': high,
+            'low': low,
+            'starts': starts[keep],
+            'ends': ends[keep],
+            'bars_held': lengths[keep],
+            'direction': direction[keep],
+            'price_opened': price_opened[keep],
+            'price_closed': price_closed[keep],
+            'price_max': price_max[keep],
+            'price_min': price_min[keep],
+            'pips_favorable': pips_favorable[keep],
+            'pips_adverse': pips_adverse[keep],
+        }
 
     def generate_positions(self):
-        positions = []
-        for name, block in self.signals.groupby('signal_change'):
-            if len(block) < 2:  # Ignore trades that last less than 2 bars
-                continue
-            direction = block['signal'].iloc[0]
-            if direction == 0:
-                continue
-
-            # Get opening and close price
-            price_opened = block.iloc[0]['close']
-            price_closed = block.iloc[-1]['next_close']
-            if np.isnan(price_opened) or np.isnan(price_closed):
-                continue
-
-            # Get max favorable / max adverse values
-            price_max = self.df_ohlc.loc[block.index]['High'][1:].max()
-            price_min = self.df_ohlc.loc[block.index]['Low'][1:].min()
-            if direction == 1:
-                pips_favorable = price_max - price_opened
-                pips_adverse = price_opened - price_min
-            elif direction == -1:
-                pips_favorable = price_opened - price_min
-                pips_adverse = price_max - price_opened
+        trades = self._find_trades()
+        index = trades['index']
+        starts = trades['starts']
+        direction = trades['direction']
+        price_opened = trades['price_opened']
+        price_closed = trades['price_closed'].copy()
+        date_closed_ilocs = trades['ends'].copy()
+        bars_held = trades['bars_held'].copy()
+        close_type = np.full(len(starts), 'Signal', dtype=object)
+
+        # If there is a stop_loss or take_profit, adjust the trade to exit on the first bar touching the stop/take price.
+        if self.stop_loss is not None or self.take_profit is not None:
+            if self.stop_loss is not None:
+                stop_prices = price_opened - direction * (self.pip_size * self.stop_loss)
+            else:
+                stop_prices = np.full(len(starts), np.nan)
+            if self.take_profit is not None:
+                take_prices = price_opened + direction * (self.pip_size * self.take_profit)
             else:
-                raise RuntimeError(f'Portfolio.generate_positions() invalid direction {direction}, must be -1 or 1.')
-            if np.isnan(pips_favorable) or np.isnan(pips_adverse):
-                continue
-
-            # Get trade time range and set close on signal as default
-            date_opened = block.iloc[0].name
-            date_closed = block.iloc[-1].name
-            bars_held = len(block)
-            close_type = 'Signal'
-
-            # If there is a stop_loss or take_profit, adjust the trade to exit on the stop/take price.
-            if self.stop_loss is not None or self.take_profit is not None:
-                block_bars = self.df_ohlc.loc[block.index]
-                price_stop_loss = None
-                price_take_profit = None
-                bars_stop = None
-                bars_take = None
-                # Calculate stop/take price level and bars for new trade
-                if direction == 1.0:
-                    if self.stop_loss is not None:
-                        price_stop_loss = price_opened - (self.pip_size * self.stop_loss)
-                        bars_stop = block_bars[block_bars['Low'] <= price_stop_loss]
-                    if self.take_profit is not None:
-                        price_take_profit = price_opened + (self.pip_size * self.stop_loss)
-                        bars_take = block_bars[block_bars['High'] >= price_take_profit]
-                elif direction == -1.0:
-                    if self.stop_loss is not None:
-                        price_stop_loss = price_opened + (self.pip_size * self.stop_loss)
-                        bars_stop = block_bars[block_bars['High'] >= price_stop_loss]
-                    if self.take_profit is not None:
-                        price_take_profit = price_opened - (self.pip_size * self.stop_loss)
-                        bars_take = block_bars[block_bars['Low'] <= price_take_profit]
-                else:
-                    raise RuntimeError(f'MACrossStrategy.generate_positions() unknown direction {direction}')
-
-                # Adjust closed price and date, change signal to exit type
-                if bars_stop is not None and len(bars_stop) > 0:
-                    price_closed = price_stop_loss
-                    date_closed = bars_stop.iloc[0].name
-                    iloc_closed = block_bars.index.get_loc(date_closed)
-                    bars_held = iloc_closed - 1
-                    close_type = 'Stop'
-                elif bars_take is not None and len(bars_take) > 0:
-                    price_closed = price_take_profit
-                    date_closed = bars_take.iloc[0].name
-                    iloc_closed = block_bars.index.get_loc(date_closed)
-                    bars_held = iloc_closed - 1
-                    close_type = 'Take'
-
-            pips_profit = (price_closed - price_opened) if direction == 1.0 else (price_opened - price_closed)
-
-
-            positions.append({
-                'date_opened': date_opened,
-                'date_closed': date_closed,
-                'price_opened': price_opened,
-                'price_closed': price_closed,
-                'pips_profit': pips_profit,
-                'bars_held': bars_held,
-                'direction': direction,
-                'price_max': price_max,
-                'price_min': price_min,
-                'pips_favorable': pips_favorable,
-                'pips_adverse': pips_adverse,
-                'close_type': close_type,
-            })
-
-        df_positions = pd.DataFrame(positions)
-        if self.initial_equity:
+                take_prices = np.full(len(starts), np.nan)
+            exit_offsets, exit_types = Exits.find_first_touch(trades['high'], trades['low'], starts, trades['ends'],
+                                                              direction, stop_prices, take_prices, self.b_use_numba)
+            for exit_type, exit_prices, exit_name in ((Exits.EXIT_STOP, stop_prices, 'Stop'), (Exits.EXIT_TAKE, take_prices, 'Take')):
+                b_exit = exit_types == exit_type
+                price_closed[b_exit] = exit_prices[b_exit]
+                date_closed_ilocs[b_exit] = starts[b_exit] + exit_offsets[b_exit]
+                bars_held[b_exit] = exit_offsets[b_exit] - 1
+                close_type[b_exit] = exit_name
+
+        pips_profit = np.where(direction == 1.0, price_closed - price_opened, price_opened - price_closed)
+
+        df_positions = pd.DataFrame({
+            'date_opened': index[starts],
+            'date_closed': index[date_closed_ilocs],
+            'price_opened': price_opened,
+            'price_closed': price_closed,
+            'pips_profit': pips_profit,
+            'bars_held': bars_held,
+            'direction': direction,
+            'price_max': trades['price_max'],
+            'price_min': trades['price_min'],
+            'pips_favorable': trades['pips_favorable'],
+            'pips_adverse': trades['pips_adverse'],
+            'close_type': close_type,
+        }, columns=self.POSITION_COLUMNS)
+        if self.initial_equity and len(df_positions) == 0:
+            return df_positions.assign(equity=np.array([], dtype=np.float64))
+        elif self.initial_equity:
             equity_curve = self.generate_equity_curve(df_positions, self.initial_equity, self.b_top_off_equity)
             return self.merge_equity_curve_and_positions(equity_curve, df_positions)
         else:
@@ -246,7 +266,7 @@ class Portfolio(object):
         data = [num_of_trades, count_winners, profit_total, profit_mean, profit_winners_mean, profit_losers_mean]
 
         if 'equity' in positions:
-            final_equity = positions.iloc[-1]['equity']
+            final_equity = positions.iloc[-1]['equity'] if len(positions) > 0 else self.initial_equity
             columns.append('equity')
             data.append(final_equity)
 
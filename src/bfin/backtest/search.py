@@ -0,0 +1,101 @@
+'''
+Samplers for the optimizer's non exhaustive search modes.
+
+A search space is the filtered myutil.period_generator() sequence of period tuples, optionally crossed with the
+myutil.stop_take_generator() trading settings. Samplers return lists of (periods, trading) pairs, where trading is a
+dict of Portfolio kwargs and is empty when the space has no trading generators.
+'''
+
+import math
+import bfin.myutil as Utils
+
+
+class SearchSpace(object):
+    def __init__(self, period_generators, trading_settings=None):
+        '''
+        period_generators   [(start, stop, step), ...] ordered shortest to longest, as for myutil.period_generator()
+        trading_settings    {'stop_loss_gen': (start, stop, step), 'take_profit_gen': (start, stop, step)} or None
+        '''
+        self.period_generators = list(period_generators)
+        self.period_count = Utils.period_generator_count(*self.period_generators)
+        if trading_settings:
+            self.trading_list = list(Utils.stop_take_generator(trading_settings))
+            self.stop_loss_values = range(*(trading_settings.get('stop_loss_gen') or (0, 1, 1)))
+            self.take_profit_values = range(*(trading_settings.get('take_profit_gen') or (0, 1, 1)))
+        else:
+            self.trading_list = [{}]
+            self.stop_loss_values = range(0, 1)
+            self.take_profit_values = range(0, 1)
+        self.count = self.period_count * len(self.trading_list)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for periods in Utils.period_generator(*self.period_generators):
+            for trading in self.trading_list:
+                yield periods, trading
+
+    def item(self, index):
+        period_index, trading_index = divmod(index, len(self.trading_list))
+        return Utils.period_generator_item(period_index, *self.period_generators), self.trading_list[trading_index]
+
+
+def sample_random(space, budget, rng):
+    '''
+    budget distinct combinations drawn uniformly from the space, or the whole space if it is smaller
+    '''
+    if budget >= len(space):
+        return list(space)
+    return [space.item(index) for index in rng.sample(range(len(space)), budget)]
+
+
+def sample_latin_hypercube(space, budget, rng, max_rounds=10):
+    '''
+    Latin hypercube sampling, every generator is split into budget equal strata and each stratum is used once per
+    round. Points with non increasing periods are rejected and the round repeated, up to max_rounds, then any
+    shortfall is filled with sample_random().
+    '''
+    if budget >= len(space):
+        return list(space)
+    dimensions = [range(*generator) for generator in space.period_generators]
+    dimensions += [space.stop_loss_values, space.take_profit_values]
+    period_dims = len(space.period_generators)
+
+    samples = {}
+    for _ in range(max_rounds):
+        columns = []
+        for values in dimensions:
+            strata = list(range(budget))
+            rng.shuffle(strata)
+            columns.append([values[math.floor((stratum + rng.random()) / budget * len(values))] for stratum in strata])
+        for point in zip(*columns):
+            periods = point[:period_dims]
+            if any(periods[i] >= periods[i + 1] for i in range(period_dims - 1)):
+                continue
+            trading = {name: value for name, value in zip(('stop_loss', 'take_profit'), point[period_dims:]) if value != 0}
+            samples.setdefault((periods, tuple(sorted(trading.items()))), (periods, trading))
+            if len(samples) >= budget:
+                return list(samples.values())
+
+    for periods, trading in sample_random(space, budget, rng):
+        samples.setdefault((periods, tuple(sorted(trading.items()))), (periods, trading))
+        if len(samples) >= budget:
+            break
+    return list(samples.values())
+
+
+def halving_rungs(candidate_count, eta, min_fraction):
+    '''
+    Successive halving schedule as [(data_fraction, candidates), ...]. The last rung runs on the full data, each
+    earlier rung uses 1/eta of the data of the next and keeps 1/eta of its candidates.
+    '''
+    rung_count = 1
+    while eta ** rung_count <= candidate_count and eta ** -rung_count >= min_fraction:
+        rung_count += 1
+    rungs = []
+    candidates = candidate_count
+    for rung in range(rung_count):
+        rungs.append((float(eta) ** (rung - rung_count + 1), candidates))
+        candidates = max(1, math.ceil(candidates / eta))
+    return rungs
@@ -0,0 +1,139 @@
+'''
+Strategy spec files for non interactive optimize and backtest runs.
+
+A spec is a YAML (.yaml, .yml) or JSON (.json) file. Top level settings apply to every job, a job can override any of
+them. Generators are (start, stop, step) lists or "start, stop, step" strings, period generators are ordered shortest
+to longest.
+
+    strategy: StrategyMACross
+    generators:                         # optimize
+        periods:
+            short: [5, 60, 5]
+            long: [20, 200, 10]
+        trading:                        # optional
+            stop_loss_gen: [10, 50, 10]
+    periods: [10, 50]                   # backtest
+    portfolio:
+        initial_equity: 10000
+        margin_ratio: 25
+        top_off_equity: false
+    optimizer:                          # any Optimizer / WalkForward kwargs
+        engine: batch
+        search: random
+        budget: 500
+    jobs:
+        - {instrument: EUR_USD, timeframe: H1, start: '2022-01-01', end: '2023-01-01'}
+        - {instrument: USD_JPY, timeframe: M15, start: '2023-01-01', portfolio: {initial_equity: 5000}}
+'''
+
+import json
+from pathlib import Path
+import yaml
+import bfin.myutil as Utils
+from bfin.backtest.strategy_ma_cross import StrategyMACross
+
+STRATEGIES = {strategy.STRATEGY_NAME: strategy for strategy in (StrategyMACross,)}
+
+DEFAULT_PORTFOLIO = {
+    'initial_equity': 10000,
+    'margin_ratio': 25,
+    'b_top_off_equity': False,
+}
+
+# Spec portfolio settings named differently from the Portfolio kwargs they set
+PORTFOLIO_ALIASES = {
+    'top_off_equity': 'b_top_off_equity',
+}
+
+# Optimizer kwargs a spec may set
+OPTIMIZER_OPTIONS = ('engine', 'search', 'budget', 'seed', 'halving_eta', 'halving_min_fraction', 'checkpoint',
+                     'keep_top', 'in_sample_bars', 'out_sample_bars', 'anchored')
+
+
+def get_strategy(name):
+    for strategy_name, strategy in STRATEGIES.items():
+        if strategy_name.lower() == str(name).lower():
+            return strategy
+    raise RuntimeError(f'Spec.get_strategy() unknown strategy "{name}", must be one of {", ".join(STRATEGIES)}')
+
+
+def load_spec_file(path):
+    path = Path(path).expanduser()
+    try:
+        with open(path) as f:
+            if path.suffix.lower() == '.json':
+                return json.load(f)
+            elif path.suffix.lower() in ('.yaml', '.yml'):
+                return yaml.safe_load(f)
+    except (OSError, ValueError, yaml.YAMLError) as e:
+        raise RuntimeError(f'Spec.load_spec_file() could not read {path}, {e}')
+    raise RuntimeError(f'Spec.load_spec_file() unknown spec file type {path.suffix}, use .yaml, .yml or .json')
+
+
+def decode_generator(value):
+    if isinstance(value, str):
+        return Utils.decode_generator_string(value)
+    try:
+        start, stop, step = value
+        return int(start), int(stop), int(step)
+    except (TypeError, ValueError):
+        raise RuntimeError(f'Spec.decode_generator() expecting (start, stop, step), got {value}')
+
+
+def decode_generators(generators):
+    try:
+        periods = {name: decode_generator(value) for name, value in generators['periods'].items()}
+    except (KeyError, TypeError, AttributeError):
+        raise RuntimeError('Spec.decode_generators() generators need a "periods" mapping of name: (start, stop, step)')
+    decoded = {'periods': periods}
+    if generators.get('trading'):
+        decoded['trading'] = {name: decode_generator(value) for name, value in generators['trading'].items()}
+    return decoded
+
+
+def decode_portfolio(portfolio):
+    '''
+    Returns the Portfolio kwargs of a spec portfolio mapping
+    '''
+    if not isinstance(portfolio, dict):
+        raise RuntimeError(f'Spec.decode_portfolio() portfolio must be a mapping, got {portfolio}')
+    return {PORTFOLIO_ALIASES.get(name, name): value for name, value in portfolio.items()}
+
+
+def build_jobs(spec):
+    '''
+    Returns a list of job dicts, one per entry of spec['jobs'] (or a single job when the spec has no jobs list):
+        instrument, timeframe, start_date, end_date, strategy, generators, periods, portfolio, options
+    generators and periods are None when the spec does not give them.
+    '''
+    if not isinstance(spec, dict):
+        raise RuntimeError('Spec.build_jobs() spec must be a mapping')
+    jobs = []
+    for entry in spec.get('jobs') or [{}]:
+        settings = {**spec, **entry}
+        try:
+            instrument = settings['instrument']
+            timeframe = settings['timeframe']
+            start = settings['start']
+        except KeyError as e:
+            raise RuntimeError(f'Spec.build_jobs() job {entry} is missing {e}')
+        end = settings.get('end')
+        start_date, end_date = Utils.parse_start_and_end_dates(str(start), str(end) if end else None)
+        periods = settings.get('periods')
+        options = {**(spec.get('optimizer') or {}), **(entry.get('optimizer') or {})}
+        unknown = [name for name in options if name not in OPTIMIZER_OPTIONS]
+        if unknown:
+            raise RuntimeError(f'Spec.build_jobs() unknown optimizer option(s) {", ".join(unknown)}')
+        jobs.append({
+            'instrument': instrument,
+            'timeframe': timeframe,
+            'start_date': start_date,
+            'end_date': end_date,
+            'strategy': get_strategy(settings.get('strategy', StrategyMACross.STRATEGY_NAME)),
+            'generators': decode_generators(settings['generators']) if settings.get('generators') else None,
+            'periods': tuple(int(period) for period in periods) if periods else None,
+            'portfolio': {**DEFAULT_PORTFOLIO, **decode_portfolio(spec.get('portfolio') or {}),
+                          **decode_portfolio(entry.get('portfolio') or {})},
+            'options': options,
+        })
+    return jobs
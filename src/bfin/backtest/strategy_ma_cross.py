@@ -2,6 +2,8 @@ from bfin.backtest import Strategy
 import pandas as pd
 import pandas_ta as ta
 import numpy as np
+from bfin.myutil.indicators import MovingAverageCache
+import bfin.backtest.batch_ma_cross as BatchMACross
 
 class StrategyMACross(Strategy):
     STRATEGY_NAME = "StrategyMACross"
@@ -9,9 +11,11 @@ class StrategyMACross(Strategy):
         """
         kwargs:
             'periods': [(value, ...), ... ]
+            'ma_cache': MovingAverageCache of df_ohlc['Close'], used instead of computing the averages
         """
         self.instrument = instrument
         self.df_ohlc = df_ohlc
+        self.ma_cache = kwargs.get('ma_cache')
 
         try:
             self.periods = kwargs['periods']
@@ -42,6 +46,27 @@ class StrategyMACross(Strategy):
         else:
             raise RuntimeError(f'StrategyMACross.__init__() - Unknown periods, expecting tuple or dict {self.periods}')
 
+    @classmethod
+    def precompute(cls, df_ohlc, period_values):
+        return {'ma_cache': MovingAverageCache(df_ohlc['Close'], period_values)}
+
+    @classmethod
+    def precompute_window(cls, precomputed, df_window, period_values):
+        ma_cache = precomputed.get('ma_cache')
+        if ma_cache is None or any(period not in ma_cache.rows for period in period_values):
+            return cls.precompute(df_window, period_values)
+        return {'ma_cache': ma_cache.window(df_window.index)}
+
+    @classmethod
+    def evaluate_batch(cls, instrument, df_ohlc, periods_list, portfolio_settings=None, **kwargs):
+        pairs = [(periods['short'], periods['long']) if isinstance(periods, dict) else tuple(periods) for periods in periods_list]
+        if any(len(pair) != 2 for pair in pairs):
+            raise RuntimeError('StrategyMACross.evaluate_batch() needs 2 period(s) for every entry')
+        ma_cache = kwargs.get('ma_cache')
+        if ma_cache is None:
+            ma_cache = MovingAverageCache(df_ohlc['Close'], sorted(set(value for pair in pairs for value in pair)))
+        return BatchMACross.evaluate_grid(instrument, df_ohlc, pairs, ma_cache, portfolio_settings)
+
     def generate_signals(self):
         # 1.0 holding a long, 0.0 no position flat, -1.0 holding a short
         signals = pd.DataFrame(index=self.df_ohlc.index)
@@ -50,8 +75,12 @@ class StrategyMACross(Strategy):
         signals['signal_short'] = 0.0
 
         # Create the two moving averages which will be used to generate the signals
-        signals['short_mavg'] = ta.sma(self.df_ohlc['Close'], self.period_short)
-        signals['long_mavg'] = ta.sma(self.df_ohlc['Close'], self.period_long)
+        if self.ma_cache is not None:
+            signals['short_mavg'] = self.ma_cache.sma(self.period_short)
+            signals['long_mavg'] = self.ma_cache.sma(self.period_long)
+        else:
+            signals['short_mavg'] = ta.sma(self.df_ohlc['Close'], self.period_short)
+            signals['long_mavg'] = ta.sma(self.df_ohlc['Close'], self.period_long)
 
         # Create the signals when the MA's are in the correct position, a 1.0 means to buy and hold, and -1.0 means to sell and hold
         signals['signal_long'][self.period_short:] = np.where(
@@ -0,0 +1,203 @@
+import multiprocessing
+import numpy as np
+import pandas as pd
+from bfin.backtest.optimizer import Optimizer
+from bfin.backtest.portfolio import Portfolio
+
+
+class WalkForward(object):
+    def __init__(self, df_ohlc, instrument, timeframe, **kwargs):
+        '''
+        Rolling walk forward optimization. The data from start_date on is split into in-sample windows of
+        in_sample_bars, each followed by an out-of-sample window of out_sample_bars. Every in-sample window is optimized
+        with Optimizer, the best combination is then traded on the out-of-sample window that follows it, and the
+        out-of-sample results are stitched into one positions frame.
+
+        kwargs:
+            Every Optimizer kwarg, plus
+            in_sample_bars      int     Bars optimized in each window
+            out_sample_bars     int     Bars traded with the winning combination after each window, windows step by this
+            anchored            bool    If true every in-sample window starts at start_date and grows, default False
+        '''
+        self.df_ohlc = df_ohlc
+        self.instrument = instrument
+        self.timeframe = timeframe
+        self.kwargs = kwargs
+
+        try:
+            self.strategy = kwargs['strategy']
+        except KeyError:
+            raise RuntimeError('WalkForward() needs "strategy" kwargs')
+        self.start_date = kwargs.get('start_date')
+        if self.start_date is None:
+            raise RuntimeError('WalkForward() needs "start_date" kwargs')
+        try:
+            self.in_sample_bars = int(kwargs['in_sample_bars'])
+            self.out_sample_bars = int(kwargs['out_sample_bars'])
+        except KeyError as e:
+            raise RuntimeError(f'WalkForward() needs {e} kwargs')
+        if self.in_sample_bars < 2 or self.out_sample_bars < 2:
+            raise RuntimeError('WalkForward() in_sample_bars and out_sample_bars must be at least 2')
+        self.anchored = kwargs.get('anchored', False)
+        self.use_multiprocessing = kwargs.get('use_multiprocessing', True)
+        self.portfolio_settings = kwargs.get('portfolio') or {}
+
+        try:
+            self.periods = kwargs['generators']['periods']
+        except KeyError:
+            raise RuntimeError('WalkForward() needs "generators.periods" kwargs')
+
+    def windows(self):
+        '''
+        Returns [(in_start, in_stop, out_start, out_stop), ...] as iloc positions into df_ohlc, stops are exclusive.
+        The last out-of-sample window may be shorter than out_sample_bars.
+        '''
+        first = int(self.df_ohlc.index.searchsorted(pd.Timestamp(self.start_date)))
+        bars = len(self.df_ohlc)
+        windows = []
+        step = 0
+        while True:
+            in_stop = first + self.in_sample_bars + step * self.out_sample_bars
+            out_stop = min(in_stop + self.out_sample_bars, bars)
+            if out_stop - in_stop < 2:
+                break
+            in_start = first if self.anchored else in_stop - self.in_sample_bars
+            windows.append((in_start, in_stop, in_stop, out_stop))
+            step += 1
+        return windows
+
+    def run(self):
+        '''
+        Returns (df_windows, df_positions)
+            df_windows      one row per window, its date ranges, the winning settings, the in-sample score, and the
+                            Portfolio.analyze_positions() columns of the trades opened in its out-of-sample window
+            df_positions    every out-of-sample position with the 'window' it was opened in. With initial_equity set,
+                            the equity column is one equity curve over all of them
+
+        The out-of-sample signals of every window are stitched into one signals frame, each window's signals are
+        generated with the bars before it as warm up so its first bars are not forced flat. Positions are found on the
+        stitched frame, a trade still open at the end of a window is carried into the next one for as long as the next
+        winner holds the same direction, and closes at the end of the window otherwise. A trade keeps the trading
+        settings of the window it was opened in. A trade still open at the end of the last window has no close and is
+        dropped, as Portfolio drops one at the end of the data.
+        '''
+        windows = self.windows()
+        if len(windows) == 0:
+            raise RuntimeError('WalkForward.run() not enough data after start_date for one in-sample and out-of-sample window')
+
+        # Indicators are computed once over the whole series, every window optimizer slices them
+        period_values = sorted(set(value for generator in self.periods.values() for value in range(*generator)))
+        precomputed = self.strategy.precompute(self.df_ohlc, period_values)
+        optimizer_kwargs = {**self.kwargs, 'use_multiprocessing': False, 'results': 'metrics', 'keep_top': 0,
+                            'precomputed': precomputed}
+        worker_args = (self.df_ohlc, self.instrument, self.timeframe, optimizer_kwargs)
+
+        # Windows are independent, each process optimizes whole windows
+        if self.use_multiprocessing:
+            with multiprocessing.Pool(initializer=init_window_worker, initargs=worker_args) as pool:
+                best_list = pool.map(optimize_window, windows)
+        else:
+            init_window_worker(*worker_args)
+            try:
+                best_list = [optimize_window(window) for window in windows]
+            finally:
+                _window_state.clear()
+
+        signals = self.stitch_signals(windows, best_list, precomputed)
+        df_positions = self.generate_positions(windows, best_list, signals)
+
+        equity = self.portfolio_settings.get('initial_equity')
+        b_equity = bool(equity)
+        portfolio = Portfolio(self.instrument, self.df_ohlc, signals, **self.portfolio_settings)
+        window_rows = []
+        for number, ((in_start, in_stop, out_start, out_stop), (key, _, _, score)) in enumerate(zip(windows, best_list)):
+            positions = df_positions[df_positions['window'] == number]
+            analysis = portfolio.analyze_positions(positions).to_dict('records')[0]
+            if b_equity and len(positions) > 0:
+                equity = analysis['equity']
+            elif b_equity:
+                analysis['equity'] = equity
+
+            window_rows.append({
+                'window': number,
+                'in_sample_start': self.df_ohlc.index[in_start],
+                'in_sample_end': self.df_ohlc.index[in_stop - 1],
+                'out_sample_start': self.df_ohlc.index[out_start],
+                'out_sample_end': self.df_ohlc.index[out_stop - 1],
+                'settings': str(key),
+                'in_sample_score': score,
+                **analysis,
+            })
+
+        df_windows = pd.DataFrame(window_rows).set_index('window')
+        return df_windows, df_positions
+
+    def stitch_signals(self, windows, best_list, precomputed):
+        '''
+        One signals frame over every out-of-sample window, each window's rows generated with its winning periods
+        '''
+        warm_up = max(value for generator in self.periods.values() for value in range(*generator))
+        signals_list = []
+        for (_, _, out_start, out_stop), (_, periods, _, _) in zip(windows, best_list):
+            period_values = sorted(periods.values()) if isinstance(periods, dict) else sorted(periods)
+            df_context = self.df_ohlc.iloc[max(0, out_start - warm_up):out_stop]
+            strategy_kwargs = self.strategy.precompute_window(precomputed, df_context, period_values)
+            strategy = self.strategy(self.instrument, df_context, periods=periods, **strategy_kwargs)
+            signals_list.append(strategy.generate_signals().loc[self.df_ohlc.index[out_start]:])
+        signals = pd.concat(signals_list)
+
+        # Trades are keyed on the runs of the stitched signal, and no trade closes past the last out-of-sample bar
+        signals['signal_change'] = signals['signal'].ne(signals['signal'].shift().fillna(0)).cumsum()
+        signals['next_close'] = signals['close'].shift(-1)
+        return signals
+
+    def generate_positions(self, windows, best_list, signals):
+        '''
+        Positions over the stitched signals, each one traded with the settings of the window it was opened in
+        '''
+        out_starts = self.df_ohlc.index[[out_start for _, _, out_start, _ in windows]]
+        window_trading = [trading for _, _, trading, _ in best_list]
+        settings = {key: value for key, value in self.portfolio_settings.items() if key != 'initial_equity'}
+
+        positions_list = []
+        for trading in [trading for number, trading in enumerate(window_trading) if trading not in window_trading[:number]]:
+            portfolio = Portfolio(self.instrument, self.df_ohlc, signals, **{**settings, **trading})
+            positions = portfolio.generate_positions()
+            opened_in = out_starts.searchsorted(positions['date_opened'], side='right') - 1
+            b_keep = np.array([window_trading[number] == trading for number in opened_in], dtype=bool)
+            positions_list.append(positions[b_keep].assign(window=opened_in[b_keep]))
+        df_positions = pd.concat(positions_list).sort_values('date_opened', ignore_index=True)
+
+        equity = self.portfolio_settings.get('initial_equity')
+        if equity and len(df_positions) > 0:
+            portfolio = Portfolio(self.instrument, self.df_ohlc, signals, **self.portfolio_settings)
+            equity_curve = portfolio.generate_equity_curve(df_positions, equity, portfolio.b_top_off_equity)
+            df_positions = portfolio.merge_equity_curve_and_positions(equity_curve, df_positions)
+        elif equity:
+            df_positions = df_positions.assign(equity=np.array([], dtype=np.float64))
+        return df_positions[[*Portfolio.POSITION_COLUMNS, *(['equity'] if equity else []), 'window']]
+
+
+# Per process state set by init_window_worker()
+_window_state = {}
+
+
+def init_window_worker(df, instrument, timeframe, optimizer_kwargs):
+    _window_state['df'] = df
+    _window_state['instrument'] = instrument
+    _window_state['timeframe'] = timeframe
+    _window_state['optimizer_kwargs'] = optimizer_kwargs
+
+
+def optimize_window(window):
+    '''
+    Optimize one in-sample window, returns (key, periods, trading, score) of the best combination
+    '''
+    in_start, in_stop, _, _ = window
+    df_in = _window_state['df'].iloc[in_start:in_stop]
+    kwargs = {**_window_state['optimizer_kwargs'], 'start_date': df_in.index[0]}
+    optimizer = Optimizer(df_in, _window_state['instrument'], _window_state['timeframe'], **kwargs)
+    counter, _ = optimizer.optimize()
+    key, score = counter.most_common(1)[0]
+    periods, trading = optimizer.split_key(key)
+    return key, periods, trading, score
@@ -28,7 +28,14 @@ class ChartPrinter(object):
     )
 
     def __init__(self):
-        pass
+        # Async results of charts queued on a shared pool by write_html(), see wait_for_charts()
+        self.pending_charts = []
+
+    def __getstate__(self):
+        # Queued async results can not be pickled, workers get a printer without them
+        state = self.__dict__.copy()
+        state['pending_charts'] = []
+        return state
 
     def _break_into_chunks_by_ilocs(self, df, bars_per_chart=300):
         chunks = max(1, math.floor(len(df) / bars_per_chart))
@@ -217,6 +224,36 @@ class ChartPrinter(object):
                 ax.text(index, value - text_pad, f'{value:{floatfmt}}', verticalalignment='bottom', **kwargs)
 
 
+    # write_html() / show_in_notebook() kwargs that are merged into the data before charting and never read per chart
+    DATA_KWARGS = ('extrema', 'pool', 'pivots')
+
+    def _add_pivot_columns(self, data_chunk, config_dict):
+        '''
+        Materialize the pivot level columns of the pivots kwarg, a list of pivot_points.PivotLevels, for one chart
+        '''
+        for pivot_levels in config_dict.get('pivots') or []:
+            pivot_levels.add_to_dataframe(data_chunk)
+
+    def _chunk_config(self, config_dict, data_chunk):
+        '''
+        The config for one chart, overlays covering the whole dataset are cut down to the bars of data_chunk so each
+        chart task only carries its own window
+        '''
+        config = {key: value for key, value in config_dict.items() if key not in self.DATA_KWARGS}
+        if (signals_config := config.get('signals')) is not None and signals_config.get('df_signals') is not None:
+            df_signals = signals_config['df_signals']
+            if len(data_chunk) > 0 and df_signals.index.is_monotonic_increasing:
+                start = df_signals.index.searchsorted(data_chunk.index[0], side='left')
+                stop = df_signals.index.searchsorted(data_chunk.index[-1], side='right')
+                df_markers = df_signals.iloc[start:stop]
+            elif len(data_chunk) > 0:
+                df_markers = df_signals[(df_signals.index >= data_chunk.index[0]) & (df_signals.index <= data_chunk.index[-1])]
+            else:
+                df_markers = df_signals.iloc[0:0]
+            config['signals'] = {**signals_config, 'df_signals': df_markers.copy()}
+        return config
+
+
     def _save_chart_image(self, data, image_full_path, instrument, time_frame, pip_size, config_dict):
         figscale = config_dict.get('figscale', 1.0)
         figratio = config_dict.get('figratio', (5,2))
@@ -397,20 +434,30 @@ class ChartPrinter(object):
         for sc in range(len(session_ilocs)):
             SESSION_BAR_PADDING = 0
             data_chunk = data.iloc[max(0, session_ilocs[sc][0] - SESSION_BAR_PADDING):min(len(df) - 1, session_ilocs[sc][-1] + SESSION_BAR_PADDING)]
+            if kwargs.get('pivots'):
+                data_chunk = data_chunk.copy()
+                self._add_pivot_columns(data_chunk, kwargs)
             self._save_chart_image(
                 data_chunk,
                 None,
                 instrument,
                 time_frame,
                 pip_size,
-                kwargs,
+                self._chunk_config(kwargs, data_chunk),
             )
 
 
 
 
     def write_html(self, df, save_path, instrument, time_frame, pip_size, **kwargs):
+        '''
+        kwargs:
+            pivots      list of pivot_points.PivotLevels, their level columns are added to each chart's bars only
+            pool        multiprocessing.Pool shared between calls. The images are queued on it and write_html returns
+                        without waiting, call wait_for_charts() once every instrument has been queued.
+        '''
         b_use_multiprocessing = kwargs.get('b_use_multiprocessing')
+        pool = kwargs.pop('pool', None)
         extrema = kwargs.get('extrema')
         if extrema is not None:
             OHLCAnalysis.add_extrema_dataframe_to_data(df, extrema)
@@ -438,6 +485,9 @@ class ChartPrinter(object):
             for sc in range(len(session_ilocs)):
                 SESSION_BAR_PADDING = 0
                 data_chunk = data.iloc[max(0, session_ilocs[sc][0] - SESSION_BAR_PADDING):min(len(df) - 1, session_ilocs[sc][-1] + SESSION_BAR_PADDING)]
+                # Each chart gets its own copy of the bars and overlays it draws, not views of the whole dataset
+                data_chunk = data_chunk.copy()
+                self._add_pivot_columns(data_chunk, kwargs)
                 if b_use_multiprocessing:
                    chart_data.append((
                         data_chunk,
@@ -445,7 +495,7 @@ class ChartPrinter(object):
                         instrument,
                         time_frame,
                         pip_size,
-                        kwargs,
+                        self._chunk_config(kwargs, data_chunk),
                     ))
                 else:
                     self._save_chart_image(
@@ -454,7 +504,7 @@ class ChartPrinter(object):
                         instrument,
                         time_frame,
                         pip_size,
-                        kwargs,
+                        self._chunk_config(kwargs, data_chunk),
                     )
 
                 title = f'{data.iloc[session_ilocs[sc][0]].name} to {data.iloc[session_ilocs[sc][-1]].name}'
@@ -469,8 +519,20 @@ class ChartPrinter(object):
             fp.write(f'</TABLE>\n')
             fp.write('</BODY></HTML>\n')
 
-        if b_use_multiprocessing:
+        if b_use_multiprocessing and pool is not None:
+            print(f'Queued {len(chart_data)} images for {instrument} {time_frame}')
+            self.pending_charts.append(pool.starmap_async(self._save_chart_image, chart_data))
+        elif b_use_multiprocessing:
             print(f'Writing images to {save_path}...')
             with Pool() as pool:
                 pool.starmap(self._save_chart_image, chart_data)
 
+
+    def wait_for_charts(self):
+        '''
+        Wait for every image queued on a shared pool by write_html(), raising the first error a worker hit
+        '''
+        pending, self.pending_charts = self.pending_charts, []
+        for result in pending:
+            result.get()
+
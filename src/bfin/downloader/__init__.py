@@ -4,21 +4,26 @@ from pandas_datareader._utils import RemoteDataError
 from datetime import datetime, timedelta
 
 from bfin.oanda.api.config import Config, DEFAULT_PATH
-from v20.errors import V20Timeout, V20ConnectionError
-import json
+from bfin.oanda.historical import OandaHistorical, OandaHistoricalError
 import pandas as pd
-import time
 import pytz
 import bfin.myutil as Utils
 from bfin.directories import CACHE_DIR, QUANDL_KEY_PATH
+from bfin.downloader.store import CandleStore
 from pathlib import Path
 
 class Downloader(object):
-    def __init__(self):
+    def __init__(self, max_workers=1, requests_per_second=4.0):
+        '''
+        max_workers             Oanda downloads use this many concurrent requests when greater than 1
+        requests_per_second     Rate limit for concurrent Oanda downloads
+        '''
         self.oanda_config = Config()
         self.oanda_config.load(DEFAULT_PATH)
-        self.oanda_api = self.oanda_config.create_context()
+        self.oanda_historical = OandaHistorical(self.oanda_config)
         self.quandl_key = None
+        self.max_workers = max_workers
+        self.requests_per_second = requests_per_second
 
 
     def load_quandl_key(self):
@@ -35,29 +40,57 @@ class Downloader(object):
         return None
 
 
+    @staticmethod
+    def source_for_instrument(instrument):
+        '''
+        Returns 'oanda', 'quandl' or 'yahoo' depending on the instrument name format
+        '''
+        if len(instrument) == 7 and instrument[3] == '_' and  instrument.count('_') == 1:
+            return 'oanda'
+        elif instrument.count('/') == 1:
+            return 'quandl'
+        return 'yahoo'
+
+
     def download(self, instrument, timeframe, start_date, end_date=None, delay_between_requests=0.5):
-        file_name = f'{instrument}-{timeframe}-{Utils.format_date(start_date)}-{Utils.format_date(end_date)}.csv'
-        if Utils.check_for_cached_file(file_name):
+        '''
+        Returns bars between start_date and end_date, only downloading the parts not already held in the cache.
+        '''
+        source = self.source_for_instrument(instrument)
+        if source == 'yahoo' and timeframe.upper() != "D":
+            raise RuntimeError(f'Instrument {instrument} {timeframe} is downloaded from Yahoo which only supports daily data.')
+
+        now = pytz.utc.localize(datetime.utcnow())
+        if not end_date or end_date > now:
+            end_date = now
+        if source != 'oanda':
+            # Quandl and Yahoo work on whole days and label bars at UTC midnight
+            start_date = pytz.utc.localize(datetime(start_date.year, start_date.month, start_date.day))
+            end_date = min(now, pytz.utc.localize(datetime(end_date.year, end_date.month, end_date.day) + timedelta(days=1)) - timedelta(microseconds=1))
+
+        store = CandleStore(instrument, timeframe)
+        missing = store.missing_spans(start_date, end_date)
+        if len(missing) == 0:
             print(f'Loading from cache...   {Utils.format_date(start_date, hyphens=True)} to {Utils.format_date(end_date, hyphens=True)}')
-            return Utils.load_from_cache(file_name)
+            return store.get(start_date, end_date)
+
+        for gap_start, gap_end in missing:
+            if source == 'oanda':
+                print(f'Downloading from Oanda...   {Utils.format_date(gap_start, hyphens=True)} to {Utils.format_date(gap_end, hyphens=True)}')
+                data = self.download_from_oanda(instrument, timeframe, gap_start, gap_end, delay_between_requests, b_allow_empty=True)
+            elif source == 'quandl':
+                print(f'Downloading from QUANDL...   {Utils.format_date(gap_start, hyphens=True)} to {Utils.format_date(gap_end, hyphens=True)}')
+                data = self.download_from_quandl(instrument, gap_start, gap_end)
+            else:
+                print(f'Downloading from Yahoo...   {Utils.format_date(gap_start)} to {Utils.format_date(gap_end)}')
+                data = self.download_from_yahoo(instrument, gap_start, gap_end)
+            store.add(data, gap_start, gap_end)
+        store.save()
 
-        if len(instrument) == 7 and instrument[3] == '_' and  instrument.count('_') == 1:
-            print(f'Downloading from Oanda...   {Utils.format_date(start_date, hyphens=True)} to {Utils.format_date(end_date, hyphens=True)}')
-            data =  self.download_from_oanda(instrument, timeframe, start_date, end_date, delay_between_requests)
-            Utils.write_to_cache(file_name, data)
-            return data
-        elif instrument.count('/') == 1:
-            print(f'Downloading from QUANDL...   {Utils.format_date(start_date, hyphens=True)} to {Utils.format_date(end_date, hyphens=True)}')
-            data = self.download_from_quandl(instrument, start_date, end_date)
-            Utils.write_to_cache(file_name, data)
-            return data
-        else:
-            if timeframe.upper() != "D":
-                raise RuntimeError(f'Instrument {instrument} {timeframe} is downloaded from Yahoo which only supports daily data.')
-            print(f'Downloading from Yahoo...   {Utils.format_date(start_date)} to {Utils.format_date(end_date)}')
-            data = self.download_from_yahoo(instrument, start_date, end_date)
-            Utils.write_to_cache(file_name, data)
-            return data
+        data = store.get(start_date, end_date)
+        if data is None or len(data) == 0:
+            raise RuntimeError('Error, no data returned')
+        return data
 
 
     def download_from_quandl(self, instrument, start_date, end_date=None):
@@ -88,72 +121,39 @@ class Downloader(object):
         df.index = df.index.tz_convert(pytz.timezone('America/New_York'))
         return df
 
-    def download_from_oanda(self, instrument, timeframe, start_date, end_date=None, delay_between_requests=0.5):
-        def _load_dataframe(raw_body):
-            """
-                Passed the response.raw_body from a Oanda.v20 request. Convert the data to dataframe and return.
-                No indicators are added at this stage.
-            """
-            df = pd.json_normalize(json.loads(raw_body), 'candles')
-            df.rename(columns={'time': 'Date', 'volume': 'Volume', 'mid.o': 'Open', 'mid.h': 'High', 'mid.l': 'Low',
-                               'mid.c': 'Close'}, inplace=True)
-            try:
-                df.set_index('Date', inplace=True)
-            except KeyError:
-                return None
-
-            df.index = pd.to_datetime(df.index)
-            df[['Open', 'High', 'Low', 'Close', 'Volume']] = df[['Open', 'High', 'Low', 'Close', 'Volume']].apply(
-                pd.to_numeric, errors='coerce')
-            # df.drop(['complete'], axis=1, inplace=True)
-            return df
+    def download_from_oanda_parallel(self, instrument, timeframe, start_date, end_date=None, b_allow_empty=False):
+        try:
+            df, _ = self.oanda_historical.get_bulk_data_parallel(instrument, timeframe, start_date, end_date,
+                                                                 max_workers=self.max_workers,
+                                                                 requests_per_second=self.requests_per_second,
+                                                                 b_allow_empty=b_allow_empty)
+        except OandaHistoricalError as e:
+            raise RuntimeError(str(e))
+        if df is not None:
+            df.index = df.index.tz_convert(pytz.timezone('America/New_York'))
+        return df
+
+    def iter_oanda_pages(self, instrument, timeframe, start_date, end_date=None, delay_between_requests=0.5, b_allow_empty=False):
+        '''
+        Yields each downloaded page as a dataframe indexed in America/New_York, without joining them
+        '''
+        try:
+            for df_block in self.oanda_historical.iter_bulk_data(instrument, timeframe, start_date, end_date,
+                                                                 delay_between_requests, b_allow_empty):
+                df_block.index = df_block.index.tz_convert(pytz.timezone('America/New_York'))
+                yield df_block
+        except OandaHistoricalError as e:
+            raise RuntimeError(str(e))
+
+    def download_from_oanda(self, instrument, timeframe, start_date, end_date=None, delay_between_requests=0.5, b_allow_empty=False):
+        if self.max_workers > 1:
+            return self.download_from_oanda_parallel(instrument, timeframe, start_date, end_date, b_allow_empty)
 
         if not end_date:
             tzUTC = pytz.timezone('UTC')
             end_date = tzUTC.localize(datetime.now() + timedelta(days=1))
 
-        kwargs = {
-            'granularity': timeframe,
-            'fromTime': self.oanda_api.datetime_to_str(start_date),
-            'count': 5000,
-            'includeFirst': True,
-        }
-
-        df_full = None
-        downloaded_pages = 0
-
-        while True:
-            try:
-                # print(f'Downloading with {kwargs}')
-                response = self.oanda_api.instrument.candles(instrument, **kwargs)
-            except V20Timeout as e:
-                raise RuntimeError(f'Timed out [{e}]')
-            except V20ConnectionError as e:
-                raise RuntimeError(f'Connection error [{e}]')
-            if response.status != 200:
-                raise RuntimeError(f'Request failed with HTTP status code {response.status}, check instrument and date.')
-
-            if (df_block := _load_dataframe(response.raw_body)) is None:
-                if (downloaded_pages == 0):
-                    raise RuntimeError(f'Error, no data returned')
-                else:
-                    # print('No data')
-                    break
-            if len(df_block) == 0:
-                break
-            downloaded_pages += 1
-            last_date = df_block.iloc[-1].name
-            if df_full is None:
-                df_full = df_block
-            else:
-                df_full = pd.concat([df_full, df_block])
-
-            if end_date:
-                if last_date >= end_date:
-                    return df_full[df_full.index <= end_date]
-
-            kwargs['fromTime'] = self.oanda_api.datetime_to_str(last_date)
-            kwargs['includeFirst'] = False
-            time.sleep(delay_between_requests)
-        df_full.index = df_full.index.tz_convert(pytz.timezone('America/New_York'))
-        return df_full
\ No newline at end of file
+        blocks = list(self.iter_oanda_pages(instrument, timeframe, start_date, end_date, delay_between_requests, b_allow_empty))
+        if len(blocks) == 0:
+            return None
+        return pd.concat(blocks)
@@ -0,0 +1,143 @@
+import re
+import numpy as np
+import pandas as pd
+import pytz
+import bfin.myutil as Utils
+from bfin.directories import CACHE_DIR
+
+
+class CandleStore(object):
+    '''
+    A per instrument/timeframe cache that remembers which time spans have already been downloaded.
+
+    Stored as CACHE_DIR/{instrument}-{timeframe}.npz. Along with the column arrays the file holds a '__spans__'
+    array of [start, end] pairs (int64 UTC nanoseconds, inclusive) listing every requested range that is
+    fully covered by the stored data. Downloads only need to fetch the gaps reported by missing_spans().
+    '''
+    def __init__(self, instrument, timeframe):
+        self.instrument = instrument
+        self.timeframe = timeframe
+        self.file_name = Utils.remove_slashes_from_filename(f'{instrument}-{timeframe}.npz')
+        self.data = None
+        self.spans = []
+        self.b_changed = False
+        if Utils.does_cache_dir_exist():
+            self.load()
+
+    @staticmethod
+    def to_nanoseconds(dt):
+        '''
+        Convert a datetime or Timestamp to int64 UTC nanoseconds, naive values are treated as UTC
+        '''
+        ts = pd.Timestamp(dt)
+        if ts.tz is None:
+            ts = ts.tz_localize('UTC')
+        return ts.value
+
+    @staticmethod
+    def from_nanoseconds(ns):
+        return pd.Timestamp(ns, unit='ns', tz='UTC')
+
+    def load(self):
+        if Utils.check_for_cached_file(self.file_name):
+            arrays = Utils.load_arrays_from_cache(self.file_name)
+            try:
+                self.data = Utils.arrays_to_dataframe(arrays)
+                self.spans = [list(span) for span in arrays['__spans__'].tolist()]
+            except KeyError as e:
+                raise RuntimeError(f'CandleStore.load() cache file {self.file_name} is missing array {e}')
+        self._absorb_legacy_files()
+
+    def save(self):
+        if not self.b_changed or not Utils.does_cache_dir_exist():
+            return
+        data = self.data if self.data is not None else pd.DataFrame(index=pd.DatetimeIndex([], tz='UTC'))
+        arrays = Utils.dataframe_to_arrays(data)
+        arrays['__spans__'] = np.array(self.spans, dtype=np.int64).reshape(-1, 2)
+        Utils.write_arrays_to_cache(self.file_name, arrays)
+        self.b_changed = False
+
+    def _absorb_legacy_files(self):
+        '''
+        Merge old per-range cache entries ({instrument}-{timeframe}-{start}-{end}.npz or .csv) into the store and
+        delete them. The span recorded for each is the first to last bar it contains, which never claims more
+        coverage than the file actually has.
+        '''
+        prefix = Utils.remove_slashes_from_filename(f'{self.instrument}-{self.timeframe}')
+        pattern = re.compile(rf'^{re.escape(prefix)}-\d{{8}}-\d{{8}}\.(npz|csv)$')
+        for path in sorted(CACHE_DIR.glob(f'{prefix}-*')):
+            if not pattern.match(path.name):
+                continue
+            df = Utils.load_from_cache(path.name)
+            if len(df) > 0:
+                self.add(df, df.index[0], df.index[-1])
+            path.unlink()
+            self.b_changed = True
+
+    def missing_spans(self, start_date, end_date):
+        '''
+        Returns a list of (start, end) UTC Timestamps inside the requested range that are not held by the store
+        '''
+        start = self.to_nanoseconds(start_date)
+        end = self.to_nanoseconds(end_date)
+        gaps = []
+        current = start
+        for span_start, span_end in self.spans:
+            if span_end < current:
+                continue
+            if span_start > end:
+                break
+            if span_start > current:
+                gaps.append((current, span_start - 1))
+            current = max(current, span_end + 1)
+            if current > end:
+                break
+        if current <= end:
+            gaps.append((current, end))
+        return [(self.from_nanoseconds(s), self.from_nanoseconds(e)) for s, e in gaps]
+
+    def add(self, df, start_date, end_date):
+        '''
+        Merge downloaded bars into the store and record [start_date, end_date] as covered.
+        If the bars contain an incomplete candle, coverage stops just before it so it is downloaded again next time.
+        '''
+        start = self.to_nanoseconds(start_date)
+        end = self.to_nanoseconds(end_date)
+        if df is not None and len(df) > 0:
+            df = df.copy()
+            if df.index.tz is None:
+                df.index = df.index.tz_localize('UTC')
+            df.index = df.index.tz_convert(pytz.timezone('America/New_York'))
+            df.index.name = 'Date'
+            if 'complete' in df:
+                incomplete = df.index[~df['complete'].astype(bool)]
+                if len(incomplete) > 0:
+                    end = min(end, self.to_nanoseconds(incomplete[0]) - 1)
+            if self.data is None or len(self.data) == 0:
+                self.data = df.sort_index()
+            else:
+                merged = pd.concat([self.data, df])
+                self.data = merged[~merged.index.duplicated(keep='last')].sort_index()
+            self.b_changed = True
+
+        if end >= start:
+            self.spans.append([start, end])
+            self.spans.sort()
+            merged_spans = [self.spans[0]]
+            for span_start, span_end in self.spans[1:]:
+                if span_start <= merged_spans[-1][1] + 1:
+                    merged_spans[-1][1] = max(merged_spans[-1][1], span_end)
+                else:
+                    merged_spans.append([span_start, span_end])
+            self.spans = merged_spans
+            self.b_changed = True
+
+    def get(self, start_date, end_date):
+        '''
+        Returns a copy of the stored bars between start_date and end_date inclusive
+        '''
+        if self.data is None:
+            return None
+        start = self.from_nanoseconds(self.to_nanoseconds(start_date))
+        end = self.from_nanoseconds(self.to_nanoseconds(end_date))
+        return self.data[(self.data.index >= start) & (self.data.index <= end)].copy()
@@ -66,8 +66,79 @@ def check_for_cached_file(file_name):
     return (CACHE_DIR / use_file_name).is_file()
 
 
+def dataframe_to_arrays(df):
+    '''
+    Convert an OHLC dataframe to a dict of numpy arrays suitable for np.savez.
+    The index is stored as int64 nanoseconds since the epoch in UTC, each column is stored as its own array.
+    '''
+    index = pd.DatetimeIndex(df.index)
+    if index.tz is None:
+        index = index.tz_localize('UTC')
+    index = index.tz_convert('UTC').tz_localize(None)
+    arrays = {
+        '__index__': np.asarray(index, dtype='datetime64[ns]').view(np.int64),
+        '__columns__': np.array([str(c) for c in df.columns]),
+    }
+    for i, column in enumerate(df.columns):
+        values = df[column].to_numpy()
+        if values.dtype == object:
+            values = values.astype(str)
+        arrays[f'column_{i}'] = values
+    return arrays
+
+
+def arrays_to_dataframe(arrays):
+    '''
+    Inverse of dataframe_to_arrays(), returns a dataframe indexed by 'Date' in America/New_York
+    '''
+    columns = [str(c) for c in arrays['__columns__']]
+    index = pd.to_datetime(arrays['__index__'], unit='ns', utc=True)
+    df = pd.DataFrame({column: arrays[f'column_{i}'] for i, column in enumerate(columns)}, index=index, columns=columns)
+    df.index.name = 'Date'
+    df.index = df.index.tz_convert(pytz.timezone('America/New_York'))
+    return df
+
+
+def load_arrays_from_cache(file_name):
+    '''
+    Load a .npz file from the cache and return its contents as a dict of numpy arrays
+    '''
+    use_file_name = remove_slashes_from_filename(file_name)
+    if not does_cache_dir_exist():
+        raise RuntimeError(f'Cache directory "{CACHE_DIR}" does not exist.')
+    if not check_for_cached_file(use_file_name):
+        raise RuntimeError(f'File {use_file_name} does not exist in cache.')
+    try:
+        with np.load(CACHE_DIR / use_file_name, allow_pickle=False) as npz:
+            return {key: npz[key] for key in npz.files}
+    except (OSError, ValueError) as e:
+        raise RuntimeError(f'Error loading file {use_file_name}, {e}')
+
+
+def write_arrays_to_cache(file_name, arrays):
+    '''
+    Write a dict of numpy arrays to a .npz file in the cache
+    '''
+    use_file_name = remove_slashes_from_filename(file_name)
+    if not does_cache_dir_exist():
+        return
+    # Write to a temporary file first so an interrupted write never leaves a truncated cache entry
+    temp_path = CACHE_DIR / f'{use_file_name}.tmp.npz'
+    np.savez(temp_path, **arrays)
+    os.replace(temp_path, CACHE_DIR / use_file_name)
+
+
 def load_from_cache(file_name):
+    '''
+    Load a cached dataframe. Files ending in .npz are loaded as binary column arrays, anything else is parsed as CSV.
+    '''
     use_file_name = remove_slashes_from_filename(file_name)
+    if use_file_name.endswith('.npz'):
+        arrays = load_arrays_from_cache(use_file_name)
+        try:
+            return arrays_to_dataframe(arrays)
+        except KeyError as e:
+            raise RuntimeError(f'Error loading file {use_file_name}, missing array {e}')
     if not does_cache_dir_exist():
         raise RuntimeError(f'Cache directory "{CACHE_DIR}" does not exist.')
     if not check_for_cached_file(use_file_name):
@@ -80,10 +151,16 @@ def load_from_cache(file_name):
 
 
 def write_to_cache(file_name, df):
+    '''
+    Write a dataframe to the cache. Files ending in .npz are written as binary column arrays, anything else as CSV.
+    '''
     use_file_name = remove_slashes_from_filename(file_name)
     if not does_cache_dir_exist():
         return
-    df.to_csv(CACHE_DIR /  use_file_name)
+    if use_file_name.endswith('.npz'):
+        write_arrays_to_cache(use_file_name, dataframe_to_arrays(df))
+    else:
+        df.to_csv(CACHE_DIR / use_file_name)
 
 
 def load_from_csv(full_file_path):
@@ -94,6 +171,17 @@ def load_from_csv(full_file_path):
 
 
 
+def _values_above(values, minimum):
+    '''
+    The values of a range that are greater than minimum, as a range or list without testing every value
+    '''
+    if minimum is None:
+        return values
+    if values.step > 0:
+        return values[max(0, math.ceil((minimum + 1 - values.start) / values.step)):]
+    return [value for value in values if value > minimum]
+
+
 def period_generator(*args, filtered=True):
     '''
     Generates all possible combinations of values from a list of period generators.
@@ -102,15 +190,79 @@ def period_generator(*args, filtered=True):
     filtered    If true the yielded tuple must not have a shorter value that is equal or greater than a longer value
                 example: (1, 2, 3, 4) valid   (1, 2, 2, 3)  invalid  (1, 3, 2, 4)  invalid
     yields      [(val_0_a, val_0_b, val_0_c), (val_1_a, val_1_b, val_1_c), ...]
+    Tuples are yielded lazily in the same order as itertools.product. When filtered, each position only walks the
+    values above the previous one, so invalid combinations are never built. period_generator_count() gives the total.
+    '''
+    ranges = [range(*arg) for arg in args]
+    if not filtered:
+        yield from product(*ranges)
+        return
+    if len(ranges) == 0:
+        yield ()
+        return
+
+    def extend(prefix, depth):
+        values = _values_above(ranges[depth], prefix[-1] if prefix else None)
+        if depth == len(ranges) - 1:
+            for value in values:
+                yield prefix + (value,)
+        else:
+            for value in values:
+                yield from extend(prefix + (value,), depth + 1)
+
+    yield from extend((), 0)
+
+
+def _period_tail_counts(ranges):
+    '''
+    For each generator position, a dict mapping every value to the number of strictly increasing tails that start
+    with it. Built from the longest generator back using suffix sums.
     '''
-    vals = []
-    for arg in args:
-        vals.append([i for i in range(*arg)])
-    vals = product(*vals)
-    for row in vals:
-        if filtered and any([0 if row[i] < row[i+1] else 1 for i in range(len(row)-1)]):
-            continue
-        yield(row)
+    tail_counts = [{value: 1 for value in ranges[-1]}]
+    for values in reversed(ranges[:-1]):
+        counts = tail_counts[0]
+        tail_values = np.array(sorted(counts), dtype=np.int64)
+        tail_sums = np.cumsum([counts[value] for value in tail_values.tolist()][::-1], dtype=np.int64)[::-1]
+        suffix = np.concatenate([tail_sums, np.zeros(1, dtype=np.int64)])
+        positions = np.searchsorted(tail_values, np.array(values, dtype=np.int64), side='right')
+        tail_counts.insert(0, dict(zip(values, suffix[positions].tolist())))
+    return tail_counts
+
+
+def period_generator_count(*args, filtered=True):
+    '''
+    The number of tuples period_generator() yields for the same arguments, computed without enumerating them
+    '''
+    ranges = [range(*arg) for arg in args]
+    if not filtered:
+        return math.prod(len(values) for values in ranges)
+    if len(ranges) == 0:
+        return 1
+    return sum(_period_tail_counts(ranges)[0].values())
+
+
+def period_generator_item(index, *args):
+    '''
+    The tuple at position index of the filtered period_generator() sequence, found without enumerating the ones
+    before it. Raises IndexError if index is out of range.
+    '''
+    ranges = [range(*arg) for arg in args]
+    if len(ranges) == 0:
+        if index == 0:
+            return ()
+        raise IndexError(f'myutil.period_generator_item() index {index} out of range')
+    tail_counts = _period_tail_counts(ranges)
+    if index < 0 or index >= sum(tail_counts[0].values()):
+        raise IndexError(f'myutil.period_generator_item() index {index} out of range')
+    row = ()
+    for depth, counts in enumerate(tail_counts):
+        for value in _values_above(ranges[depth], row[-1] if row else None):
+            if index < counts[value]:
+                row += (value,)
+                break
+            index -= counts[value]
+    return row
+
 
 def stop_take_generator(trading_settings):
     stop_loss_gen = trading_settings.get('stop_loss_gen')
@@ -134,6 +286,28 @@ def stop_take_generator(trading_settings):
 
 
 
+def run_length_encode(values):
+    '''
+    Split an array into runs of equal consecutive values in one pass.
+    Returns (starts, ends, run_values, bars), starts and ends are inclusive positions. A value starts a new run when
+    it differs from the one before it, NaN never equals anything and the value after a NaN is compared to 0, the
+    Series.ne(Series.shift().fillna(0)) grouping get_ranges_from_dataframe() has always used.
+    '''
+    values = np.asarray(values)
+    if len(values) == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, values, empty
+    previous = values[:-1]
+    if previous.dtype.kind in 'fcO':
+        previous = np.where(pd.isna(previous), 0, previous)
+    b_start = np.empty(len(values), dtype=bool)
+    b_start[0] = True
+    b_start[1:] = values[1:] != previous
+    starts = np.flatnonzero(b_start)
+    ends = np.append(starts[1:] - 1, len(values) - 1)
+    return starts, ends, values[starts], ends - starts + 1
+
+
 def get_ranges_from_dataframe(df_input, column_name, drop_first_zero=True, drop_nan=True, bar_length=False):
     '''
     Input Dataframe
@@ -151,23 +325,18 @@ def get_ranges_from_dataframe(df_input, column_name, drop_first_zero=True, drop_
         2       2022-01-05      2022-01-06      2.3
     if drop_first_zero is True, if the first row in Output has a Value of zero the first row is dropped
     '''
-    ranges = []
-    data = pd.DataFrame(index=df_input.index)
-    data['change'] = df_input[column_name].ne(df_input[column_name].shift().fillna(0)).cumsum()
-    for index, block in data.groupby(data['change']):
-        start_date = block.iloc[0].name
-        end_date = block.iloc[-1].name
-        value = df_input.loc[start_date][column_name]
-        if bar_length:
-            bars = len(df_input.loc[start_date:end_date])
-            ranges.append([start_date, end_date, value, bars])
-        else:
-            ranges.append([start_date, end_date, value])
+    starts, ends, values, bars = run_length_encode(df_input[column_name].to_numpy())
+    columns = ['StartDateTime', 'EndDateTime', 'Value']
+    data = {
+        'StartDateTime': df_input.index[starts],
+        'EndDateTime': df_input.index[ends],
+        'Value': values,
+    }
     if bar_length:
-        df_result = pd.DataFrame(columns=['StartDateTime', 'EndDateTime', 'Value', 'Bars'], data=ranges)
-    else:
-        df_result = pd.DataFrame(columns=['StartDateTime', 'EndDateTime', 'Value'], data=ranges)
-    if drop_first_zero:
+        columns.append('Bars')
+        data['Bars'] = bars
+    df_result = pd.DataFrame(data, columns=columns)
+    if drop_first_zero and len(df_result) > 0:
         if df_result.iloc[0]['Value'] == 0:
             df_result = df_result[1:]
     if drop_nan:
@@ -190,9 +359,22 @@ def add_ranges_to_dataframe(df_target, df_ranges, column_name):
         2022-01-04  0.7
         2022-01-05  2.3
         2022-01-06  2.3
+    The index of df_target must be sorted, rows outside every range keep their value (NaN in a new column).
     '''
-    for index, row in df_ranges.iterrows():
-        df_target.loc[row["StartDateTime"]:row["EndDateTime"], column_name] = row['Value']
+    if len(df_ranges) == 0:
+        return
+    starts = df_target.index.searchsorted(df_ranges['StartDateTime'], side='left')
+    stops = df_target.index.searchsorted(df_ranges['EndDateTime'], side='right')
+    bars = np.maximum(stops - starts, 0)
+    values = df_ranges['Value'].to_numpy()
+    if column_name in df_target:
+        column = df_target[column_name].to_numpy(dtype=np.result_type(df_target[column_name].dtype, values.dtype), copy=True)
+    else:
+        column = np.full(len(df_target), np.nan, dtype=np.result_type(np.float64, values.dtype))
+    # Positions of every row of every range, ranges later in df_ranges overwrite earlier ones where they overlap
+    offsets = np.arange(bars.sum()) - np.repeat(np.cumsum(bars) - bars, bars)
+    column[np.repeat(starts, bars) + offsets] = np.repeat(values, bars)
+    df_target[column_name] = column
 
 
 
@@ -0,0 +1,118 @@
+'''
+Relative extrema of a price array for several orders at once.
+
+A bar is a maximum of order p when it is greater than or equal to every bar up to p bars away on both sides, as found
+by scipy.signal.argrelextrema(values, np.greater_equal, order=p) (np.less_equal for minima). Windows are clipped at the
+ends of the array and a NaN in a window, or on the bar itself, rules the bar out.
+
+Every bar's reach, the largest order it is an extremum for, is found in one pass with a monotonic stack, compiled with
+numba when it is installed, so any number of orders costs one pass. Without numba each order is found with a van
+Herk/Gil-Werman sliding window maximum, O(N) whatever the order.
+'''
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+# Reach of a bar that nothing blocks on one side
+NO_LIMIT = np.iinfo(np.int64).max
+
+
+def _reach_loop(values, b_maxima, reach):
+    n = len(values)
+    stack = np.empty(n, dtype=np.int64)
+
+    # Distance to the nearest blocking bar on the left, a bar blocks when it is strictly beyond the value or NaN.
+    # Comparisons with NaN are false, so NaN bars are never popped and block everything after them.
+    top = 0
+    for i in range(n):
+        while top > 0 and ((b_maxima and values[stack[top - 1]] <= values[i]) or
+                           (not b_maxima and values[stack[top - 1]] >= values[i])):
+            top -= 1
+        reach[i] = i - stack[top - 1] - 1 if top > 0 else NO_LIMIT
+        stack[top] = i
+        top += 1
+
+    top = 0
+    for i in range(n - 1, -1, -1):
+        while top > 0 and ((b_maxima and values[stack[top - 1]] <= values[i]) or
+                           (not b_maxima and values[stack[top - 1]] >= values[i])):
+            top -= 1
+        if top > 0 and stack[top - 1] - i - 1 < reach[i]:
+            reach[i] = stack[top - 1] - i - 1
+        stack[top] = i
+        top += 1
+
+    for i in range(n):
+        if values[i] != values[i]:
+            reach[i] = 0
+
+
+_reach_compiled = njit(cache=True)(_reach_loop) if njit is not None else None
+
+
+def _window_extreme(values, order, b_maxima):
+    '''
+    van Herk/Gil-Werman max (or min) of values[i - order:i + order + 1] for every i, NaN treated as missing
+    '''
+    n = len(values)
+    width = 2 * order + 1
+    fill = -np.inf if b_maxima else np.inf
+    accumulate = np.maximum.accumulate if b_maxima else np.minimum.accumulate
+    extreme = np.maximum if b_maxima else np.minimum
+
+    blocks = -(-(n + 2 * order) // width)
+    padded = np.full(blocks * width, fill)
+    padded[order:order + n] = np.where(np.isnan(values), fill, values)
+    padded = padded.reshape(blocks, width)
+    prefix = accumulate(padded, axis=1).ravel()
+    suffix = accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+    return extreme(suffix[:n], prefix[width - 1:width - 1 + n])
+
+
+def _find_extrema_numpy(values, orders, b_maxima):
+    n = len(values)
+    b_nan = np.isnan(values)
+    nan_cumsum = np.r_[0, np.cumsum(b_nan)]
+    positions = np.arange(n)
+    ilocs_list = []
+    for order in orders:
+        order = min(order, n)
+        window = _window_extreme(values, order, b_maxima)
+        b_extreme = values >= window if b_maxima else values <= window
+        window_nans = nan_cumsum[np.minimum(positions + order + 1, n)] - nan_cumsum[np.maximum(positions - order, 0)]
+        ilocs_list.append(np.flatnonzero(b_extreme & (window_nans == 0)))
+    return ilocs_list
+
+
+def extrema_reach(values, b_maxima=True):
+    '''
+    Returns the largest order each bar is a maximum (or minimum) for, 0 for bars that are not an extremum of any order
+    and NO_LIMIT for bars no other bar blocks. Needs numba.
+    '''
+    if _reach_compiled is None:
+        raise RuntimeError('extrema_reach() needs numba')
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    reach = np.empty(len(values), dtype=np.int64)
+    _reach_compiled(values, b_maxima, reach)
+    return reach
+
+
+def find_extrema(values, orders, b_maxima=True, b_use_numba=True):
+    '''
+    Returns a list with the ilocs of the maxima (or minima) of values for each order in orders, each equal to
+    argrelextrema(values, np.greater_equal, order=order)[0], or np.less_equal when b_maxima is False
+    '''
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    for order in orders:
+        if int(order) != order or order < 1:
+            raise RuntimeError(f'find_extrema() order must be an int >= 1, got {order}')
+    orders = [int(order) for order in orders]
+    if b_use_numba and _reach_compiled is not None:
+        reach = extrema_reach(values, b_maxima)
+        return [np.flatnonzero(reach >= order) for order in orders]
+    return _find_extrema_numpy(values, orders, b_maxima)
@@ -1,6 +1,7 @@
-from scipy.signal import argrelextrema
 import numpy as np
+import pandas as pd
 import pandas_ta as ta
+from bfin.myutil.extrema import find_extrema
 
 def add_extrema(df, **kwargs):
     '''
@@ -8,18 +9,22 @@ def add_extrema(df, **kwargs):
         period_short        int
         period_medium       int
         period_long         int
+        b_use_numba         bool    Find every period in one pass with numba when it is installed, default True
     '''
     periods = (
         (kwargs.get('period_short'), 'S'),
         (kwargs.get('period_medium'), 'M'),
         (kwargs.get('period_long'), 'L'),
     )
+    periods = [(period, letter) for period, letter in periods if period is not None]
+    if len(periods) == 0:
+        return
+    b_use_numba = kwargs.get('b_use_numba', True)
+    orders = [period for period, _ in periods]
+    ilocs_max_list = find_extrema(df['High'].values, orders, b_maxima=True, b_use_numba=b_use_numba)
+    ilocs_min_list = find_extrema(df['Low'].values, orders, b_maxima=False, b_use_numba=b_use_numba)
 
-    for period, letter in periods:
-        if period is None:
-            continue
-        ilocs_max = argrelextrema(df['High'].values, np.greater_equal, order=period)[0]
-        ilocs_min = argrelextrema(df['Low'].values, np.less_equal, order=period)[0]
+    for (period, letter), ilocs_max, ilocs_min in zip(periods, ilocs_max_list, ilocs_min_list):
         ind_max = df.iloc[ilocs_max].index
         ind_min = df.iloc[ilocs_min].index
         df.loc[ind_max, f'E{letter}_HI'] = df.loc[ind_max, 'High']
@@ -32,4 +37,54 @@ def add_moving_average_ribbon(df):
     '''
     df['ma_50'] = ta.sma(df['Close'], 50)
     df['ma_100'] = ta.sma(df['Close'], 100)
-    df['ma_200'] = ta.sma(df['Close'], 200)
\ No newline at end of file
+    df['ma_200'] = ta.sma(df['Close'], 200)
+
+
+def sma_matrix(values, periods):
+    '''
+    Simple moving averages of values for every period in periods, returned as a 2-D array with one row per period.
+    Every row is ta.sma() of the series, so the averages are bit for bit the ones a strategy computes without the cache
+    and exact short/long ties fall the same way. Values before a full window are NaN.
+    '''
+    series = pd.Series(np.asarray(values, dtype=np.float64))
+    matrix = np.full((len(periods), len(series)), np.nan)
+    for row, period in enumerate(periods):
+        # ta.sma() returns None for a series shorter than the period
+        if 0 < period <= len(series) and (sma := ta.sma(series, period)) is not None:
+            matrix[row] = sma.to_numpy()
+    return matrix
+
+
+class MovingAverageCache(object):
+    '''
+    Simple moving averages of one price series for many periods, computed once with sma_matrix() and shared by every
+    strategy instance built during an optimization.
+    '''
+    def __init__(self, close, periods):
+        self.index = close.index
+        self.periods = sorted(set(int(period) for period in periods))
+        self.rows = {period: row for row, period in enumerate(self.periods)}
+        self.matrix = sma_matrix(close.to_numpy(dtype=np.float64), self.periods)
+
+    def sma(self, period):
+        try:
+            row = self.rows[period]
+        except KeyError:
+            raise RuntimeError(f'MovingAverageCache.sma() period {period} was not precomputed')
+        return pd.Series(self.matrix[row], index=self.index)
+
+    def window(self, index):
+        '''
+        A cache over a contiguous part of the series, index must be a run of consecutive bars of self.index. The
+        averages keep the values computed over the full series, so bars near the start of the window are not NaN.
+        '''
+        positions = self.index.get_indexer(index)
+        if len(index) > 0 and (positions[0] < 0 or not np.array_equal(positions, np.arange(positions[0], positions[0] + len(index)))):
+            raise RuntimeError('MovingAverageCache.window() index is not a contiguous part of the cached series')
+        start = positions[0] if len(index) > 0 else 0
+        cache = MovingAverageCache.__new__(MovingAverageCache)
+        cache.index = self.index[start:start + len(index)]
+        cache.periods = self.periods
+        cache.rows = self.rows
+        cache.matrix = self.matrix[:, start:start + len(index)]
+        return cache
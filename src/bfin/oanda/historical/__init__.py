@@ -1,53 +1,138 @@
 from bfin.oanda.api.config import Config, DEFAULT_PATH
 from v20.errors import V20Timeout, V20ConnectionError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
 import json
+import threading
 import time
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+MAX_CANDLES_PER_REQUEST = 5000
+
+GRANULARITY_SECONDS = {
+    'S5': 5, 'S10': 10, 'S15': 15, 'S30': 30,
+    'M1': 60, 'M2': 120, 'M4': 240, 'M5': 300, 'M10': 600, 'M15': 900, 'M30': 1800,
+    'H1': 3600, 'H2': 7200, 'H3': 10800, 'H4': 14400, 'H6': 21600, 'H8': 28800, 'H12': 43200,
+    'D': 86400, 'W': 604800, 'M': 2678400,
+}
+
 
 class OandaHistoricalError(Exception):
     """ Raise on error in OandaHistorical """
 
 
+class RateLimiter(object):
+    """
+        Token bucket shared between threads. Tokens refill at `rate` per second up to `capacity`,
+        acquire() blocks until a token is available.
+    """
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise OandaHistoricalError(f'RateLimiter() rate must be positive, got {rate}')
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_time) * self.rate)
+                self.last_time = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def decode_candles(raw_body):
+    """
+        Decode the raw_body of a v20 candles response straight into numpy arrays and return a dataframe indexed by
+        'Date' (UTC) with complete, Volume, Open, High, Low, Close columns. Returns None if there are no candles.
+        Uses orjson when it is installed.
+    """
+    candles = _json_loads(raw_body).get('candles')
+    if not candles:
+        return None
+    count = len(candles)
+    try:
+        prices = np.array([(c['mid']['o'], c['mid']['h'], c['mid']['l'], c['mid']['c']) for c in candles], dtype=np.float64)
+    except KeyError:
+        raise OandaHistoricalError('decode_candles() only mid prices are supported')
+    volume = np.fromiter((c['volume'] for c in candles), dtype=np.int64, count=count)
+    complete = np.fromiter((c['complete'] for c in candles), dtype=bool, count=count)
+    times = [c['time'] for c in candles]
+    if times[0].endswith('Z'):
+        # RFC3339 with nanoseconds, numpy parses it directly once the 'Z' is removed
+        times = np.array([t[:-1] for t in times], dtype='datetime64[ns]')
+    else:
+        # UNIX seconds as a decimal string
+        times = (np.array(times, dtype=np.float64) * 1e9).astype('datetime64[ns]')
+    index = pd.DatetimeIndex(times, name='Date').tz_localize('UTC')
+    return pd.DataFrame({
+        'complete': complete,
+        'Volume': volume,
+        'Open': prices[:, 0],
+        'High': prices[:, 1],
+        'Low': prices[:, 2],
+        'Close': prices[:, 3],
+    }, index=index)
+
+
 class OandaHistorical(object):
-    def __init__(self):
+    def __init__(self, config=None):
+        """
+            config is a loaded Config, if omitted it is loaded from DEFAULT_PATH.
+            Pointing config.hostname/port/ssl at a local server allows running against a fake v20 endpoint.
+        """
         # TODO error checking on creation
-        self.config = Config()
-        self.config.load(DEFAULT_PATH)
+        if config is None:
+            config = Config()
+            config.load(DEFAULT_PATH)
+        self.config = config
         self.api = self.config.create_context()
+        self._thread_local = threading.local()
+
+    def _thread_api(self):
+        """
+            Each download thread gets its own v20 context so requests sessions are never shared between threads.
+        """
+        if (api := getattr(self._thread_local, 'api', None)) is None:
+            api = self.config.create_context()
+            self._thread_local.api = api
+        return api
 
     def _load_dataframe(self, raw_body):
         """
             Passed the response.raw_body from a Oanda.v20 request. Convert the data to dataframe and return.
             No indicators are added at this stage.
         """
-        df = pd.json_normalize(json.loads(raw_body), 'candles')
-        df.rename(columns={'time': 'Date', 'volume': 'Volume', 'mid.o': 'Open', 'mid.h': 'High', 'mid.l': 'Low',
-                           'mid.c': 'Close'}, inplace=True)
-        try:
-            df.set_index('Date', inplace=True)
-        except KeyError:
-            return None
-
-        df.index = pd.to_datetime(df.index)
-        df[['Open', 'High', 'Low', 'Close', 'Volume']] = df[['Open', 'High', 'Low', 'Close', 'Volume']].apply(
-            pd.to_numeric, errors='coerce')
-        # df.drop(['complete'], axis=1, inplace=True)
-        return df
+        return decode_candles(raw_body)
 
     def get_data(self, currency_pair, granularity, bar_count, from_time=None, include_first=None):
+        api = self._thread_api()
         kwargs = {
             'granularity': granularity,
             'count': bar_count,
         }
         if from_time:
-            kwargs['fromTime'] = self.api.datetime_to_str(from_time)
+            kwargs['fromTime'] = api.datetime_to_str(from_time)
 
         if include_first:
             kwargs['includeFirst'] = include_first
 
         try:
-            response = self.api.instrument.candles(currency_pair, **kwargs)
+            response = api.instrument.candles(currency_pair, **kwargs)
         except V20Timeout as e:
             raise OandaHistoricalError(f'Timed out [{e}]')
         except V20ConnectionError as e:
@@ -63,15 +148,16 @@ class OandaHistorical(object):
         """
             Download bars between date range. If range is more than 5000 bars, this call will fail with HTTP status 400.
         """
+        api = self._thread_api()
         kwargs = {
             'granularity': granularity,
-            'fromTime': self.api.datetime_to_str(from_time),
-            'toTime': self.api.datetime_to_str(to_time),
+            'fromTime': api.datetime_to_str(from_time),
+            'toTime': api.datetime_to_str(to_time),
         }
 
         try:
             # print(f'Downloading with {kwargs}')
-            response = self.api.instrument.candles(currency_pair, **kwargs)
+            response = api.instrument.candles(currency_pair, **kwargs)
         except V20Timeout as e:
             raise OandaHistoricalError(f'Timed out [{e}]')
         except V20ConnectionError as e:
@@ -84,24 +170,27 @@ class OandaHistorical(object):
             raise OandaHistoricalError(f'Error, no data returned')
         return df
 
-    def get_bulk_data(self, currency_pair, granularity, start_time, end_time=None, delay_between_requests=0.5):
+    def iter_bulk_data(self, currency_pair, granularity, start_time, end_time=None, delay_between_requests=0.5,
+                       b_allow_empty=False):
         """
-            Loads bulk data from from_time to the current date.
+            Generator version of get_bulk_data(), yields each page as a dataframe as soon as it is downloaded so
+            callers can process or store pages without holding the full range in memory.
+            Runs on the calling thread's own v20 context, so several threads can share one OandaHistorical.
         """
+        api = self._thread_api()
         kwargs = {
             'granularity': granularity,
-            'fromTime': self.api.datetime_to_str(start_time),
-            'count': 5000,
+            'fromTime': api.datetime_to_str(start_time),
+            'count': MAX_CANDLES_PER_REQUEST,
             'includeFirst': True,
         }
 
-        df_full = None
         downloaded_pages = 0
 
         while True:
             try:
                 # print(f'Downloading with {kwargs}')
-                response = self.api.instrument.candles(currency_pair, **kwargs)
+                response = api.instrument.candles(currency_pair, **kwargs)
             except V20Timeout as e:
                 raise OandaHistoricalError(f'Timed out [{e}]')
             except V20ConnectionError as e:
@@ -110,29 +199,102 @@ class OandaHistorical(object):
                 raise OandaHistoricalError(f'Request failed with HTTP status code {response.status}, check instrument and date.')
 
             if (df_block := self._load_dataframe(response.raw_body)) is None:
-                if (downloaded_pages == 0):
+                if downloaded_pages == 0 and not b_allow_empty:
                     raise OandaHistoricalError(f'Error, no data returned')
-                else:
-                    # print('No data')
-                    break
+                return
             if len(df_block) == 0:
-                break
+                return
             downloaded_pages += 1
             last_date = df_block.iloc[-1].name
-            if df_full is None:
-                df_full = df_block
-            else:
-                df_full = pd.concat([df_full, df_block])
 
             if end_time:
                 if last_date >= end_time:
-                    return df_full[df_full.index <= end_time], downloaded_pages
+                    yield df_block[df_block.index <= end_time]
+                    return
+            yield df_block
 
-            kwargs['fromTime'] = self.api.datetime_to_str(last_date)
+            kwargs['fromTime'] = api.datetime_to_str(last_date)
             kwargs['includeFirst'] = False
             time.sleep(delay_between_requests)
 
-        return df_full, downloaded_pages
+    def get_bulk_data(self, currency_pair, granularity, start_time, end_time=None, delay_between_requests=0.5):
+        """
+            Loads bulk data from from_time to the current date.
+        """
+        blocks = list(self.iter_bulk_data(currency_pair, granularity, start_time, end_time, delay_between_requests))
+        if len(blocks) == 0:
+            return None, 0
+        # Join once at the end, concatenating per page copies the growing frame on every iteration
+        return pd.concat(blocks), len(blocks)
+
+    def get_bulk_data_parallel(self, currency_pair, granularity, start_time, end_time=None, max_workers=4,
+                               requests_per_second=4.0, b_allow_empty=False):
+        """
+            Loads bulk data from start_time to end_time (or now) using a pool of threads.
+
+            The range is split up front into fromTime/toTime windows that each hold at most
+            MAX_CANDLES_PER_REQUEST bars of the granularity, the windows are fetched concurrently with
+            at most requests_per_second requests started per second, and then joined in order.
+            Returns the same (dataframe, downloaded_pages) tuple as get_bulk_data().
+        """
+        try:
+            bar_seconds = GRANULARITY_SECONDS[granularity]
+        except KeyError:
+            raise OandaHistoricalError(f'Unknown granularity {granularity}')
+        if max_workers < 1:
+            raise OandaHistoricalError(f'max_workers must be at least 1, got {max_workers}')
 
+        start_time = pd.Timestamp(start_time)
+        start_time = start_time.tz_localize('UTC') if start_time.tz is None else start_time.tz_convert('UTC')
+        now = pd.Timestamp(datetime.utcnow(), tz='UTC')
+        if end_time is None:
+            end_time = now
+        else:
+            end_time = pd.Timestamp(end_time)
+            end_time = end_time.tz_localize('UTC') if end_time.tz is None else end_time.tz_convert('UTC')
+
+        # One bar less than the maximum so an inclusive toTime never pushes a window over the limit. Each window
+        # starts at the previous toTime, so a bar on the edge is fetched whether or not toTime is inclusive. The
+        # last window reaches one bar past end_time, but not into the future, for the same reason, and the extra
+        # bar is trimmed after the join.
+        window = timedelta(seconds=bar_seconds * (MAX_CANDLES_PER_REQUEST - 1))
+        range_end = max(end_time, min(end_time + timedelta(seconds=bar_seconds), now))
+        windows = []
+        window_start = start_time
+        while window_start < range_end:
+            window_end = min(window_start + window, range_end)
+            windows.append((window_start, window_end))
+            window_start = window_end
+
+        limiter = RateLimiter(requests_per_second)
+
+        def _fetch_window(window_range):
+            from_time, to_time = window_range
+            api = self._thread_api()
+            kwargs = {
+                'granularity': granularity,
+                'fromTime': api.datetime_to_str(from_time),
+                'toTime': api.datetime_to_str(to_time),
+            }
+            limiter.acquire()
+            try:
+                response = api.instrument.candles(currency_pair, **kwargs)
+            except V20Timeout as e:
+                raise OandaHistoricalError(f'Timed out [{e}]')
+            except V20ConnectionError as e:
+                raise OandaHistoricalError(f'Connection error [{e}]')
+            if response.status != 200:
+                raise OandaHistoricalError(f'Request failed with HTTP status code {response.status}, check instrument and date.')
+            return self._load_dataframe(response.raw_body)
 
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            blocks = list(executor.map(_fetch_window, windows))
 
+        blocks = [block for block in blocks if block is not None and len(block) > 0]
+        if len(blocks) == 0:
+            if b_allow_empty:
+                return None, len(windows)
+            raise OandaHistoricalError('Error, no data returned')
+        df_full = pd.concat(blocks)
+        df_full = df_full[~df_full.index.duplicated(keep='last')]
+        return df_full[df_full.index <= end_time], len(windows)
@@ -1,6 +1,6 @@
 import numpy as np
 import pandas as pd
-from scipy.signal import argrelextrema
+from bfin.myutil.extrema import find_extrema
 from tabulate import tabulate
 import bfin.myutil as Utils
 from datetime import timedelta
@@ -29,8 +29,8 @@ class OHLCAnalysis(object):
     @staticmethod
     def generate_extrema_dataframe(df, period):
         data = pd.DataFrame(index=df.index)
-        ilocs_max = argrelextrema(df['High'].values, np.greater_equal, order=period)[0]
-        ilocs_min = argrelextrema(df['Low'].values, np.less_equal, order=period)[0]
+        ilocs_max = find_extrema(df['High'].values, [period], b_maxima=True)[0]
+        ilocs_min = find_extrema(df['Low'].values, [period], b_maxima=False)[0]
         ind_max = df.iloc[ilocs_max].index
         ind_min = df.iloc[ilocs_min].index
         data.loc[ind_max, 'extrema_high'] = df.loc[ind_max, 'High']
@@ -43,19 +43,26 @@ class OHLCAnalysis(object):
         data['next_date'] = data['next_date'] - timedelta(seconds=1)
         data['extrema_change'] = data['extrema'].ne(data['extrema'].shift().fillna(0)).cumsum()
         data.at[data.iloc[-1].name, 'next_date'] =  df.iloc[-1].name
-        for index, row in data.iterrows():
-            data.at[index, 'bars'] = len(df.loc[index:row['next_date']])
+        # Bars of df from each extremum through its next_date, from their positions in the sorted index
+        starts = df.index.searchsorted(data.index, side='left')
+        stops = df.index.searchsorted(data['next_date'], side='right')
+        data['bars'] = np.maximum(stops - starts, 0).astype(np.float64)
         data['bars'] = data['bars'].shift().fillna(0)
         return data
 
 
     @staticmethod
     def add_extrema_dataframe_to_data(data, extrema):
-        for index, row in extrema.iterrows():
-            start_date = index
-            end_date = row['next_date']
-            for column in ['extrema_high', 'extrema_low', 'extrema', 'extrema_change']:
-                data.loc[start_date:end_date, column] = row[column]
+        '''
+        Fill the extrema columns of data from each extremum through its next_date, rows outside every extremum keep
+        their value (NaN in new columns). The index of data must be sorted.
+        '''
+        columns = ['extrema_high', 'extrema_low', 'extrema', 'extrema_change']
+        filled = extrema[columns + ['next_date']].reindex(data.index, method='ffill')
+        b_covered = filled['next_date'].values >= data.index.values
+        for column in columns:
+            previous = data[column] if column in data else np.nan
+            data[column] = filled[column].where(b_covered, previous).astype(np.float64)
 
 
 
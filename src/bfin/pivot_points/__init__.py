@@ -1,78 +1,112 @@
+import numpy as np
 import pandas as pd
 from tabulate import tabulate
 import pandas.tseries.offsets as of
 from datetime import timedelta
 
 
-def _calculate_pivots(df_daily, signals, prefix, limit_digits=4):
+def _calculate_pivots(df_daily, groups, prefix, limit_digits=4):
+    '''
+    groups      array of one period key per row of df_daily, keys must sort in period order
+    Returns one record per period, each period after the first gets the pivot levels of the period before it.
+    '''
+    df_groups = pd.DataFrame({
+        'iloc': np.arange(len(df_daily)),
+        'High': df_daily['High'].to_numpy(),
+        'Low': df_daily['Low'].to_numpy(),
+    })
+    df_periods = df_groups.groupby(groups).agg(
+        first=('iloc', 'first'),
+        last=('iloc', 'last'),
+        bars=('iloc', 'size'),
+        high=('High', 'max'),
+        low=('Low', 'min'),
+    )
+    first = df_periods['first'].to_numpy()
+    last = df_periods['last'].to_numpy()
+    bars = df_periods['bars'].to_numpy()
+    high = df_periods['high'].to_numpy()
+    low = df_periods['low'].to_numpy()
+    close = df_daily['Close'].to_numpy()[last]
+
+    # Pivot levels of every period from the period before it
+    prev_high = high[:-1]
+    prev_low = low[:-1]
+    prev_close = close[:-1]
+    pivot = (prev_high + prev_low + prev_close) / 3
+    levels = {
+        f'{prefix}S3': np.round(prev_low - (2 * (prev_high - pivot)), limit_digits),
+        f'{prefix}S2': np.round(pivot - (prev_high - prev_low), limit_digits),
+        f'{prefix}S1': np.round((pivot * 2) - prev_high, limit_digits),
+        f'{prefix}PP': np.round(pivot, limit_digits),
+        f'{prefix}R1': np.round((pivot * 2) - prev_low, limit_digits),
+        f'{prefix}R2': np.round(pivot + (prev_high - prev_low), limit_digits),
+        f'{prefix}R3': np.round(prev_high + (2 * (pivot - prev_low)), limit_digits),
+    }
+
+    index = df_daily.index
     pivots = []
-
-    for idx, (name, block) in enumerate(signals.groupby('group')):
-        # Record the current data
-        price_high = df_daily.loc[block.index]['High'].max()
-        price_low = df_daily.loc[block.index]['Low'].min()
-        price_close = df_daily.loc[block.iloc[-1].name]['Close']
-        pivots.append({
-            'start': block.iloc[0].name,
-            'end': block.iloc[-1].name,
-            'bars': len(block),
-            'high': price_high,
-            'low': price_low,
-            'close': price_close,
-        })
-        # Calculate pivot points for the current block using the previous block
+    for idx in range(len(df_periods)):
+        record = {
+            'start': index[first[idx]],
+            'end': index[last[idx]],
+            'bars': int(bars[idx]),
+            'high': high[idx],
+            'low': low[idx],
+            'close': close[idx],
+        }
         if idx > 0:
-            prev = pivots[idx - 1]
-            cur = pivots[idx]
-            prev_high = prev['high']
-            prev_low = prev['low']
-            prev_close = prev['close']
-            pivot = (prev_high + prev_low + prev_close) / 3
-            cur[f'{prefix}S3'] = round(prev_low - (2 * (prev_high - pivot)), limit_digits)
-            cur[f'{prefix}S2'] = round(pivot - (prev_high - prev_low), limit_digits)
-            cur[f'{prefix}S1'] = round((pivot * 2) - prev_high, limit_digits)
-            cur[f'{prefix}PP'] = round(pivot, limit_digits)
-            cur[f'{prefix}R1'] = round((pivot * 2) - prev_low, limit_digits)
-            cur[f'{prefix}R2'] = round(pivot + (prev_high - prev_low), limit_digits)
-            cur[f'{prefix}R3'] = round(prev_high + (2 * (pivot - prev_low)), limit_digits)
+            for name, values in levels.items():
+                record[name] = values[idx - 1]
+        pivots.append(record)
     return pivots
 
 
+def _month_groups(index):
+    '''
+    Period keys matching strftime('%Y-%m'), as integers
+    '''
+    return index.year.to_numpy() * 100 + index.month.to_numpy()
+
+
+def _week_groups(index):
+    '''
+    Period keys matching strftime('%Y-%U'), weeks start on Sunday and days before the first Sunday are week 0
+    '''
+    day_of_year = index.dayofyear.to_numpy() - 1
+    day_of_week = (index.dayofweek.to_numpy() + 1) % 7
+    return index.year.to_numpy() * 100 + (day_of_year + 7 - day_of_week) // 7
+
+
+def _day_groups(index):
+    '''
+    Period keys matching strftime('%Y-%m-%d'), as integers
+    '''
+    return index.year.to_numpy() * 10000 + index.month.to_numpy() * 100 + index.day.to_numpy()
+
+
 def calculate_monthly_pivots_from_daily(df_daily):
-    signals = pd.DataFrame(index=df_daily.index)
-    signals['group'] = signals.index.strftime('%Y-%m')
-    return _calculate_pivots(df_daily, signals, 'Mn')
+    return _calculate_pivots(df_daily, _month_groups(df_daily.index), 'Mn')
 
 
 def calculate_monthly_pivots_from_intraday(df_intraday):
-    signals = pd.DataFrame(index=df_intraday.index)
-    signals['group'] = (signals.index + of.Hour(7)).strftime('%Y-%m')
-    return _calculate_pivots(df_intraday, signals, 'Mn')
+    return _calculate_pivots(df_intraday, _month_groups(df_intraday.index + of.Hour(7)), 'Mn')
 
 
 def calculate_weekly_pivots_from_daily(df_daily):
-    signals = pd.DataFrame(index=df_daily.index)
-    signals['group'] = signals.index.strftime('%Y-%U')
-    return _calculate_pivots(df_daily, signals, 'Wk')
+    return _calculate_pivots(df_daily, _week_groups(df_daily.index), 'Wk')
 
 
 def calculate_weekly_pivots_from_intraday(df_intraday):
-    signals = pd.DataFrame(index=df_intraday.index)
-    signals['group'] = (signals.index + of.Hour(7)).strftime('%Y-%U')
-    return _calculate_pivots(df_intraday, signals, 'Wk')
+    return _calculate_pivots(df_intraday, _week_groups(df_intraday.index + of.Hour(7)), 'Wk')
 
 
 def calculate_daily_pivots_from_daily(df_daily):
-    signals = pd.DataFrame(index=df_daily.index)
-    signals['group'] = signals.index.strftime('%Y-%m-%d')
-    return _calculate_pivots(df_daily, signals, 'Day')
+    return _calculate_pivots(df_daily, _day_groups(df_daily.index), 'Day')
 
 
 def calculate_daily_pivots_from_intraday(df_intraday):
-    signals = pd.DataFrame(index=df_intraday.index)
-    signals['group'] = (signals.index + of.Hour(7)).strftime('%Y-%m-%d')
-    return _calculate_pivots(df_intraday, signals, 'Day')
-
+    return _calculate_pivots(df_intraday, _day_groups(df_intraday.index + of.Hour(7)), 'Day')
 
 
 def _adjust_pivots_end_date(pivots, last_date=None):
@@ -90,11 +124,70 @@ def add_interday_to_intraday(df_intra, pivots_inter, prefix):
     Add a daily, weekly, or monthly pivots to an hourly or minute chart.
     The _adjust_pivots_end_date should be called on pivots to ensure the intraday Friday data is filled in.
     '''
-    columns = [f'{prefix}{x}' for x in ['S3', 'S2', 'S1', 'PP', 'R1', 'R2', 'R3']]
-    if len(pivots_inter) == 0:
-        return
-    for pivot in pivots_inter[1:]:
-        df_intra.loc[pivot['start']:pivot['end'], columns] = [pivot[x] for x in columns]
+    PivotLevels(pivots_inter, prefix).add_to_dataframe(df_intra)
+
+
+LEVELS = ('S3', 'S2', 'S1', 'PP', 'R1', 'R2', 'R3')
+
+
+class PivotLevels(object):
+    def __init__(self, pivots, prefix):
+        '''
+        The pivot levels of one timeframe as a step function, period i holds its levels from starts[i] through
+        ends[i]. Timestamps are mapped to periods with searchsorted, dense columns are only built by to_frame() and
+        add_to_dataframe() for the rows asked for.
+
+        pivots      records from a calculate_*_pivots_from_* function, the first period has no levels and is skipped
+        prefix      column prefix, 'Day', 'Wk' or 'Mn'
+        '''
+        self.prefix = prefix
+        self.columns = [f'{prefix}{level}' for level in LEVELS]
+        periods = pivots[1:]
+        self.starts = pd.DatetimeIndex([pivot['start'] for pivot in periods])
+        self.ends = pd.DatetimeIndex([pivot['end'] for pivot in periods])
+        self.levels = np.array([[pivot[column] for column in self.columns] for pivot in periods],
+                               dtype=np.float64).reshape(len(periods), len(self.columns))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def period_ilocs(self, index):
+        '''
+        Returns the period of each timestamp in index, -1 where no period covers it
+        '''
+        if len(self) == 0:
+            # No periods, the empty starts have no timezone to compare index with
+            return np.full(len(index), -1)
+        ilocs = self.starts.searchsorted(index, side='right') - 1
+        b_covered = ilocs >= 0
+        b_covered[b_covered] = index[b_covered] <= self.ends[ilocs[b_covered]]
+        return np.where(b_covered, ilocs, -1)
+
+    def lookup(self, index):
+        '''
+        Returns a (len(index), 7) array of the S3..R3 levels at each timestamp, NaN where no period covers it
+        '''
+        ilocs = self.period_ilocs(index)
+        values = np.full((len(index), len(self.columns)), np.nan)
+        b_covered = ilocs >= 0
+        values[b_covered] = self.levels[ilocs[b_covered]]
+        return values
+
+    def to_frame(self, index):
+        return pd.DataFrame(self.lookup(index), index=index, columns=self.columns)
+
+    def add_to_dataframe(self, df):
+        '''
+        Write the level columns into df. Rows no period covers are left as they were, NaN in new columns.
+        '''
+        if len(self) == 0:
+            return
+        ilocs = self.period_ilocs(df.index)
+        b_covered = ilocs >= 0
+        values = self.levels[np.maximum(ilocs, 0)]
+        for column, column_values in zip(self.columns, values.T):
+            previous = df[column].to_numpy(dtype=np.float64) if column in df else np.nan
+            df[column] = np.where(b_covered, column_values, previous)
 
 
 def pivots_list_to_string_table(table):
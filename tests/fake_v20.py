@@ -0,0 +1,139 @@
+'''
+Local stand-in for the v20 candles endpoint.
+
+FakeV20Server serves /v3/instruments/<instrument>/candles over plain HTTP on 127.0.0.1, from a deterministic series of
+mid price candles that has no bars on Saturdays. It answers fromTime/toTime and fromTime/count/includeFirst requests
+like the v20 REST API, including the HTTP 400 for a request over MAX_CANDLES candles, and records every request.
+'''
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import json
+import threading
+import pandas as pd
+from bfin.oanda.api.config import Config
+from bfin.oanda.historical import GRANULARITY_SECONDS
+
+MAX_CANDLES = 5000
+DATA_START = pd.Timestamp('2022-01-01', tz='UTC')
+DATA_END = pd.Timestamp('2022-04-01', tz='UTC')
+
+
+def candle_times(granularity, from_time, to_time):
+    '''
+    Bar times of the fake series in [from_time, to_time]
+    '''
+    step = pd.Timedelta(seconds=GRANULARITY_SECONDS[granularity])
+    from_time = max(from_time, DATA_START)
+    first = DATA_START + -(-(from_time - DATA_START) // step) * step
+    times = pd.date_range(first, min(to_time, DATA_END), freq=step)
+    return times[times.dayofweek != 5]
+
+
+def candle_values(times):
+    '''
+    (volume, open, high, low, close) arrays of the bars, a function of the bar time only
+    '''
+    minutes = ((times - DATA_START) // pd.Timedelta(minutes=1)).to_numpy()
+    base = 1.1 + (minutes % 997) * 0.00001
+    return minutes % 97 + 1, base, base + 0.0005, base - 0.0005, base + 0.0001
+
+
+def format_time(time):
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000000000Z')
+
+
+class FakeV20Server(object):
+    def __init__(self, b_inclusive_to=True):
+        '''
+        b_inclusive_to      A bar at exactly toTime is returned when True
+        '''
+        self.b_inclusive_to = b_inclusive_to
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def config(self):
+        '''
+        Config pointing OandaHistorical at this server
+        '''
+        config = Config()
+        config.hostname = '127.0.0.1'
+        config.streaming_hostname = '127.0.0.1'
+        config.port = self.port
+        config.ssl = False
+        config.token = 'fake-token'
+        return config
+
+    def candles(self, query):
+        '''
+        Returns (status, times) for the query parameters of a candles request
+        '''
+        granularity = query['granularity']
+        from_time = pd.Timestamp(query['from'])
+        if 'to' in query:
+            to_time = pd.Timestamp(query['to'])
+            times = candle_times(granularity, from_time, to_time)
+            if not self.b_inclusive_to:
+                times = times[times < to_time]
+        else:
+            count = int(query.get('count', 500))
+            if count > MAX_CANDLES:
+                return 400, None
+            times = candle_times(granularity, from_time, DATA_END)
+            if query.get('includeFirst', 'true').lower() == 'false':
+                times = times[times > from_time]
+            times = times[:count]
+        if len(times) > MAX_CANDLES:
+            return 400, None
+        return 200, times
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {name: values[0] for name, values in parse_qs(url.query).items()}
+                with fake.lock:
+                    fake.requests.append(query)
+                status, times = fake.candles(query)
+                if status != 200:
+                    self.send_response(status)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                volume, *prices = candle_values(times)
+                body = json.dumps({
+                    'instrument': url.path.split('/')[-2],
+                    'granularity': query['granularity'],
+                    'candles': [{
+                        'complete': True,
+                        'volume': int(volume[number]),
+                        'time': format_time(time),
+                        'mid': {name: f'{values[number]:.5f}' for name, values in zip('ohlc', prices)},
+                    } for number, time in enumerate(times)],
+                }).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
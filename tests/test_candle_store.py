@@ -0,0 +1,179 @@
+'''
+CandleStore coverage spans, merging of downloaded bars, legacy cache files, and the .npz column format it is saved in.
+
+Every test points CACHE_DIR at a temporary directory.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+import bfin.myutil as Utils
+import bfin.downloader.store as Store
+from bfin.downloader.store import CandleStore
+
+TIMEZONE = 'America/New_York'
+BAR = pd.Timedelta(minutes=5)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(Utils, 'CACHE_DIR', tmp_path)
+    monkeypatch.setattr(Store, 'CACHE_DIR', tmp_path)
+    return tmp_path
+
+
+def make_bars(start, count, price=1.1, b_complete_last=True):
+    start = pd.Timestamp(start)
+    start = start.tz_localize('UTC') if start.tz is None else start
+    index = pd.date_range(start, periods=count, freq=BAR, name='Date')
+    close = price + np.arange(count) / 10000
+    df = pd.DataFrame({'complete': True, 'Volume': np.arange(count, dtype=np.int64) + 1, 'Open': close, 'High': close,
+                       'Low': close, 'Close': close}, index=index)
+    if not b_complete_last:
+        df.iloc[-1, 0] = False
+    return df
+
+
+def span(start, end):
+    return pd.Timestamp(start, tz='UTC'), pd.Timestamp(end, tz='UTC')
+
+
+def test_missing_spans(cache_dir):
+    store = CandleStore('EUR_USD', 'M5')
+    assert store.missing_spans(*span('2022-01-03', '2022-01-04')) == [span('2022-01-03', '2022-01-04')]
+
+    store.add(make_bars('2022-01-03 02:00', 12), *span('2022-01-03 02:00', '2022-01-03 03:00'))
+    store.add(make_bars('2022-01-03 05:00', 12), *span('2022-01-03 05:00', '2022-01-03 06:00'))
+    one_ns = pd.Timedelta(1, unit='ns')
+    assert store.missing_spans(*span('2022-01-03 00:00', '2022-01-03 08:00')) == [
+        (pd.Timestamp('2022-01-03 00:00', tz='UTC'), pd.Timestamp('2022-01-03 02:00', tz='UTC') - one_ns),
+        (pd.Timestamp('2022-01-03 03:00', tz='UTC') + one_ns, pd.Timestamp('2022-01-03 05:00', tz='UTC') - one_ns),
+        (pd.Timestamp('2022-01-03 06:00', tz='UTC') + one_ns, pd.Timestamp('2022-01-03 08:00', tz='UTC')),
+    ]
+    assert store.missing_spans(*span('2022-01-03 02:10', '2022-01-03 02:50')) == []
+    # Naive datetimes are UTC, aware ones in any timezone are the same instants
+    assert store.missing_spans(pd.Timestamp('2022-01-03 02:10'), pd.Timestamp('2022-01-03 02:50')) == []
+    assert store.missing_spans(pd.Timestamp('2022-01-02 21:10', tz=TIMEZONE), pd.Timestamp('2022-01-02 21:50', tz=TIMEZONE)) == []
+
+
+def test_incomplete_last_candle_is_not_covered(cache_dir):
+    store = CandleStore('EUR_USD', 'M5')
+    df = make_bars('2022-01-03 00:00', 12, b_complete_last=False)
+    store.add(df, *span('2022-01-03 00:00', '2022-01-03 01:00'))
+
+    # The incomplete bar is kept, but the next download starts at it
+    last_bar = df.index[-1]
+    assert store.missing_spans(*span('2022-01-03 00:00', '2022-01-03 01:00')) == [(last_bar, pd.Timestamp('2022-01-03 01:00', tz='UTC'))]
+    assert not store.get(*span('2022-01-03', '2022-01-04'))['complete'].iat[-1]
+
+    # Downloading it again once complete replaces it
+    store.add(make_bars(last_bar, 3, price=1.2), last_bar, pd.Timestamp('2022-01-03 01:10', tz='UTC'))
+    data = store.get(*span('2022-01-03', '2022-01-04'))
+    assert data['complete'].all() and data.index.is_unique and len(data) == 14
+    assert data.loc[last_bar, 'Close'] == 1.2
+    assert store.missing_spans(*span('2022-01-03 00:00', '2022-01-03 01:10')) == []
+
+
+@pytest.mark.parametrize('second, expected', [
+    # Adjacent, one nanosecond after the first span ends
+    (('2022-01-03 01:00:00.000000001', '2022-01-03 02:00'), [('2022-01-03 00:00', '2022-01-03 02:00')]),
+    # Overlapping
+    (('2022-01-03 00:30', '2022-01-03 02:00'), [('2022-01-03 00:00', '2022-01-03 02:00')]),
+    # Inside
+    (('2022-01-03 00:10', '2022-01-03 00:20'), [('2022-01-03 00:00', '2022-01-03 01:00')]),
+    # A gap of one nanosecond stays a gap
+    (('2022-01-03 01:00:00.000000002', '2022-01-03 02:00'),
+     [('2022-01-03 00:00', '2022-01-03 01:00'), ('2022-01-03 01:00:00.000000002', '2022-01-03 02:00')]),
+])
+def test_spans_merge(cache_dir, second, expected):
+    store = CandleStore('EUR_USD', 'M5')
+    store.add(None, *span('2022-01-03 00:00', '2022-01-03 01:00'))
+    store.add(None, *span(*second))
+    assert store.spans == [[CandleStore.to_nanoseconds(pd.Timestamp(start, tz='UTC')),
+                            CandleStore.to_nanoseconds(pd.Timestamp(end, tz='UTC'))] for start, end in expected]
+
+
+def test_spans_merge_out_of_order(cache_dir):
+    store = CandleStore('EUR_USD', 'M5')
+    for start, end in (('2022-01-05', '2022-01-06'), ('2022-01-01', '2022-01-02'), ('2022-01-02', '2022-01-05')):
+        store.add(None, *span(start, end))
+    assert store.missing_spans(*span('2022-01-01', '2022-01-06')) == []
+    assert len(store.spans) == 1
+
+
+def test_overlapping_bars_keep_last(cache_dir):
+    store = CandleStore('EUR_USD', 'M5')
+    store.add(make_bars('2022-01-03 00:00', 12, price=1.1), *span('2022-01-03 00:00', '2022-01-03 01:00'))
+    store.add(make_bars('2022-01-03 00:30', 12, price=1.3), *span('2022-01-03 00:30', '2022-01-03 01:30'))
+    data = store.get(*span('2022-01-03', '2022-01-04'))
+    assert data.index.is_unique and data.index.is_monotonic_increasing and len(data) == 18
+    assert (data['Close'].iloc[:6] < 1.2).all() and (data['Close'].iloc[6:] >= 1.3).all()
+    assert str(data.index.tz) == TIMEZONE
+
+
+def test_save_and_load(cache_dir):
+    store = CandleStore('EUR_USD', 'M5')
+    store.add(make_bars('2022-01-03 00:00', 12, b_complete_last=False), *span('2022-01-03 00:00', '2022-01-03 01:00'))
+    store.save()
+    assert (cache_dir / 'EUR_USD-M5.npz').is_file() and not store.b_changed
+
+    loaded = CandleStore('EUR_USD', 'M5')
+    pd.testing.assert_frame_equal(store.data, loaded.data, check_freq=False)
+    assert loaded.spans == store.spans
+
+
+def test_no_cache_dir(tmp_path, monkeypatch):
+    missing = tmp_path / 'missing'
+    monkeypatch.setattr(Utils, 'CACHE_DIR', missing)
+    monkeypatch.setattr(Store, 'CACHE_DIR', missing)
+    store = CandleStore('EUR_USD', 'M5')
+    store.add(make_bars('2022-01-03 00:00', 12), *span('2022-01-03 00:00', '2022-01-03 01:00'))
+    store.save()
+    assert not missing.exists()
+
+
+def test_absorb_legacy_files(cache_dir):
+    df_csv = make_bars('2022-01-03 00:00', 12).drop(columns='complete')
+    df_npz = make_bars('2022-01-03 02:00', 12, price=1.2)
+    for df in (df_csv, df_npz):
+        df.index = df.index.tz_convert(TIMEZONE)
+    Utils.write_to_cache('EUR_USD-M5-20220103-20220103.csv', df_csv)
+    Utils.write_to_cache('EUR_USD-M5-20220102-20220104.npz', df_npz)
+    # Other instruments, timeframes and names are left alone
+    Utils.write_to_cache('EUR_USD-M15-20220103-20220103.csv', df_csv)
+    Utils.write_to_cache('EUR_USD-M5-backup.csv', df_csv)
+
+    store = CandleStore('EUR_USD', 'M5')
+    assert sorted(path.name for path in cache_dir.iterdir()) == ['EUR_USD-M15-20220103-20220103.csv', 'EUR_USD-M5-backup.csv']
+    assert store.b_changed and len(store.data) == 24
+    # Each file covers its first to last bar, not the dates in its name
+    assert store.missing_spans(df_csv.index[0], df_csv.index[-1]) == []
+    assert store.missing_spans(df_npz.index[0], df_npz.index[-1]) == []
+    assert store.missing_spans(df_csv.index[-1], df_npz.index[0]) == [(df_csv.index[-1] + pd.Timedelta(1, unit='ns'),
+                                                                      df_npz.index[0] - pd.Timedelta(1, unit='ns'))]
+    np.testing.assert_array_equal(store.get(df_csv.index[0], df_csv.index[-1])['Close'], df_csv['Close'])
+
+    store.save()
+    assert CandleStore('EUR_USD', 'M5').spans == store.spans
+
+
+def test_dataframe_arrays_round_trip():
+    df = make_bars('2022-03-13 05:00', 36, b_complete_last=False)
+    df.index = df.index.tz_convert(TIMEZONE)
+    df['note'] = np.array(['a', 'bb', 'ccc'] * 12, dtype=object)
+    arrays = Utils.dataframe_to_arrays(df)
+    assert all(array.dtype != object for array in arrays.values())
+
+    df_loaded = Utils.arrays_to_dataframe(arrays)
+    # The bars span the daylight saving change in New York
+    assert df_loaded.index[0].utcoffset() != df_loaded.index[-1].utcoffset()
+    assert str(df_loaded.index.tz) == TIMEZONE and df_loaded.index.name == 'Date'
+    assert df_loaded['complete'].dtype == bool and df_loaded['Volume'].dtype == np.int64
+    pd.testing.assert_frame_equal(df, df_loaded, check_freq=False)
+
+
+def test_naive_index_is_utc():
+    df = make_bars('2022-01-03 00:00', 3)
+    df.index = df.index.tz_localize(None)
+    df_loaded = Utils.arrays_to_dataframe(Utils.dataframe_to_arrays(df))
+    assert (df_loaded.index == df.index.tz_localize('UTC')).all()
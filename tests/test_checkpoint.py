@@ -0,0 +1,124 @@
+'''
+Resuming an optimizer search from its checkpoint.
+
+A run is interrupted after some cells, the rerun must only evaluate the cells the first run did not finish and end
+with the results of a run that was never interrupted.
+'''
+
+from pathlib import Path
+import pandas as pd
+import pytest
+import bfin.backtest.optimizer as OptimizerModule
+from bfin.backtest.optimizer import Optimizer
+from bfin.backtest.strategy_ma_cross import StrategyMACross
+
+DATA_DIR = Path(__file__).parent / 'data'
+INSTRUMENT = 'EUR_USD'
+PERIODS = {'short': (3, 15, 2), 'long': (10, 40, 5)}
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture(scope='module')
+def df_ohlc():
+    df = pd.read_csv(DATA_DIR / 'ohlc_eur_usd_m5.csv', index_col='Date')
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.index, utc=True)).tz_convert('America/New_York')
+    return df
+
+
+def optimize(df_ohlc, engine, checkpoint=None, trading=None, **kwargs):
+    generators = {'periods': PERIODS, **({'trading': trading} if trading else {})}
+    return Optimizer(df_ohlc, INSTRUMENT, 'M5', strategy=StrategyMACross, start_date=df_ohlc.index[100],
+                     generators=generators, portfolio={'initial_equity': 10000, 'margin_ratio': 25},
+                     use_multiprocessing=False, results='metrics', keep_top=0, engine=engine, checkpoint=checkpoint,
+                     **kwargs).optimize()
+
+
+def count_cells(monkeypatch, engine, evaluated, stop_after=None):
+    '''
+    Wraps the worker function of engine to record every cell it evaluates, raising Interrupted once stop_after
+    cells are done
+    '''
+    name = 'process_batch' if engine == 'batch' else 'process_periods'
+    process_task = getattr(OptimizerModule, name)
+
+    def counting(task):
+        if stop_after is not None and len(evaluated) >= stop_after:
+            raise Interrupted()
+        evaluated.extend([tuple(periods) for periods, _ in task] if engine == 'batch' else [tuple(task[0])])
+        return process_task(task)
+
+    monkeypatch.setattr(OptimizerModule, name, counting)
+
+
+def assert_same_results(expected, results):
+    counter, total_data = results
+    assert counter == expected[0]
+    assert total_data.keys() == expected[1].keys()
+    for key, data in expected[1].items():
+        pd.testing.assert_frame_equal(data['analysis'], total_data[key]['analysis'], check_dtype=False)
+
+
+@pytest.mark.parametrize('engine, search', [
+    ('portfolio', {}),
+    ('portfolio', {'search': 'random', 'budget': 20, 'seed': 4}),
+    ('batch', {}),
+])
+def test_resume(df_ohlc, tmp_path, monkeypatch, engine, search):
+    # Small blocks so the batch engine can be interrupted between them
+    monkeypatch.setattr(OptimizerModule, 'BATCH_BLOCK_SIZE', 4)
+    expected = optimize(df_ohlc, engine, **search)
+    cell_count = len(expected[0])
+    checkpoint = tmp_path / 'checkpoint.sqlite'
+
+    first = []
+    with monkeypatch.context() as patch:
+        count_cells(patch, engine, first, stop_after=cell_count // 2)
+        with pytest.raises(Interrupted):
+            optimize(df_ohlc, engine, checkpoint, **search)
+    assert 0 < len(first) < cell_count
+
+    second = []
+    with monkeypatch.context() as patch:
+        count_cells(patch, engine, second)
+        results = optimize(df_ohlc, engine, checkpoint, **search)
+    assert not set(first) & set(second)
+    assert len(first) + len(second) == len(set(first) | set(second)) == cell_count
+    assert_same_results(expected, results)
+
+    # Everything is stored now, a third run evaluates nothing
+    third = []
+    with monkeypatch.context() as patch:
+        count_cells(patch, engine, third)
+        assert_same_results(expected, optimize(df_ohlc, engine, checkpoint, **search))
+    assert third == []
+
+
+def test_resume_with_trading(df_ohlc, tmp_path, monkeypatch):
+    trading = {'stop_loss_gen': (0, 20, 10)}
+    expected = optimize(df_ohlc, 'portfolio', trading=trading)
+    checkpoint = tmp_path / 'checkpoint.sqlite'
+
+    with monkeypatch.context() as patch:
+        count_cells(patch, 'portfolio', [], stop_after=len(expected[0]) // 3)
+        with pytest.raises(Interrupted):
+            optimize(df_ohlc, 'portfolio', checkpoint, trading=trading)
+
+    evaluated = []
+    with monkeypatch.context() as patch:
+        count_cells(patch, 'portfolio', evaluated)
+        results = optimize(df_ohlc, 'portfolio', checkpoint, trading=trading)
+    assert len(evaluated) == len(expected[0]) - len(expected[0]) // 3
+    assert_same_results(expected, results)
+
+
+def test_other_search_does_not_reuse_cells(df_ohlc, tmp_path, monkeypatch):
+    checkpoint = tmp_path / 'checkpoint.sqlite'
+    optimize(df_ohlc, 'portfolio', checkpoint, search='random', budget=10, seed=1)
+    evaluated = []
+    with monkeypatch.context() as patch:
+        count_cells(patch, 'portfolio', evaluated)
+        optimize(df_ohlc, 'portfolio', checkpoint, search='random', budget=10, seed=2)
+    assert len(evaluated) == 10
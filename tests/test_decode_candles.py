@@ -0,0 +1,77 @@
+'''
+decode_candles() against the json_normalize decoder it replaced, on payloads in the v20 candles response format.
+
+oanda_candles_eur_usd_m5.json holds 60 M5 mid candles with RFC3339 times, including a weekend gap and an incomplete
+last candle, oanda_candles_eur_usd_m5_unix.json holds the same candles with UNIX datetime_format times.
+'''
+
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+from bfin.oanda.historical import decode_candles, OandaHistoricalError
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+
+def read_payload(name):
+    return (DATA_DIR / name).read_text()
+
+
+def legacy_load_dataframe(raw_body):
+    '''
+    OandaHistorical._load_dataframe() before decode_candles()
+    '''
+    df = pd.json_normalize(json.loads(raw_body), 'candles')
+    df.rename(columns={'time': 'Date', 'volume': 'Volume', 'mid.o': 'Open', 'mid.h': 'High', 'mid.l': 'Low',
+                       'mid.c': 'Close'}, inplace=True)
+    try:
+        df.set_index('Date', inplace=True)
+    except KeyError:
+        return None
+    df.index = pd.to_datetime(df.index)
+    df[['Open', 'High', 'Low', 'Close', 'Volume']] = df[['Open', 'High', 'Low', 'Close', 'Volume']].apply(
+        pd.to_numeric, errors='coerce')
+    return df
+
+
+def test_matches_json_normalize():
+    raw_body = read_payload('oanda_candles_eur_usd_m5.json')
+    df = decode_candles(raw_body)
+    pd.testing.assert_frame_equal(legacy_load_dataframe(raw_body), df)
+    assert len(df) == 60
+    assert not df['complete'].iloc[-1] and df['complete'].iloc[:-1].all()
+
+
+def test_bytes_payload():
+    raw_body = read_payload('oanda_candles_eur_usd_m5.json')
+    pd.testing.assert_frame_equal(decode_candles(raw_body), decode_candles(raw_body.encode()))
+
+
+def test_unix_times():
+    df = decode_candles(read_payload('oanda_candles_eur_usd_m5.json'))
+    df_unix = decode_candles(read_payload('oanda_candles_eur_usd_m5_unix.json'))
+    pd.testing.assert_frame_equal(df, df_unix)
+
+
+@pytest.mark.parametrize('raw_body', ['{"instrument": "EUR_USD", "granularity": "M5", "candles": []}',
+                                      '{"instrument": "EUR_USD", "granularity": "M5"}'])
+def test_no_candles(raw_body):
+    # The json_normalize decoder also returned None for an empty list, and raised KeyError without one
+    assert decode_candles(raw_body) is None
+
+
+def test_bid_ask_only():
+    payload = json.loads(read_payload('oanda_candles_eur_usd_m5.json'))
+    for candle in payload['candles']:
+        candle['bid'] = candle.pop('mid')
+    with pytest.raises(OandaHistoricalError):
+        decode_candles(json.dumps(payload))
+
+
+def test_price_precision():
+    payload = json.loads(read_payload('oanda_candles_eur_usd_m5.json'))
+    df = decode_candles(json.dumps(payload))
+    expected = np.array([float(candle['mid']['c']) for candle in payload['candles']])
+    np.testing.assert_array_equal(df['Close'].to_numpy(), expected)
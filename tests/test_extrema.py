@@ -0,0 +1,96 @@
+'''
+myutil.extrema.find_extrema() against scipy.signal.argrelextrema, on the numba reach stack and on the numpy sliding
+window path.
+
+Random arrays are drawn from a few values so neighbouring bars tie, repeated to make plateaus, and given NaN bars.
+'''
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.signal import argrelextrema
+import bfin.myutil.extrema as Extrema
+from bfin.myutil.extrema import find_extrema
+from bfin.myutil.indicators import add_extrema
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+B_USE_NUMBA = [pytest.param(True, id='numba', marks=pytest.mark.skipif(Extrema.njit is None, reason='needs numba')),
+               pytest.param(False, id='numpy')]
+
+
+def expected_extrema(values, order, b_maxima):
+    return argrelextrema(values, np.greater_equal if b_maxima else np.less_equal, order=order)[0]
+
+
+def random_arrays(count=300, seed=9):
+    rng = np.random.default_rng(seed)
+    for number in range(count):
+        length = int(rng.integers(1, 60))
+        values = rng.integers(0, 5, length).astype(np.float64)
+        if number % 2:
+            # Plateaus of up to 6 equal bars
+            values = np.repeat(values, rng.integers(1, 7, length))[:length]
+        if number % 3 == 0:
+            values[rng.random(length) < 0.1] = np.nan
+        yield values
+
+
+ARRAYS = [
+    np.array([1.0]),
+    np.array([np.nan]),
+    np.array([2.0, 2.0]),
+    np.array([1.0, 3.0, 3.0, 3.0, 1.0, 3.0]),
+    np.array([np.nan, 5.0, 1.0, 5.0, np.nan, 0.0, 0.0]),
+    np.full(9, 4.0),
+    *random_arrays(),
+]
+ORDERS = [1, 2, 3, 5, 8, 13, 40, 100]
+
+
+@pytest.mark.parametrize('b_maxima', [True, False], ids=['maxima', 'minima'])
+@pytest.mark.parametrize('b_use_numba', B_USE_NUMBA)
+def test_matches_argrelextrema(b_use_numba, b_maxima):
+    for values in ARRAYS:
+        ilocs_list = find_extrema(values, ORDERS, b_maxima=b_maxima, b_use_numba=b_use_numba)
+        assert len(ilocs_list) == len(ORDERS)
+        for order, ilocs in zip(ORDERS, ilocs_list):
+            np.testing.assert_array_equal(ilocs, expected_extrema(values, order, b_maxima),
+                                          err_msg=f'order {order} values {values.tolist()}')
+
+
+@pytest.mark.parametrize('b_use_numba', B_USE_NUMBA)
+def test_prices(b_use_numba):
+    df = pd.read_csv(DATA_DIR / 'ohlc_eur_usd_m5.csv', index_col='Date')
+    orders = [1, 5, 20, 150]
+    for column, b_maxima in (('High', True), ('Low', False)):
+        values = df[column].to_numpy()
+        for order, ilocs in zip(orders, find_extrema(values, orders, b_maxima=b_maxima, b_use_numba=b_use_numba)):
+            np.testing.assert_array_equal(ilocs, expected_extrema(values, order, b_maxima))
+
+
+@pytest.mark.parametrize('b_use_numba', B_USE_NUMBA)
+def test_empty(b_use_numba):
+    ilocs_list = find_extrema(np.array([]), [1, 4], b_use_numba=b_use_numba)
+    assert [len(ilocs) for ilocs in ilocs_list] == [0, 0]
+
+
+@pytest.mark.parametrize('order', [0, -1, 2.5])
+def test_bad_order(order):
+    with pytest.raises(RuntimeError):
+        find_extrema(np.array([1.0, 2.0]), [order])
+
+
+@pytest.mark.parametrize('b_use_numba', B_USE_NUMBA)
+def test_add_extrema(b_use_numba):
+    df = pd.read_csv(DATA_DIR / 'ohlc_eur_usd_m5.csv', index_col='Date')
+    add_extrema(df, period_short=5, period_medium=20, period_long=80, b_use_numba=b_use_numba)
+    for period, letter in ((5, 'S'), (20, 'M'), (80, 'L')):
+        b_high = np.zeros(len(df), dtype=bool)
+        b_high[expected_extrema(df['High'].to_numpy(), period, True)] = True
+        b_low = np.zeros(len(df), dtype=bool)
+        b_low[expected_extrema(df['Low'].to_numpy(), period, False)] = True
+        np.testing.assert_array_equal(df[f'E{letter}_HI'].notna(), b_high)
+        np.testing.assert_array_equal(df[f'E{letter}_LO'].notna(), b_low)
+        np.testing.assert_array_equal(df.loc[b_high, f'E{letter}_HI'], df.loc[b_high, 'High'])
@@ -0,0 +1,66 @@
+'''
+MovingAverageCache against the moving averages StrategyMACross computes itself.
+
+Exact short/long ties decide the signal, so the cached averages must be bit for bit the ta.sma() ones for an optimizer,
+batch engine or walk forward run to give the same trades as a backtest of the same periods.
+'''
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pandas_ta as ta
+import pytest
+from bfin.backtest.strategy_ma_cross import StrategyMACross
+from bfin.myutil.indicators import MovingAverageCache, sma_matrix
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+# Every pair on a grid, and pairs whose signals changed when the cache summed offsets
+PAIRS = sorted({(short, long) for short in range(2, 40) for long in range(short + 1, 160, 13)} |
+               {(26, 34), (2, 115), (2, 3), (3, 4), (2, 174)})
+
+
+@pytest.fixture(scope='module')
+def df_ohlc():
+    df = pd.read_csv(DATA_DIR / 'ohlc_eur_usd_m5.csv', index_col='Date')
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.index, utc=True)).tz_convert('America/New_York')
+    return df
+
+
+def test_signals_match_uncached(df_ohlc):
+    ma_cache = MovingAverageCache(df_ohlc['Close'], sorted({period for pair in PAIRS for period in pair}))
+    different = []
+    for pair in PAIRS:
+        signals = StrategyMACross('EUR_USD', df_ohlc, periods=pair).generate_signals()
+        signals_cached = StrategyMACross('EUR_USD', df_ohlc, periods=pair, ma_cache=ma_cache).generate_signals()
+        if not signals.equals(signals_cached):
+            different.append(pair)
+    assert different == []
+
+
+def test_sma_matrix_rows(df_ohlc):
+    close = df_ohlc['Close']
+    periods = [1, 2, 7, 50, len(close), len(close) + 1]
+    matrix = sma_matrix(close.to_numpy(), periods)
+    for row, period in enumerate(periods[:-1]):
+        np.testing.assert_array_equal(matrix[row], ta.sma(close, period).to_numpy())
+    # Longer than the series, every value is NaN
+    assert np.isnan(matrix[-1]).all()
+
+
+def test_sma_matrix_nan_and_empty():
+    values = np.array([1.0, 2.0, np.nan, 4.0, 5.0, 6.0, 7.0])
+    matrix = sma_matrix(values, [2, 3])
+    np.testing.assert_array_equal(matrix[0], pd.Series(values).rolling(2).mean().to_numpy())
+    np.testing.assert_array_equal(matrix[1], pd.Series(values).rolling(3).mean().to_numpy())
+    assert sma_matrix(np.array([]), [2, 3]).shape == (2, 0)
+
+
+def test_window(df_ohlc):
+    ma_cache = MovingAverageCache(df_ohlc['Close'], [5, 20])
+    window = ma_cache.window(df_ohlc.index[100:400])
+    pd.testing.assert_series_equal(window.sma(20), ma_cache.sma(20).iloc[100:400])
+    with pytest.raises(RuntimeError):
+        ma_cache.window(df_ohlc.index[[1, 3]])
+    with pytest.raises(RuntimeError):
+        ma_cache.sma(6)
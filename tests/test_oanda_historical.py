@@ -0,0 +1,100 @@
+'''
+OandaHistorical bulk downloads against the local fake v20 server in fake_v20.py.
+
+get_bulk_data_parallel() splits a range into fromTime/toTime windows of MAX_CANDLES_PER_REQUEST - 1 bar intervals and
+stitches the pages back together. These tests check that no window is refused for holding too many candles and that
+the stitched frame holds every bar of the range exactly once, whether or not the server includes a bar at toTime.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+from bfin.oanda.historical import OandaHistorical, OandaHistoricalError, MAX_CANDLES_PER_REQUEST, GRANULARITY_SECONDS
+from fake_v20 import FakeV20Server, candle_times, candle_values, DATA_START
+
+
+@pytest.fixture(params=[True, False], ids=['inclusive_to', 'exclusive_to'])
+def server(request):
+    with FakeV20Server(b_inclusive_to=request.param) as fake:
+        yield fake
+
+
+@pytest.fixture
+def historical(server):
+    return OandaHistorical(server.config())
+
+
+def expected_frame(granularity, start_time, end_time):
+    times = candle_times(granularity, start_time, end_time)
+    volume, *prices = candle_values(times)
+    columns = {name: [float(f'{value:.5f}') for value in values] for name, values in zip(('Open', 'High', 'Low', 'Close'), prices)}
+    return pd.DataFrame({'complete': True, 'Volume': volume.astype(np.int64), **columns},
+                        index=pd.DatetimeIndex(times, name='Date'))
+
+
+def window_ranges(server):
+    return [(pd.Timestamp(query['from']), pd.Timestamp(query['to'])) for query in server.requests]
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+@pytest.mark.parametrize('granularity, start_time, end_time', [
+    # Window edges fall on bar times
+    ('M1', DATA_START + pd.Timedelta(days=2), DATA_START + pd.Timedelta(days=10)),
+    # Start and end between bars
+    ('M1', DATA_START + pd.Timedelta(days=2, seconds=30), DATA_START + pd.Timedelta(days=10, seconds=45)),
+    # Windows of about 7 hours, Saturdays leave whole windows empty
+    ('S5', DATA_START + pd.Timedelta(days=6, hours=12), DATA_START + pd.Timedelta(days=8, hours=12)),
+    ('M5', DATA_START, DATA_START + pd.Timedelta(days=40)),
+])
+def test_parallel_stitches_every_bar_once(server, historical, granularity, start_time, end_time, max_workers):
+    df, windows = historical.get_bulk_data_parallel('EUR_USD', granularity, start_time, end_time, max_workers=max_workers,
+                                                    requests_per_second=1000)
+    assert windows == len(server.requests) > 1
+    assert df.index.is_unique and df.index.is_monotonic_increasing
+    pd.testing.assert_frame_equal(expected_frame(granularity, start_time, end_time), df, check_freq=False)
+
+
+def test_windows_hold_at_most_max_candles(server, historical):
+    start_time = DATA_START + pd.Timedelta(days=2)
+    end_time = start_time + pd.Timedelta(minutes=3 * MAX_CANDLES_PER_REQUEST + 17)
+    historical.get_bulk_data_parallel('EUR_USD', 'M1', start_time, end_time, max_workers=3, requests_per_second=1000)
+
+    ranges = sorted(window_ranges(server))
+    bar = pd.Timedelta(seconds=GRANULARITY_SECONDS['M1'])
+    # The last window reaches one bar past end_time so the bar at end_time is fetched even with an exclusive toTime
+    assert ranges[0][0] == start_time and ranges[-1][1] == end_time + bar
+    for (_, to_time), (from_time, _) in zip(ranges[:-1], ranges[1:]):
+        # Each window starts where the previous ended, a bar on the edge is in both and kept once
+        assert from_time == to_time
+    assert all((to_time - from_time) / bar <= MAX_CANDLES_PER_REQUEST - 1 for from_time, to_time in ranges)
+
+
+def test_window_edge_bars(server, historical):
+    start_time = DATA_START + pd.Timedelta(days=2)
+    edge = start_time + pd.Timedelta(minutes=MAX_CANDLES_PER_REQUEST - 1)
+    df, windows = historical.get_bulk_data_parallel('EUR_USD', 'M1', start_time, edge + pd.Timedelta(minutes=10),
+                                                    requests_per_second=1000)
+    assert windows == 2
+    assert (df.index == edge).sum() == 1
+    assert df.index[0] == start_time
+    assert df.index[-1] == edge + pd.Timedelta(minutes=10)
+    assert len(df) == MAX_CANDLES_PER_REQUEST + 10
+
+
+def test_parallel_matches_sequential(historical):
+    start_time = DATA_START + pd.Timedelta(days=3, minutes=7)
+    end_time = DATA_START + pd.Timedelta(days=12)
+    df_sequential, _ = historical.get_bulk_data('EUR_USD', 'M1', start_time, end_time, delay_between_requests=0)
+    df_parallel, _ = historical.get_bulk_data_parallel('EUR_USD', 'M1', start_time, end_time, requests_per_second=1000)
+    pd.testing.assert_frame_equal(df_sequential, df_parallel)
+
+
+def test_empty_range(historical):
+    # A Saturday holds no bars
+    start_time = DATA_START + pd.Timedelta(days=7, hours=1)
+    end_time = start_time + pd.Timedelta(hours=12)
+    df, windows = historical.get_bulk_data_parallel('EUR_USD', 'S5', start_time, end_time, requests_per_second=1000,
+                                                    b_allow_empty=True)
+    assert df is None and windows == 2
+    with pytest.raises(OandaHistoricalError):
+        historical.get_bulk_data_parallel('EUR_USD', 'S5', start_time, end_time, requests_per_second=1000)
@@ -0,0 +1,92 @@
+'''
+Regression tests of OHLCAnalysis.generate_extrema_dataframe() and add_extrema_dataframe_to_data() against the
+original per-extremum implementation.
+
+The frames in data/extrema_baseline were written by the original generate_extrema_dataframe(), which used
+scipy.signal.argrelextrema and counted each extremum's bars with a df.loc slice, on data/ohlc_eur_usd_m5.csv with
+periods 5 and 20 and on data/ohlc_eur_usd_h1.csv with period 10. The original add_extrema_dataframe_to_data() loop
+is kept below.
+'''
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.signal import argrelextrema
+from bfin.ohlc_analysis import OHLCAnalysis
+
+DATA_DIR = Path(__file__).parent / 'data'
+BASELINE_DIR = DATA_DIR / 'extrema_baseline'
+TIMEZONE = 'America/New_York'
+CASES = [('m5', 5), ('m5', 20), ('h1', 10)]
+
+
+def read_dates(values):
+    return pd.DatetimeIndex(pd.to_datetime(values, utc=True)).tz_convert(TIMEZONE)
+
+
+@pytest.fixture(scope='module')
+def sources():
+    frames = {}
+    for timeframe in ('m5', 'h1'):
+        df = pd.read_csv(DATA_DIR / f'ohlc_eur_usd_{timeframe}.csv', index_col='Date', float_precision='round_trip')
+        df.index = read_dates(df.index)
+        frames[timeframe] = df
+    return frames
+
+
+def read_baseline(timeframe, period):
+    df = pd.read_csv(BASELINE_DIR / f'{timeframe}_{period}.csv', index_col='Date', float_precision='round_trip')
+    df.index = read_dates(df.index)
+    df['next_date'] = read_dates(df['next_date'])
+    return df
+
+
+def legacy_add_extrema_dataframe_to_data(data, extrema):
+    '''
+    add_extrema_dataframe_to_data() before reindex
+    '''
+    for index, row in extrema.iterrows():
+        start_date = index
+        end_date = row['next_date']
+        for column in ['extrema_high', 'extrema_low', 'extrema', 'extrema_change']:
+            data.loc[start_date:end_date, column] = row[column]
+
+
+@pytest.mark.parametrize('timeframe, period', CASES)
+def test_extrema_match_baseline(sources, timeframe, period):
+    df_extrema = OHLCAnalysis.generate_extrema_dataframe(sources[timeframe], period)
+    pd.testing.assert_frame_equal(read_baseline(timeframe, period), df_extrema, check_exact=True, check_freq=False,
+                                  check_index_type=False)
+
+
+@pytest.mark.parametrize('timeframe, period', CASES)
+def test_add_extrema_match_legacy(sources, timeframe, period):
+    df_extrema = read_baseline(timeframe, period)
+    expected = sources[timeframe].copy()
+    data = sources[timeframe].copy()
+    legacy_add_extrema_dataframe_to_data(expected, df_extrema)
+    OHLCAnalysis.add_extrema_dataframe_to_data(data, df_extrema)
+    pd.testing.assert_frame_equal(expected, data, check_exact=True)
+    assert data['extrema'].notna().any()
+
+
+def test_add_extrema_to_part_of_data(sources):
+    # A chart's bars, extrema before and after them only fill the rows they cover
+    df_extrema = read_baseline('m5', 20)
+    expected = sources['m5'].iloc[700:1300].copy()
+    expected['extrema'] = -1.0
+    data = expected.copy()
+    legacy_add_extrema_dataframe_to_data(expected, df_extrema)
+    OHLCAnalysis.add_extrema_dataframe_to_data(data, df_extrema)
+    pd.testing.assert_frame_equal(expected, data, check_exact=True)
+
+
+def test_extrema_with_ties():
+    # Equal highs and lows on neighbouring bars are each an extremum, as np.greater_equal / np.less_equal made them
+    high = np.array([1.0, 2.0, 3.0, 3.0, 2.0, 1.0, 1.0, 0.5, 2.0, 2.0, 2.0, 1.0])
+    index = pd.date_range('2022-01-03', periods=len(high), freq='5min', tz=TIMEZONE, name='Date')
+    df = pd.DataFrame({'High': high, 'Low': high - 0.25}, index=index)
+    df_extrema = OHLCAnalysis.generate_extrema_dataframe(df, 2)
+    assert list(df_extrema.index[df_extrema['extrema_high'].notna()]) == list(index[argrelextrema(high, np.greater_equal, order=2)[0]])
+    assert list(df_extrema.index[df_extrema['extrema_low'].notna()]) == list(index[argrelextrema(high - 0.25, np.less_equal, order=2)[0]])
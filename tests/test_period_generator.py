@@ -0,0 +1,73 @@
+'''
+myutil.period_generator(), period_generator_count() and period_generator_item() against the original
+product-and-filter generator on random grids, with negative steps, empty ranges and filtered=False.
+'''
+
+from itertools import product
+import numpy as np
+import pytest
+import bfin.myutil as Utils
+
+
+def legacy_period_generator(*args, filtered=True):
+    '''
+    period_generator() before the filtered walk
+    '''
+    vals = []
+    for arg in args:
+        vals.append([i for i in range(*arg)])
+    vals = product(*vals)
+    for row in vals:
+        if filtered and any([0 if row[i] < row[i+1] else 1 for i in range(len(row)-1)]):
+            continue
+        yield(row)
+
+
+def random_grids(count=250, seed=13):
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        grid = []
+        for _ in range(int(rng.integers(0, 5))):
+            step = int(rng.choice([-5, -3, -2, -1, 1, 2, 3, 4, 7]))
+            start = int(rng.integers(-10, 40))
+            stop = start + step * int(rng.integers(-1, 7))
+            grid.append((start, stop, step))
+        yield grid
+
+
+GRIDS = [
+    [],
+    [(1, 5, 1)],
+    [(5, 1, -1)],
+    [(1, 1, 1), (2, 6, 1)],
+    [(3, 20, 2), (3, 20, 2), (3, 20, 2)],
+    [(30, 0, -4), (1, 40, 3), (50, 10, -7)],
+    *random_grids(),
+]
+
+
+@pytest.mark.parametrize('b_filtered', [True, False], ids=['filtered', 'unfiltered'])
+def test_generator_and_count(b_filtered):
+    for grid in GRIDS:
+        expected = list(legacy_period_generator(*grid, filtered=b_filtered))
+        assert list(Utils.period_generator(*grid, filtered=b_filtered)) == expected, grid
+        count = Utils.period_generator_count(*grid, filtered=b_filtered)
+        assert count == len(expected) and type(count) is int, grid
+
+
+def test_item():
+    for grid in GRIDS:
+        expected = list(legacy_period_generator(*grid))
+        assert [Utils.period_generator_item(index, *grid) for index in range(len(expected))] == expected, grid
+        for index in (-1, len(expected)):
+            with pytest.raises(IndexError):
+                Utils.period_generator_item(index, *grid)
+
+
+def test_generator_is_lazy():
+    # The first tuple of a grid with about 10**15 combinations
+    grid = [(1, 10000, 1)] * 4
+    assert next(Utils.period_generator(*grid)) == (1, 2, 3, 4)
+    assert Utils.period_generator_count(*grid) == 416250145812501
+    assert Utils.period_generator_item(0, *grid) == (1, 2, 3, 4)
+    assert Utils.period_generator_item(416250145812500, *grid) == (9996, 9997, 9998, 9999)
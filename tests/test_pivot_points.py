@@ -0,0 +1,119 @@
+'''
+Regression tests of the pivot_points groupby aggregate and PivotLevels against the original per-group implementation.
+
+The records in data/pivot_baseline were written by the original calculate_*_pivots_from_* functions, which looped
+over the groups of strftime() keys, on data/ohlc_eur_usd_h1.csv and data/ohlc_eur_usd_d.csv. The H1 bars cover the
+2021 and 2022 daylight saving changes and a new year whose first days fall in week 0. The level columns are checked
+against the original add_interday_to_intraday() loop below, run on the baseline records.
+'''
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+import bfin.pivot_points as Pivots
+
+DATA_DIR = Path(__file__).parent / 'data'
+BASELINE_DIR = DATA_DIR / 'pivot_baseline'
+TIMEZONE = 'America/New_York'
+PREFIXES = {'daily': 'Day', 'weekly': 'Wk', 'monthly': 'Mn'}
+
+
+def read_dates(values):
+    return pd.DatetimeIndex(pd.to_datetime(values, utc=True)).tz_convert(TIMEZONE)
+
+
+def read_ohlc(name):
+    df = pd.read_csv(DATA_DIR / name, index_col='Date', float_precision='round_trip')
+    df.index = read_dates(df.index)
+    return df
+
+
+@pytest.fixture(scope='module')
+def sources():
+    return {'intraday': read_ohlc('ohlc_eur_usd_h1.csv'), 'daily': read_ohlc('ohlc_eur_usd_d.csv')}
+
+
+def read_baseline(name):
+    df = pd.read_csv(BASELINE_DIR / f'{name}.csv', float_precision='round_trip')
+    for column in ('start', 'end'):
+        df[column] = read_dates(df[column])
+    return df
+
+
+def baseline_records(name):
+    return [{key: value for key, value in record.items() if not (isinstance(value, float) and np.isnan(value))}
+            for record in read_baseline(name).to_dict('records')]
+
+
+def legacy_add_interday_to_intraday(df_intra, pivots_inter, prefix):
+    '''
+    add_interday_to_intraday() before PivotLevels
+    '''
+    columns = [f'{prefix}{x}' for x in ['S3', 'S2', 'S1', 'PP', 'R1', 'R2', 'R3']]
+    if len(pivots_inter) == 0:
+        return
+    for pivot in pivots_inter[1:]:
+        df_intra.loc[pivot['start']:pivot['end'], columns] = [pivot[x] for x in columns]
+
+
+@pytest.mark.parametrize('source', ['daily', 'intraday'])
+@pytest.mark.parametrize('period', list(PREFIXES))
+def test_pivots_match_baseline(sources, period, source):
+    name = f'{period}_from_{source}'
+    pivots = getattr(Pivots, f'calculate_{period}_pivots_from_{source}')(sources[source])
+    pd.testing.assert_frame_equal(read_baseline(name), pd.DataFrame(pivots), check_exact=True, check_dtype=False)
+    assert f'{PREFIXES[period]}PP' not in pivots[0]
+
+
+def source_pivots(sources, period, source):
+    '''
+    Baseline records ready to map onto the H1 bars, daily sourced periods are stretched to the next period's start
+    '''
+    pivots = baseline_records(f'{period}_from_{source}')
+    if source == 'daily':
+        Pivots._adjust_pivots_end_date(pivots, sources['intraday'].index[-1])
+    return pivots
+
+
+@pytest.mark.parametrize('source', ['daily', 'intraday'])
+def test_levels_match_legacy(sources, source):
+    df_intra = sources['intraday']
+    expected = df_intra[[]].copy()
+    df_levels = df_intra[[]].copy()
+    df_added = df_intra[[]].copy()
+    frames = []
+    for period, prefix in PREFIXES.items():
+        pivots = source_pivots(sources, period, source)
+        legacy_add_interday_to_intraday(expected, pivots, prefix)
+        Pivots.PivotLevels(pivots, prefix).add_to_dataframe(df_levels)
+        Pivots.add_interday_to_intraday(df_added, pivots, prefix)
+        frames.append(Pivots.PivotLevels(pivots, prefix).to_frame(df_intra.index))
+
+    # Bars before the second period have no levels in either
+    assert expected.isna().any().all() and expected.notna().any().all()
+    pd.testing.assert_frame_equal(expected, df_levels, check_exact=True)
+    pd.testing.assert_frame_equal(expected, df_added, check_exact=True)
+    pd.testing.assert_frame_equal(expected, pd.concat(frames, axis=1), check_exact=True)
+
+
+def test_levels_keep_existing_values(sources):
+    # Rows no period covers keep the values a column already had, as the .loc assignments did
+    df_intra = sources['intraday']
+    pivots = source_pivots(sources, 'weekly', 'intraday')[5:9]
+    expected = df_intra[[]].assign(**{f'Wk{level}': -1.0 for level in Pivots.LEVELS})
+    df_levels = expected.copy()
+    legacy_add_interday_to_intraday(expected, pivots, 'Wk')
+    Pivots.PivotLevels(pivots, 'Wk').add_to_dataframe(df_levels)
+    pd.testing.assert_frame_equal(expected, df_levels, check_exact=True)
+    assert (df_levels['WkPP'] == -1.0).any() and (df_levels['WkPP'] != -1.0).any()
+
+
+@pytest.mark.parametrize('count', [0, 1])
+def test_no_levels(sources, count):
+    pivots = source_pivots(sources, 'monthly', 'intraday')[:count]
+    df_levels = sources['intraday'][[]].copy()
+    Pivots.PivotLevels(pivots, 'Mn').add_to_dataframe(df_levels)
+    Pivots.add_interday_to_intraday(df_levels, pivots, 'Mn')
+    assert len(df_levels.columns) == 0
+    assert Pivots.PivotLevels(pivots, 'Mn').to_frame(df_levels.index).isna().all().all()
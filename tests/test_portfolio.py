@@ -0,0 +1,101 @@
+'''
+Regression tests of Portfolio.generate_positions() against the original per-trade implementation.
+
+The frames in data/portfolio_baseline were written by the groupby based generate_positions() and the iterrows based
+generate_equity_curve() that the vectorized versions replaced, on data/ohlc_eur_usd_m5.csv with
+StrategyMACross(periods=(5, 20)) signals. The original priced the take profit from stop_loss and raised when only
+take_profit was set, so take_only.csv was written with that one line corrected. stop_take.csv uses equal stop and take
+distances, where the original's take price was already right.
+'''
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+from bfin.backtest.portfolio import Portfolio
+from bfin.backtest.strategy_ma_cross import StrategyMACross
+
+DATA_DIR = Path(__file__).parent / 'data'
+BASELINE_DIR = DATA_DIR / 'portfolio_baseline'
+TIMEZONE = 'America/New_York'
+
+CASES = {
+    'signal': {},
+    'stop_only': {'stop_loss': 10},
+    'take_only': {'take_profit': 12},
+    'equity': {'initial_equity': 10000, 'margin_ratio': 25},
+    'equity_top_off': {'stop_loss': 8, 'initial_equity': 10000, 'margin_ratio': 25, 'b_top_off_equity': True},
+}
+
+
+def read_dates(values):
+    return pd.DatetimeIndex(pd.to_datetime(values, utc=True)).tz_convert(TIMEZONE)
+
+
+@pytest.fixture(scope='module')
+def df_ohlc():
+    df = pd.read_csv(DATA_DIR / 'ohlc_eur_usd_m5.csv', index_col='Date')
+    df.index = read_dates(df.index)
+    return df
+
+
+@pytest.fixture(scope='module')
+def signals(df_ohlc):
+    return StrategyMACross('EUR_USD', df_ohlc, periods=(5, 20)).generate_signals()
+
+
+def read_baseline(name):
+    df = pd.read_csv(BASELINE_DIR / f'{name}.csv')
+    for column in ('date_opened', 'date_closed'):
+        df[column] = read_dates(df[column])
+    df['direction'] = df['direction'].astype(np.float64)
+    return df
+
+
+def compare_positions(expected, positions):
+    pd.testing.assert_frame_equal(expected, positions.reset_index(drop=True), check_dtype=False)
+
+
+@pytest.mark.parametrize('b_use_numba', [True, False])
+@pytest.mark.parametrize('name', list(CASES))
+def test_positions_match_baseline(df_ohlc, signals, name, b_use_numba):
+    positions = Portfolio('EUR_USD', df_ohlc, signals, b_use_numba=b_use_numba, **CASES[name]).generate_positions()
+    compare_positions(read_baseline(name), positions)
+
+
+@pytest.mark.parametrize('b_use_numba', [True, False])
+def test_stop_and_take_exit_on_first_touch(df_ohlc, signals, b_use_numba):
+    '''
+    The original let any stop touch win, the fix exits on whichever level is touched first. Only trades whose take
+    was touched on an earlier bar than their stop may differ from the baseline.
+    '''
+    expected = read_baseline('stop_take')
+    positions = Portfolio('EUR_USD', df_ohlc, signals, stop_loss=10, take_profit=10,
+                          b_use_numba=b_use_numba).generate_positions().reset_index(drop=True)
+
+    b_changed = (expected['close_type'] == 'Stop') & (positions['close_type'] == 'Take')
+    assert b_changed.any()
+    assert (positions.loc[b_changed, 'date_closed'] < expected.loc[b_changed, 'date_closed']).all()
+    assert (positions.loc[b_changed, 'bars_held'] < expected.loc[b_changed, 'bars_held']).all()
+    np.testing.assert_allclose(positions.loc[b_changed, 'pips_profit'], 10 * 0.0001)
+    compare_positions(expected[~b_changed].reset_index(drop=True), positions[~b_changed])
+
+
+def test_equity_curve_matches_baseline(df_ohlc, signals):
+    expected = pd.read_csv(BASELINE_DIR / 'equity_curve.csv', index_col='date')
+    expected.index = read_dates(expected.index)
+    portfolio = Portfolio('EUR_USD', df_ohlc, signals, stop_loss=8, margin_ratio=25)
+    curve = portfolio.generate_equity_curve(portfolio.generate_positions(), 1000, b_top_off_equity=True)
+    pd.testing.assert_frame_equal(expected, curve, check_freq=False)
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'stop_loss': 10, 'take_profit': 10}, {'initial_equity': 10000}])
+def test_no_trades(df_ohlc, kwargs):
+    # The long average never warms up, every signal is flat
+    df = df_ohlc.iloc[:15]
+    signals = StrategyMACross('EUR_USD', df, periods=(5, 20)).generate_signals()
+    positions = Portfolio('EUR_USD', df, signals, **kwargs).generate_positions()
+    assert len(positions) == 0
+    expected_columns = Portfolio.POSITION_COLUMNS + (['equity'] if 'initial_equity' in kwargs else [])
+    assert list(positions.columns) == expected_columns
+    assert len(Portfolio('EUR_USD', df, signals).generate_equity_curve(positions, 10000)) == 0
@@ -0,0 +1,163 @@
+'''
+myutil.run_length_encode(), get_ranges_from_dataframe() and add_ranges_to_dataframe() against the groupby and .loc
+implementations they replaced, kept below as legacy_*.
+
+Columns are drawn from a few values with zero and NaN runs, and the pivot level columns of data/ohlc_eur_usd_h1.csv
+are the ranges ChartPrinter draws as lines.
+'''
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+import bfin.myutil as Utils
+import bfin.pivot_points as Pivots
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+
+def legacy_get_ranges_from_dataframe(df_input, column_name, drop_first_zero=True, drop_nan=True, bar_length=False):
+    '''
+    get_ranges_from_dataframe() before run_length_encode()
+    '''
+    ranges = []
+    data = pd.DataFrame(index=df_input.index)
+    data['change'] = df_input[column_name].ne(df_input[column_name].shift().fillna(0)).cumsum()
+    for index, block in data.groupby(data['change']):
+        start_date = block.iloc[0].name
+        end_date = block.iloc[-1].name
+        value = df_input.loc[start_date][column_name]
+        if bar_length:
+            bars = len(df_input.loc[start_date:end_date])
+            ranges.append([start_date, end_date, value, bars])
+        else:
+            ranges.append([start_date, end_date, value])
+    if bar_length:
+        df_result = pd.DataFrame(columns=['StartDateTime', 'EndDateTime', 'Value', 'Bars'], data=ranges)
+    else:
+        df_result = pd.DataFrame(columns=['StartDateTime', 'EndDateTime', 'Value'], data=ranges)
+    if drop_first_zero:
+        if df_result.iloc[0]['Value'] == 0:
+            df_result = df_result[1:]
+    if drop_nan:
+        df_result = df_result.dropna()
+    return df_result
+
+
+def legacy_add_ranges_to_dataframe(df_target, df_ranges, column_name):
+    '''
+    add_ranges_to_dataframe() before searchsorted
+    '''
+    for index, row in df_ranges.iterrows():
+        df_target.loc[row["StartDateTime"]:row["EndDateTime"], column_name] = row['Value']
+
+
+def make_frame(values):
+    index = pd.date_range('2022-01-03', periods=len(values), freq='15min', tz='America/New_York', name='Date')
+    return pd.DataFrame({'level': values}, index=index)
+
+
+def random_columns(count=60, seed=5):
+    rng = np.random.default_rng(seed)
+    choices = np.array([0.0, 0.0, 1.5, 2.3, np.nan, np.nan])
+    for _ in range(count):
+        length = int(rng.integers(1, 40))
+        # Repeat each drawn value to make runs of several bars
+        yield np.repeat(rng.choice(choices, length), rng.integers(1, 4, length))[:length]
+
+
+COLUMNS = [
+    [1.5],
+    [0.0],
+    [np.nan],
+    [0.0, 0.0, 1.5, 1.5, 0.7, 2.3, 2.3],
+    [np.nan, np.nan, 0.0, 0.0, 1.5, np.nan, 0.0, 1.5, 1.5],
+    [1.5, np.nan, np.nan, 1.5, 0.0, 0.0, np.nan],
+    *random_columns(),
+]
+
+
+@pytest.mark.parametrize('bar_length', [False, True])
+@pytest.mark.parametrize('drop_first_zero, drop_nan', [(True, True), (False, False), (True, False), (False, True)])
+def test_ranges_match_legacy(drop_first_zero, drop_nan, bar_length):
+    for values in COLUMNS:
+        df = make_frame(values)
+        expected = legacy_get_ranges_from_dataframe(df, 'level', drop_first_zero, drop_nan, bar_length)
+        df_ranges = Utils.get_ranges_from_dataframe(df, 'level', drop_first_zero, drop_nan, bar_length)
+        pd.testing.assert_frame_equal(expected, df_ranges, check_exact=True)
+
+
+def test_integer_column():
+    df = make_frame(np.array([0, 0, 3, 3, 3, 1, 0, 0, 2]))
+    for drop_first_zero in (True, False):
+        expected = legacy_get_ranges_from_dataframe(df, 'level', drop_first_zero, bar_length=True)
+        pd.testing.assert_frame_equal(expected, Utils.get_ranges_from_dataframe(df, 'level', drop_first_zero, bar_length=True),
+                                      check_exact=True)
+
+
+def test_run_length_encode():
+    starts, ends, values, bars = Utils.run_length_encode(np.array([np.nan, np.nan, 0.0, 2.0, 2.0, 0.0]))
+    # A NaN never equals the value after it, the value after a NaN is compared to 0
+    np.testing.assert_array_equal(starts, [0, 1, 3, 5])
+    np.testing.assert_array_equal(ends, [0, 2, 4, 5])
+    np.testing.assert_array_equal(values, [np.nan, np.nan, 2.0, 0.0])
+    np.testing.assert_array_equal(bars, [1, 2, 2, 1])
+
+    starts, ends, values, bars = Utils.run_length_encode(np.array([7]))
+    assert (starts.tolist(), ends.tolist(), values.tolist(), bars.tolist()) == ([0], [0], [7], [1])
+
+
+def test_empty():
+    assert all(len(array) == 0 for array in Utils.run_length_encode(np.array([])))
+    # The legacy version raised IndexError looking for a first row to drop
+    df_ranges = Utils.get_ranges_from_dataframe(make_frame([]), 'level', bar_length=True)
+    assert len(df_ranges) == 0 and list(df_ranges.columns) == ['StartDateTime', 'EndDateTime', 'Value', 'Bars']
+
+    df_target = make_frame([1.0, 2.0])
+    Utils.add_ranges_to_dataframe(df_target, df_ranges, 'level')
+    Utils.add_ranges_to_dataframe(df_target, df_ranges, 'new_level')
+    pd.testing.assert_frame_equal(make_frame([1.0, 2.0]), df_target)
+
+
+@pytest.fixture(scope='module')
+def df_h1():
+    df = pd.read_csv(DATA_DIR / 'ohlc_eur_usd_h1.csv', index_col='Date')
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.index, utc=True)).tz_convert('America/New_York')
+    for prefix, pivots in (('Day', Pivots.calculate_daily_pivots_from_intraday(df)),
+                           ('Wk', Pivots.calculate_weekly_pivots_from_intraday(df))):
+        Pivots.PivotLevels(pivots, prefix).add_to_dataframe(df)
+    return df
+
+
+@pytest.mark.parametrize('column_name', ['DayPP', 'DayR3', 'WkS1'])
+def test_pivot_lines_match_legacy(df_h1, column_name):
+    expected = legacy_get_ranges_from_dataframe(df_h1, column_name, bar_length=True)
+    df_ranges = Utils.get_ranges_from_dataframe(df_h1, column_name, bar_length=True)
+    pd.testing.assert_frame_equal(expected, df_ranges, check_exact=True)
+
+    # Written back onto a coarser index the lines give the original column
+    df_expected = df_h1[[]].iloc[::3].copy()
+    df_target = df_expected.copy()
+    legacy_add_ranges_to_dataframe(df_expected, df_ranges, column_name)
+    Utils.add_ranges_to_dataframe(df_target, df_ranges, column_name)
+    pd.testing.assert_frame_equal(df_expected, df_target, check_exact=True)
+    pd.testing.assert_series_equal(df_h1[column_name].iloc[::3], df_target[column_name], check_exact=True)
+
+
+@pytest.mark.parametrize('existing', [None, 9.0, 4])
+def test_add_ranges_match_legacy(existing):
+    df_expected = make_frame(np.arange(12, dtype=np.float64))[[]]
+    if existing is not None:
+        df_expected['level'] = existing
+    df_target = df_expected.copy()
+    index = df_expected.index
+    bar = index[1] - index[0]
+    df_ranges = pd.DataFrame({
+        # Edges on bars, between bars, before and after the index, overlapping and ending before they start
+        'StartDateTime': [index[0] - 5 * bar, index[2], index[4] + bar / 2, index[6], index[10], index[11] + bar, index[9]],
+        'EndDateTime': [index[0], index[3], index[7] - bar / 3, index[8], index[11] + 4 * bar, index[11] + 2 * bar, index[8]],
+        'Value': [1.5, 0.7, 2.3, -1.0, 0.0, 8.0, 6.0],
+    })
+    legacy_add_ranges_to_dataframe(df_expected, df_ranges, 'level')
+    Utils.add_ranges_to_dataframe(df_target, df_ranges, 'level')
+    pd.testing.assert_frame_equal(df_expected, df_target, check_exact=True)
@@ -0,0 +1,94 @@
+'''
+The optimizer's search samplers in backtest.search, random and Latin hypercube sampling of a SearchSpace and the
+successive halving schedule.
+'''
+
+import random
+import pytest
+import bfin.myutil as Utils
+from bfin.backtest.search import SearchSpace, sample_random, sample_latin_hypercube, halving_rungs
+
+PERIODS = [(3, 30, 2), (10, 80, 5), (40, 200, 10)]
+TRADING = {'stop_loss_gen': (0, 40, 10), 'take_profit_gen': (0, 60, 20)}
+SAMPLERS = [pytest.param(sample_random, id='random'), pytest.param(sample_latin_hypercube, id='lhs')]
+
+
+def key(task):
+    periods, trading = task
+    return tuple(periods), tuple(sorted(trading.items()))
+
+
+@pytest.fixture(params=[None, TRADING], ids=['periods', 'trading'])
+def space(request):
+    return SearchSpace(PERIODS, request.param)
+
+
+def test_space(space):
+    tasks = list(space)
+    assert len(tasks) == len(space) == Utils.period_generator_count(*PERIODS) * len(space.trading_list)
+    assert [space.item(index) for index in range(0, len(space), 7)] == tasks[::7]
+
+
+@pytest.mark.parametrize('sampler', SAMPLERS)
+def test_seed_determinism(space, sampler):
+    first = sampler(space, 40, random.Random(5))
+    assert sampler(space, 40, random.Random(5)) == first
+    assert sampler(space, 40, random.Random(6)) != first
+
+
+@pytest.mark.parametrize('sampler', SAMPLERS)
+@pytest.mark.parametrize('budget', [1, 17, 120])
+def test_samples_in_grid(space, sampler, budget):
+    grid = {key(task) for task in space}
+    for seed in range(5):
+        tasks = sampler(space, budget, random.Random(seed))
+        keys = [key(task) for task in tasks]
+        assert len(tasks) == budget and len(set(keys)) == budget
+        assert set(keys) <= grid
+
+
+@pytest.mark.parametrize('sampler', SAMPLERS)
+def test_budget_covers_space(sampler):
+    space = SearchSpace([(2, 8, 2), (4, 12, 4)], {'stop_loss_gen': (0, 20, 10)})
+    for budget in (len(space), len(space) + 5):
+        assert sampler(space, budget, random.Random(1)) == list(space)
+
+
+def test_latin_hypercube_strata():
+    # With one generator every tenth of it is sampled exactly once
+    space = SearchSpace([(0, 100, 1)])
+    tasks = sample_latin_hypercube(space, 10, random.Random(3))
+    assert sorted(periods[0] // 10 for periods, _ in tasks) == list(range(10))
+
+
+def test_latin_hypercube_fills_shortfall():
+    # Few increasing points in the strata, the rest come from sample_random()
+    space = SearchSpace([(1, 40, 1), (1, 40, 1), (1, 40, 1)])
+    tasks = sample_latin_hypercube(space, 200, random.Random(0), max_rounds=1)
+    assert len({key(task) for task in tasks}) == 200
+    assert all(periods[0] < periods[1] < periods[2] for periods, _ in tasks)
+
+
+@pytest.mark.parametrize('candidate_count, eta, min_fraction, expected', [
+    (1, 3, 0.01, [(1.0, 1)]),
+    (2, 3, 0.01, [(1.0, 2)]),
+    (27, 3, 0.01, [(1 / 27, 27), (1 / 9, 9), (1 / 3, 3), (1.0, 1)]),
+    (27, 3, 0.1, [(1 / 9, 27), (1 / 3, 9), (1.0, 3)]),
+    (10, 2, 0.01, [(1 / 8, 10), (1 / 4, 5), (1 / 2, 3), (1.0, 2)]),
+    (100, 4, 1.0, [(1.0, 100)]),
+])
+def test_halving_rungs(candidate_count, eta, min_fraction, expected):
+    assert halving_rungs(candidate_count, eta, min_fraction) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('eta', [2, 3, 4])
+def test_halving_rungs_sizes(eta):
+    for candidate_count in range(1, 300, 7):
+        rungs = halving_rungs(candidate_count, eta, 0.02)
+        fractions = [fraction for fraction, _ in rungs]
+        counts = [candidates for _, candidates in rungs]
+        assert fractions[-1] == 1.0 and fractions[0] >= 0.02
+        assert fractions == pytest.approx([eta ** (rung - len(rungs) + 1) for rung in range(len(rungs))])
+        assert counts[0] == candidate_count and counts[-1] >= 1
+        assert all(later == max(1, -(-earlier // eta)) for earlier, later in zip(counts, counts[1:]))
+        assert eta ** (len(rungs) - 1) <= candidate_count
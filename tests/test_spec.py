@@ -0,0 +1,73 @@
+'''
+spec.build_jobs() on data/spec_ma_cross.yaml, an example like the one in the spec module docstring, and on a JSON copy.
+'''
+
+import json
+from pathlib import Path
+import pandas as pd
+import pytest
+import bfin.backtest.spec as Spec
+from bfin.backtest.strategy_ma_cross import StrategyMACross
+
+DATA_DIR = Path(__file__).parent / 'data'
+TIMEZONE = 'America/New_York'
+
+
+@pytest.fixture
+def spec():
+    return Spec.load_spec_file(DATA_DIR / 'spec_ma_cross.yaml')
+
+
+def test_build_jobs(spec):
+    first, second = Spec.build_jobs(spec)
+
+    assert (first['instrument'], first['timeframe']) == ('EUR_USD', 'H1')
+    assert first['start_date'] == pd.Timestamp('2022-01-01', tz=TIMEZONE)
+    assert first['end_date'] == pd.Timestamp('2023-01-01', tz=TIMEZONE)
+    assert first['strategy'] is StrategyMACross
+    assert first['generators'] == {'periods': {'short': (5, 60, 5), 'long': (20, 200, 10)},
+                                   'trading': {'stop_loss_gen': (10, 50, 10)}}
+    assert first['periods'] == (10, 50)
+    assert first['portfolio'] == {'initial_equity': 10000, 'margin_ratio': 25, 'b_top_off_equity': False}
+    assert first['options'] == {'engine': 'portfolio', 'search': 'random', 'budget': 500, 'seed': 7}
+
+    # Job settings override the top level ones, strategy names are matched without case
+    assert (second['instrument'], second['timeframe']) == ('USD_JPY', 'M15')
+    assert second['strategy'] is StrategyMACross
+    assert second['portfolio'] == {'initial_equity': 5000, 'margin_ratio': 25, 'b_top_off_equity': True}
+    assert second['options'] == {'engine': 'portfolio', 'search': 'grid', 'budget': 500, 'seed': 7}
+
+
+def test_json_spec(spec, tmp_path):
+    path = tmp_path / 'spec.json'
+    path.write_text(json.dumps(spec))
+    assert Spec.build_jobs(Spec.load_spec_file(path)) == Spec.build_jobs(spec)
+
+
+def test_single_job(spec):
+    del spec['jobs']
+    spec.update({'instrument': 'GBP_USD', 'timeframe': 'D', 'start': '2021-06-01'})
+    (job,) = Spec.build_jobs(spec)
+    assert (job['instrument'], job['timeframe']) == ('GBP_USD', 'D')
+    assert job['end_date'] > job['start_date']
+
+
+@pytest.mark.parametrize('change', [
+    {'jobs': [{'timeframe': 'H1', 'start': '2022-01-01'}]},
+    {'optimizer': {'engine': 'batch', 'budgett': 10}},
+    {'strategy': 'StrategyUnknown'},
+    {'generators': {'periods': {'short': [5, 60]}}},
+    {'generators': {'trading': {'stop_loss_gen': [10, 50, 10]}}},
+    {'portfolio': [10000]},
+], ids=['missing_instrument', 'unknown_option', 'unknown_strategy', 'short_generator', 'no_periods', 'portfolio_list'])
+def test_bad_spec(spec, change):
+    spec.update(change)
+    with pytest.raises(RuntimeError):
+        Spec.build_jobs(spec)
+
+
+def test_unknown_file_type(tmp_path):
+    path = tmp_path / 'spec.toml'
+    path.write_text('strategy = "StrategyMACross"')
+    with pytest.raises(RuntimeError):
+        Spec.load_spec_file(path)
@@ -0,0 +1,73 @@
+'''
+WalkForward.run() positions across out-of-sample windows.
+
+With a single combination every window wins with the same settings, so the stitched out-of-sample positions must
+be the positions of one Portfolio over the whole series from the first out-of-sample bar on, including the trades
+open across a window edge.
+'''
+
+from pathlib import Path
+import pandas as pd
+import pytest
+from bfin.backtest.portfolio import Portfolio
+from bfin.backtest.strategy_ma_cross import StrategyMACross
+from bfin.backtest.walk_forward import WalkForward
+
+DATA_DIR = Path(__file__).parent / 'data'
+INSTRUMENT = 'EUR_USD'
+PERIODS = {'short': (5, 6, 1), 'long': (20, 21, 1)}
+
+
+@pytest.fixture(scope='module')
+def df_ohlc():
+    df = pd.read_csv(DATA_DIR / 'ohlc_eur_usd_m5.csv', index_col='Date')
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.index, utc=True)).tz_convert('America/New_York')
+    return df
+
+
+def walk_forward(df_ohlc, portfolio, trading=None):
+    generators = {'periods': PERIODS, **({'trading': trading} if trading else {})}
+    return WalkForward(df_ohlc, INSTRUMENT, 'M5', strategy=StrategyMACross, start_date=df_ohlc.index[100],
+                       in_sample_bars=400, out_sample_bars=300, generators=generators, portfolio=portfolio,
+                       use_multiprocessing=False)
+
+
+@pytest.mark.parametrize('portfolio, trading, settings', [
+    ({}, None, {}),
+    ({'initial_equity': 10000, 'margin_ratio': 25}, None, {}),
+    ({'initial_equity': 10000, 'margin_ratio': 25, 'b_top_off_equity': True}, {'stop_loss_gen': (8, 9, 1)},
+     {'stop_loss': 8}),
+], ids=['signal', 'equity', 'stop_loss_top_off'])
+def test_positions_match_one_portfolio(df_ohlc, portfolio, trading, settings):
+    wf = walk_forward(df_ohlc, portfolio, trading)
+    windows = wf.windows()
+    df_windows, df_positions = wf.run()
+
+    first, last = windows[0][2], windows[-1][3]
+    signals = StrategyMACross(INSTRUMENT, df_ohlc, periods=(5, 20)).generate_signals().iloc[first:last]
+    signals['next_close'] = signals['close'].shift(-1)
+    expected = Portfolio(INSTRUMENT, df_ohlc, signals, **portfolio, **settings).generate_positions()
+    pd.testing.assert_frame_equal(expected.reset_index(drop=True), df_positions.drop(columns='window'))
+
+    # Some trades are carried over a window edge, each belongs to the window it was opened in
+    out_starts = df_ohlc.index[[window[2] for window in windows]]
+    opened_in = out_starts.searchsorted(df_positions['date_opened'], side='right') - 1
+    closed_in = out_starts.searchsorted(df_positions['date_closed'], side='right') - 1
+    assert (closed_in > opened_in).any()
+    assert (df_positions['window'].to_numpy() == opened_in).all()
+    assert df_windows['trades'].sum() == len(df_positions)
+    if 'initial_equity' in portfolio:
+        assert df_windows['equity'].iat[-1] == df_positions['equity'].iat[-1]
+
+
+def test_window_without_trades_keeps_equity(df_ohlc):
+    # Flat prices in the second out-of-sample window leave it without a trade opened
+    df = df_ohlc.copy()
+    wf = walk_forward(df, {'initial_equity': 10000, 'margin_ratio': 25})
+    _, _, out_start, out_stop = wf.windows()[1]
+    df.iloc[out_start - 30:out_stop, :4] = df['Close'].iat[out_start - 30]
+    df_windows, df_positions = walk_forward(df, {'initial_equity': 10000, 'margin_ratio': 25}).run()
+
+    assert df_windows['trades'].iat[1] == 0
+    assert df_windows['equity'].iat[1] == df_windows['equity'].iat[0]
+    assert 1 not in set(df_positions['window'])